@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, g
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import os
@@ -6,17 +6,27 @@ import json
 import logging
 from datetime import datetime, timedelta
 
+import click
+
+from database.init_db import init_db
+from database.update_db import update_db_schema
+
 # Import modules
 from modules.user import UserProfile
-from modules.content import ContentModule
+from modules.content import ContentModule, LEARNING_STYLES
 from modules.assessment import AssessmentEngine
 from modules.adaptation import AdaptationEngine
+from modules.db import get_connection
+from modules.dashboard import DashboardService
+from modules.memo import begin_request_memo, end_request_memo
+from modules.auth import is_admin, admin_required, admin_api_required, ADMIN_CLAIM_KEY
+from modules.content_index import content_index
+from modules.prerequisites import MASTERY_THRESHOLD
+from modules.path_planner import path_planner
 
-from modules.predictive_analytics import PredictiveAnalytics
-from modules.content_recommendation import ContentRecommendation
-from modules.learning_style_detection import LearningStyleDetection
 from modules.ai_api import ai_api
 from modules.content_adaptation import ContentAdaptation
+from modules.adaptation_queue import adaptation_queue
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -29,37 +39,35 @@ app.secret_key = os.urandom(24)
 # Register blueprint
 app.register_blueprint(ai_api)
 
-# Initialize database connection
+# Feature extraction and similar per-user lookups are memoized for the
+# duration of a request, so panels computed in the same request share them
+@app.before_request
+def start_request_memo():
+    g.request_memo_token = begin_request_memo()
+
+@app.teardown_request
+def finish_request_memo(exc):
+    token = g.pop('request_memo_token', None)
+    if token is not None:
+        end_request_memo(token)
+
+# Initialize database connection (pooled; close() returns it to the pool)
 def get_db_connection():
-    conn = sqlite3.connect('database/adaptive_learning.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_connection()
 
 # Initialize core components
 user_profile = UserProfile()
 content_module = ContentModule()
 assessment_engine = AssessmentEngine()
 adaptation_engine = AdaptationEngine()
-
-# Initialize AI components
-predictive_analytics = PredictiveAnalytics()
-content_recommendation = ContentRecommendation()
-learning_style_detection = LearningStyleDetection()
+dashboard_service = DashboardService()
 
 # Routes
 
 
-def is_admin(user_id):
-    """Check if a user has admin privileges"""
-    conn = get_db_connection()
-    user = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
-    
-    return user and user['is_admin'] == 1
-
 @app.context_processor
 def inject_is_admin():
-    """Add is_admin flag to all templates"""
+    """Add is_admin flag to all templates (cached in the session, see modules.auth)"""
     if 'user_id' in session:
         return {'is_admin': is_admin(session['user_id'])}
     return {'is_admin': False}
@@ -142,6 +150,7 @@ def logout():
     """User logout route"""
     session.pop('user_id', None)
     session.pop('username', None)
+    session.pop(ADMIN_CLAIM_KEY, None)
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
@@ -152,65 +161,61 @@ def dashboard():
     
     user_id = session['user_id']
     
-    # Get user profile data
-    profile_data = user_profile.get_profile(user_id)
-    
-    # Get recommended content - using traditional method first for safety
-    recommended_content = adaptation_engine.get_recommendations(user_id)
+    # Profile, recommendations, AI insights and progress are independent, so they
+    # are computed concurrently; failed or slow parts fall back to safe defaults
+    data, timings = dashboard_service.get_dashboard_data(user_id)
     
-    # Try to get AI-powered features, but gracefully handle errors
-    learning_style = None
-    risk_assessment = None
-    performance_prediction = None
-    
-    try:
-        # Get AI-enhanced learning style
-        learning_style = learning_style_detection.detect_learning_style(user_id)
-        profile_data['learning_style'] = learning_style
-    except Exception as e:
-        logger.error(f"Error getting learning style: {e}")
-        # Use default learning style
-        profile_data['learning_style'] = {
-            'style': 'visual',
-            'confidence': 0.5,
-            'description': 'Default learning style (AI not yet available)'
-        }
+    response = make_response(render_template('dashboard.html', 
+                          username=session['username'],
+                          profile=data['profile'],
+                          recommended_content=data['recommendations'],
+                          progress=data['progress'],
+                          risk_assessment=data['risk_assessment'],
+                          performance_prediction=data['performance_prediction']))
+    response.headers['Server-Timing'] = DashboardService.server_timing_header(timings)
+    return response
+
+@app.route('/api/dashboard/bundle')
+def dashboard_bundle():
+    """API endpoint returning all AI dashboard panels in a single response"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
     
-    try:
-        # Get disengagement risk assessment
-        risk_assessment = predictive_analytics.predict_disengagement_risk(user_id)
-    except Exception as e:
-        logger.error(f"Error getting risk assessment: {e}")
-        # Use default risk assessment
-        risk_assessment = {
-            'disengagement_risk': 'low',
-            'reason': 'Not enough data for analysis',
-            'intervention': None
-        }
+    bundle, timings = dashboard_service.get_analytics_bundle(session['user_id'])
+    bundle['timestamp'] = datetime.now().isoformat()
     
+    response = jsonify(bundle)
+    response.headers['Server-Timing'] = DashboardService.server_timing_header(timings)
+    return response
+
+
+def presentation_style(user_id):
+    """
+    Learning style to present content in: the one chosen in settings, else the
+    one last detected for the user (stored by detect_learning_style, e.g. on the
+    dashboard). Never runs the detection model, so page views stay cheap; None
+    leaves content unstyled.
+    """
+    conn = get_db_connection()
     try:
-        # Get predicted performance
-        performance_prediction = predictive_analytics.predict_performance(user_id)
-    except Exception as e:
-        logger.error(f"Error getting performance prediction: {e}")
-        # Use default prediction
-        performance_prediction = {
-            'predicted_performance': 0.75,
-            'confidence': 0.5,
-            'features_importance': {}
-        }
-    
-    # Get progress metrics
-    progress = user_profile.get_progress_metrics(user_id)
+        preferences = conn.execute(
+            'SELECT learning_style, detected_learning_style FROM user_preferences WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        # Schema not updated yet (run database/update_db.py)
+        logger.warning(f"Detected learning styles unavailable: {e}")
+        preferences = None
+    finally:
+        conn.close()
     
-    return render_template('dashboard.html', 
-                          username=session['username'],
-                          profile=profile_data,
-                          recommended_content=recommended_content,
-                          progress=progress,
-                          risk_assessment=risk_assessment,
-                          performance_prediction=performance_prediction)
-
+    if not preferences:
+        return None
+    if preferences['learning_style'] in LEARNING_STYLES:
+        return {'style': preferences['learning_style']}
+    if preferences['detected_learning_style']:
+        return {'style': preferences['detected_learning_style']}
+    return None
 
 @app.route('/learning/<content_id>')
 def learning_content(content_id):
@@ -228,7 +233,7 @@ def learning_content(content_id):
     # Get original content first (needed regardless of adaptation)
     original_content = content_module.get_content(content_id)
     
-    # Try to get previously adapted content - do this first
+    # Serve previously adapted content if it has been generated
     adapted_content_obj = content_adaptation.get_adapted_content(user_id, content_id)
     
     if adapted_content_obj:
@@ -241,82 +246,14 @@ def learning_content(content_id):
         content['adaptation_reason'] = adapted_content_obj.get('adaptation_reason', 'Customized for your learning needs')
         logger.info(f"Using adapted content with {len(content['content_data'].get('sections', []))} sections")
     else:
-        # Check if we need to create adapted content
-        needs_adaptation = assessment_engine.check_needs_adapted_content(user_id, content_id)
-        logger.info(f"User {user_id} needs adaptation for content {content_id}: {needs_adaptation}")
-        
-        if needs_adaptation:
-            logger.info("No adapted content found, generating new adaptation")
-            # No adapted content exists, create it using the last assessment results
-            conn = get_db_connection()
-            try:
-                # Get the most recent assessment responses for this content
-                last_assessment = conn.execute(
-                    '''
-                    SELECT ur.user_response, ur.is_correct, ai.id as question_id, 
-                           ai.knowledge_component_id, ai.correct_answer, ai.explanation
-                    FROM user_responses ur
-                    JOIN assessment_items ai ON ur.assessment_item_id = ai.id
-                    JOIN content_knowledge_map ckm ON ai.knowledge_component_id = ckm.knowledge_component_id
-                    WHERE ur.user_id = ? AND ckm.content_id = ?
-                    ORDER BY ur.timestamp DESC
-                    LIMIT 5
-                    ''',
-                    (user_id, content_id)
-                ).fetchall()
-                
-                # Format assessment results for the adaptation function
-                assessment_results = {
-                    'questions': [
-                        {
-                            'question_id': row['question_id'],
-                            'is_correct': bool(row['is_correct']),
-                            'correct_answer': row['correct_answer'],
-                            'explanation': row['explanation'],
-                            'knowledge_component_id': row['knowledge_component_id']
-                        }
-                        for row in last_assessment
-                    ],
-                    'total_score': 0.0,  # Assume failed assessment
-                    'mastery_achieved': False
-                }
-                
-                # If we have assessment results, use them
-                if assessment_results['questions']:
-                    logger.info(f"Creating adapted content with {len(assessment_results['questions'])} questions")
-                    # Create adapted content
-                    adapted_content_obj = content_adaptation.adapt_content_for_struggling_student(
-                        user_id, content_id, assessment_results
-                    )
-                    
-                    # Store the adapted content for future use
-                    if adapted_content_obj:
-                        logger.info("Successfully created adapted content, storing it")
-                        content_adaptation.store_adapted_content(user_id, adapted_content_obj)
-                        
-                        # Mark adaptation as provided
-                        assessment_engine.mark_adaptation_provided(user_id, content_id)
-                        
-                        # Use the newly created adapted content
-                        content = dict(original_content)
-                        content['title'] = adapted_content_obj['title']
-                        content['content_data'] = adapted_content_obj['content_data']
-                        content['is_adapted'] = True
-                        content['adaptation_reason'] = adapted_content_obj.get('adaptation_reason', 'Customized for your learning needs')
-                    else:
-                        logger.error("Failed to create adapted content")
-                        content = original_content
-                else:
-                    logger.warning("No assessment results found for adaptation")
-                    content = original_content
-            except Exception as e:
-                logger.error(f"Error creating adapted content: {e}", exc_info=True)
-                content = original_content
-            finally:
-                conn.close()
+        # Not ready yet: serve the original (its prepared variant for the user's
+        # learning style) and generate the adaptation in the background from
+        # the last assessment results
+        content = content_module.format_content_for_style(original_content, presentation_style(user_id))
+        if original_content and assessment_engine.check_needs_adapted_content(user_id, content_id):
+            logger.info(f"Queueing adapted content for user {user_id}, content {content_id}")
+            adaptation_queue.submit(user_id, content_id)
         else:
-            # No adaptation needed, use regular content
-            content = original_content
             logger.info("Using original content (no adaptation needed)")
     
     # Log that user has started this content
@@ -345,6 +282,51 @@ def assessment(content_id):
                           content_id=content_id,
                           username=session['username'])
 
+@app.route('/api/assessment/<content_id>/next-question', methods=['POST'])
+def next_assessment_question(content_id):
+    """API endpoint for adaptive (CAT) assessments: returns the next question given the answers so far"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    responses = data.get('responses', [])
+    if not isinstance(responses, list):
+        return jsonify({'error': 'responses must be a list'}), 400
+    
+    return jsonify(assessment_engine.next_adaptive_question(content_id, responses))
+
+@app.route('/api/content/unlocked')
+def unlocked_content():
+    """API endpoint for the content the user is ready for (all prerequisites mastered)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    include_mastered = request.args.get('include_mastered', 'false').lower() == 'true'
+    return jsonify({'content': content_module.get_unlocked_content(session['user_id'], include_mastered)})
+
+@app.route('/api/learning-plan')
+def learning_plan():
+    """API endpoint for the planned study sequence that takes the user to a target mastery"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    try:
+        goal_kcs = [int(kc_id) for kc_id in request.args.get('goal', '').split(',') if kc_id.strip()] or None
+        target = float(request.args.get('target', MASTERY_THRESHOLD))
+    except ValueError:
+        return jsonify({'error': 'goal must be knowledge component IDs and target a number'}), 400
+    if not 0.0 < target <= 1.0:
+        return jsonify({'error': 'target must be between 0 and 1'}), 400
+    
+    # Served from the nightly learning_plans batch when still current
+    plan = path_planner.plan_for_user(session['user_id'], goal_kcs, target)
+    plan['content'] = [
+        {'id': content_id, 'title': content['title'], 'difficulty': content['difficulty']}
+        for content_id, content in ((content_id, content_index.get(content_id)) for content_id in plan['content_ids'])
+        if content
+    ]
+    return jsonify(plan)
+
 # Updated API endpoint for assessment submission - add to app.py
 
 @app.route('/api/submit-assessment', methods=['POST'])
@@ -364,7 +346,6 @@ def submit_assessment():
         assessment_engine = AssessmentEngine()
         user_profile = UserProfile()
         adaptation_engine = AdaptationEngine()
-        content_adaptation = ContentAdaptation()
         
         # Process the assessment
         results = assessment_engine.evaluate_assessment(user_id, content_id, responses)
@@ -375,31 +356,18 @@ def submit_assessment():
         # Get next content recommendation
         next_content = adaptation_engine.get_next_content(user_id, content_id, results)
         
-        # Enhance response with adaptation information if needed
+        # Generate adapted content in the background; the learning page serves
+        # it once stored
         if results.get('needs_adaptation', False):
             try:
-                # Create adapted content for future use
-                adapted_content = content_adaptation.adapt_content_for_struggling_student(
-                    user_id, content_id, results
+                adaptation_queue.submit(user_id, content_id, results)
+                results['adaptation_available'] = True
+                results['adaptation_message'] = (
+                    "We're preparing a simplified version of this content tailored to your learning needs. "
+                    "Review the areas you struggled with before trying the assessment again."
                 )
-                
-                if adapted_content:
-                    # Store the adapted content
-                    adapted_id = content_adaptation.store_adapted_content(user_id, adapted_content)
-                    
-                    # Mark that adaptation has been provided
-                    assessment_engine.mark_adaptation_provided(user_id, content_id)
-                    
-                    # Add adaptation info to results
-                    results['adaptation_available'] = True
-                    results['adaptation_message'] = (
-                        "We've prepared a simplified version of this content tailored to your learning needs. "
-                        "Review the areas you struggled with before trying the assessment again."
-                    )
-                else:
-                    results['adaptation_available'] = False
             except Exception as e:
-                logger.error(f"Error creating adapted content: {e}")
+                logger.error(f"Error queueing adapted content: {e}")
                 results['adaptation_available'] = False
         
         return jsonify({
@@ -854,18 +822,9 @@ def delete_account():
 
 
 @app.route('/admin')
+@admin_required
 def admin_dashboard():
     """Admin dashboard route"""
-    if 'user_id' not in session:
-        return redirect(url_for('index'))
-    
-    user_id = session['user_id']
-    
-    # Check if user is admin
-    if not is_admin(user_id):
-        flash("You don't have permission to access this page.")
-        return redirect(url_for('dashboard'))
-    
     # Get system stats
     conn = get_db_connection()
     
@@ -1078,11 +1037,9 @@ def admin_dashboard():
 
 # Admin API routes
 @app.route('/api/admin/users', methods=['GET'])
+@admin_api_required
 def api_admin_users():
     """API endpoint to get users list"""
-    if 'user_id' not in session or not is_admin(session['user_id']):
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     search = request.args.get('search', '')
@@ -1097,11 +1054,9 @@ def api_admin_users():
     })
 
 @app.route('/api/admin/content', methods=['GET'])
+@admin_api_required
 def api_admin_content():
     """API endpoint to get content list"""
-    if 'user_id' not in session or not is_admin(session['user_id']):
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     # Implementation would fetch content with filters
     # This is a placeholder
     
@@ -1112,11 +1067,9 @@ def api_admin_content():
     })
 
 @app.route('/api/admin/assessment', methods=['GET'])
+@admin_api_required
 def api_admin_assessment():
     """API endpoint to get assessment items"""
-    if 'user_id' not in session or not is_admin(session['user_id']):
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     # Implementation would fetch assessment items with filters
     # This is a placeholder
     
@@ -1127,11 +1080,9 @@ def api_admin_assessment():
     })
 
 @app.route('/api/admin/analytics', methods=['GET'])
+@admin_api_required
 def api_admin_analytics():
     """API endpoint to get analytics data"""
-    if 'user_id' not in session or not is_admin(session['user_id']):
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     date_range = request.args.get('date_range', '30')
     group_by = request.args.get('group_by', 'day')
     
@@ -1146,11 +1097,9 @@ def api_admin_analytics():
     })
 
 @app.route('/api/admin/settings', methods=['POST'])
+@admin_api_required
 def api_admin_settings():
     """API endpoint to update system settings"""
-    if 'user_id' not in session or not is_admin(session['user_id']):
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     data = request.get_json()
     
     # Implementation would update system settings in database
@@ -1160,18 +1109,9 @@ def api_admin_settings():
 
 
 @app.route('/admin/ai-dashboard')
+@admin_required
 def ai_dashboard():
     """AI System dashboard for administrators"""
-    if 'user_id' not in session:
-        return redirect(url_for('index'))
-    
-    user_id = session['user_id']
-    
-    # Check if user is admin
-    if not is_admin(user_id):
-        flash("You don't have permission to access this page.")
-        return redirect(url_for('dashboard'))
-    
     # Get AI system statistics
     ai_stats = {
         'models_count': 4,  # Number of ML models
@@ -1359,11 +1299,35 @@ def page_not_found(e):
 def internal_server_error(e):
     return render_template('500.html'), 500
 
-if __name__ == '__main__':
-    # Check if database exists, if not initialize it
-    if not os.path.exists('database/adaptive_learning.db'):
-        from database.init_db import init_db
+# Database setup
+# Schema updates run once per deploy (`flask --app app update-db`) rather than
+# on import: workers booting together would race to create the same tables
+def database_initialized(db_path='database/adaptive_learning.db'):
+    """Whether the base schema exists (an empty file is left by connecting to a missing database)"""
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='users'").fetchone() is not None
+    finally:
+        conn.close()
+
+def setup_database():
+    """Create the database if it doesn't exist and apply schema updates"""
+    if not database_initialized():
         init_db()
+    return update_db_schema()
+
+@app.cli.command('update-db')
+def update_db_command():
+    """Create the database if needed and apply schema updates"""
+    if not setup_database():
+        raise click.ClickException("Database schema update failed; see the log for details")
 
+if __name__ == '__main__':
+    # Create or update the database before serving
+    if not setup_database():
+        raise SystemExit("Database schema update failed; see the log for details")
+    
     # Start the Flask app
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Libraries that should only be imported once a request actually needs them
+HEAVY_MODULES = ['sklearn', 'pandas', 'matplotlib', 'matplotlib.pyplot', 'nltk', 'joblib', 'scipy']
+
+# Run in a fresh interpreter so every sample is a cold worker boot
+CHILD_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'import_seconds': elapsed,
+    'heavy_modules': [m for m in %r if m in sys.modules]
+}))
+''' % (HEAVY_MODULES,)
+
+def measure_startup(runs=5):
+    """
+    Measure how long it takes a fresh worker to import the Flask app.
+    
+    Args:
+        runs: Number of cold-start samples to take
+        
+    Returns:
+        Dictionary with per-run timings, summary statistics and the heavy
+        libraries that were loaded at import time
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    
+    timings = []
+    heavy_modules = []
+    
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT],
+            cwd=project_root,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout
+        
+        # The app logs to stdout as well; the JSON summary is the last line
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result['import_seconds'])
+        heavy_modules = result['heavy_modules']
+    
+    return {
+        'runs': runs,
+        'timings': timings,
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'max_seconds': max(timings),
+        'heavy_modules_at_startup': heavy_modules
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark cold import time of the Flask app')
+    parser.add_argument('--runs', type=int, default=5, help='number of cold starts to sample')
+    args = parser.parse_args()
+    
+    report = measure_startup(args.runs)
+    
+    print(f"Cold import of app.py over {report['runs']} runs:")
+    print(f"  median: {report['median_seconds'] * 1000:.1f} ms")
+    print(f"  min:    {report['min_seconds'] * 1000:.1f} ms")
+    print(f"  max:    {report['max_seconds'] * 1000:.1f} ms")
+    if report['heavy_modules_at_startup']:
+        print(f"  heavy libraries loaded at startup: {', '.join(report['heavy_modules_at_startup'])}")
+    else:
+        print("  heavy libraries loaded at startup: none")
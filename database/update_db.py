@@ -1,5 +1,8 @@
 import sqlite3
 import os
+import json
+import zlib
+import hashlib
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -65,6 +68,285 @@ def update_db_schema():
         else:
             logger.info("assessment_failures table already exists")
         
+        # Unique key so assessment failures can be written with a single UPSERT.
+        # Merge any duplicate rows (older code could race) into the newest one first.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_assessment_failures_user_content'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            UPDATE assessment_failures
+            SET failure_count = (
+                SELECT SUM(af.failure_count)
+                FROM assessment_failures af
+                WHERE af.user_id = assessment_failures.user_id
+                  AND af.content_id = assessment_failures.content_id
+            )
+            WHERE id IN (
+                SELECT MAX(id) FROM assessment_failures
+                GROUP BY user_id, content_id
+                HAVING COUNT(*) > 1
+            )
+            ''')
+            cursor.execute('''
+            DELETE FROM assessment_failures
+            WHERE id NOT IN (
+                SELECT MAX(id) FROM assessment_failures
+                GROUP BY user_id, content_id
+            )
+            ''')
+            cursor.execute('''
+            CREATE UNIQUE INDEX idx_assessment_failures_user_content
+            ON assessment_failures (user_id, content_id)
+            ''')
+            logger.info("Created unique index on assessment_failures (user_id, content_id)")
+        else:
+            logger.info("assessment_failures unique index already exists")
+        
+        # Unique key for knowledge state so mastery updates can be UPSERTs.
+        # Keep the most recently written row if duplicates exist.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_user_knowledge_state_user_kc'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            DELETE FROM user_knowledge_state
+            WHERE id NOT IN (
+                SELECT MAX(id) FROM user_knowledge_state
+                GROUP BY user_id, knowledge_component_id
+            )
+            ''')
+            cursor.execute('''
+            CREATE UNIQUE INDEX idx_user_knowledge_state_user_kc
+            ON user_knowledge_state (user_id, knowledge_component_id)
+            ''')
+            logger.info("Created unique index on user_knowledge_state (user_id, knowledge_component_id)")
+        else:
+            logger.info("user_knowledge_state unique index already exists")
+        
+        # Fitted knowledge tracing parameters (written by modules/knowledge_tracing_fit.py)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='kc_parameters'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE kc_parameters (
+                knowledge_component_id INTEGER PRIMARY KEY,
+                p_init REAL NOT NULL,
+                p_learn REAL NOT NULL,
+                p_slip REAL NOT NULL,
+                p_guess REAL NOT NULL,
+                log_likelihood REAL,
+                response_count INTEGER NOT NULL,
+                fitted_at TIMESTAMP NOT NULL,
+                FOREIGN KEY (knowledge_component_id) REFERENCES knowledge_components (id)
+            )
+            ''')
+            logger.info("Created kc_parameters table")
+        else:
+            logger.info("kc_parameters table already exists")
+        
+        # Lets per-user history reads (and the fitting pipeline) scan responses in time order
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_responses_user_time
+        ON user_responses (user_id, timestamp)
+        ''')
+        
+        # Calibrated 2PL item parameters (written by modules/irt.py)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='irt_item_parameters'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE irt_item_parameters (
+                assessment_item_id INTEGER PRIMARY KEY,
+                discrimination REAL NOT NULL,
+                difficulty REAL NOT NULL,
+                response_count INTEGER NOT NULL,
+                calibrated_at TIMESTAMP NOT NULL,
+                FOREIGN KEY (assessment_item_id) REFERENCES assessment_items (id)
+            )
+            ''')
+            logger.info("Created irt_item_parameters table")
+        else:
+            logger.info("irt_item_parameters table already exists")
+        
+        # Normalized content tags (one row per tag) so tag filters use an index
+        # instead of LIKE scans over the comma-separated content.tags
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='content_tags'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE content_tags (
+                content_id INTEGER NOT NULL,
+                tag TEXT NOT NULL,
+                PRIMARY KEY (content_id, tag),
+                FOREIGN KEY (content_id) REFERENCES content (id)
+            )
+            ''')
+            cursor.execute('CREATE INDEX idx_content_tags_tag ON content_tags (tag, content_id)')
+            
+            # Backfill from content.tags, normalized the same way as modules/content_index.py
+            rows = cursor.execute('SELECT id, tags FROM content WHERE tags IS NOT NULL').fetchall()
+            cursor.executemany(
+                'INSERT OR IGNORE INTO content_tags (content_id, tag) VALUES (?, ?)',
+                [
+                    (content_id, tag.strip().lower())
+                    for content_id, tags in rows
+                    for tag in tags.split(',')
+                    if tag.strip()
+                ]
+            )
+            logger.info("Created content_tags table")
+        else:
+            logger.info("content_tags table already exists")
+        
+        # Precomputed nearest neighbours by mastery vector (written by modules/user_similarity.py)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_neighbours'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE user_neighbours (
+                user_id INTEGER NOT NULL,
+                rank INTEGER NOT NULL,
+                neighbour_id INTEGER NOT NULL,
+                similarity REAL NOT NULL,
+                PRIMARY KEY (user_id, rank),
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (neighbour_id) REFERENCES users (id)
+            )
+            ''')
+            # Finds the lists a changed user appears in during incremental refreshes
+            cursor.execute('CREATE INDEX idx_user_neighbours_neighbour ON user_neighbours (neighbour_id)')
+            cursor.execute('''
+            CREATE TABLE user_neighbour_state (
+                user_id INTEGER PRIMARY KEY,
+                computed_at TIMESTAMP NOT NULL,
+                kth_similarity REAL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''')
+            logger.info("Created user_neighbours tables")
+        else:
+            logger.info("user_neighbours tables already exist")
+        
+        # Nightly planned study sequences per user and goal (written by modules/path_planner.py)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='learning_plans'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE learning_plans (
+                user_id INTEGER NOT NULL,
+                goal TEXT NOT NULL,
+                content_ids TEXT NOT NULL,
+                estimated_cost REAL NOT NULL,
+                unreachable_kcs TEXT NOT NULL,
+                planned_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (user_id, goal),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''')
+            logger.info("Created learning_plans table")
+        else:
+            logger.info("learning_plans table already exists")
+        
+        # Adapted content sections stored once as zlib-compressed, content-addressed
+        # blobs; adapted_content rows keep a small manifest (storage_version 2)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='adapted_content_blobs'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE adapted_content_blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL
+            )
+            ''')
+            logger.info("Created adapted_content_blobs table")
+        else:
+            logger.info("adapted_content_blobs table already exists")
+        
+        cursor.execute("PRAGMA table_info(adapted_content)")
+        if 'storage_version' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE adapted_content ADD COLUMN storage_version INTEGER NOT NULL DEFAULT 1')
+            logger.info("Added storage_version column to adapted_content")
+        
+        # Convert full JSON rows, split the same way as modules/adapted_storage.py
+        rows = cursor.execute('SELECT id, adapted_content FROM adapted_content WHERE storage_version = 1').fetchall()
+        converted = 0
+        for adapted_id, adapted_json in rows:
+            try:
+                adapted_content = json.loads(adapted_json)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable adapted content {adapted_id}")
+                continue
+            content_data = dict(adapted_content.get('content_data') or {})
+            section_hashes = []
+            for section in content_data.pop('sections', []):
+                data = json.dumps(section, sort_keys=True, separators=(',', ':')).encode('utf-8')
+                digest = hashlib.sha256(data).hexdigest()
+                cursor.execute(
+                    'INSERT OR IGNORE INTO adapted_content_blobs (hash, data, size) VALUES (?, ?, ?)',
+                    (digest, zlib.compress(data, 6), len(data))
+                )
+                section_hashes.append(digest)
+            manifest = {key: value for key, value in adapted_content.items() if key not in ('content_data', 'id')}
+            manifest['content_fields'] = content_data
+            manifest['section_hashes'] = section_hashes
+            cursor.execute(
+                'UPDATE adapted_content SET adapted_content = ?, storage_version = 2 WHERE id = ?',
+                (json.dumps(manifest), adapted_id)
+            )
+            converted += 1
+        if converted:
+            logger.info(f"Converted {converted} adapted content rows to section blobs")
+        
+        # Content version, bumped on every edit, so caches of derived content
+        # (e.g. adapted bodies in modules/content_adaptation.py) can key on it
+        cursor.execute("PRAGMA table_info(content)")
+        if 'version' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE content ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            logger.info("Added version column to content")
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_content_version
+        AFTER UPDATE OF title, description, content_type, difficulty, content_data ON content
+        BEGIN
+            UPDATE content SET version = OLD.version + 1 WHERE id = NEW.id;
+        END
+        ''')
+        
+        # Pointer to the adaptation served for each (user, content), so lookups
+        # don't sort through every version (maintained by modules/adapted_storage.py)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='current_adapted_content'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+            CREATE TABLE current_adapted_content (
+                user_id INTEGER NOT NULL,
+                original_content_id INTEGER NOT NULL,
+                adapted_content_id INTEGER NOT NULL,
+                updated_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (user_id, original_content_id),
+                FOREIGN KEY (adapted_content_id) REFERENCES adapted_content (id)
+            )
+            ''')
+            cursor.execute('''
+            INSERT INTO current_adapted_content (user_id, original_content_id, adapted_content_id, updated_at)
+            SELECT user_id, original_content_id, id, created_at
+            FROM (
+                SELECT id, user_id, original_content_id, created_at, ROW_NUMBER() OVER (
+                    PARTITION BY user_id, original_content_id
+                    ORDER BY created_at DESC, id DESC
+                ) AS version_rank
+                FROM adapted_content
+            )
+            WHERE version_rank = 1
+            ''')
+            logger.info("Created current_adapted_content table")
+        else:
+            logger.info("current_adapted_content table already exists")
+        
+        # Lets retention pruning find a pair's versions newest first
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_adapted_content_user_content
+        ON adapted_content (user_id, original_content_id, created_at)
+        ''')
+        
+        # Style last detected by modules/learning_style_detection.py, used to
+        # present content to users whose learning_style is 'auto'
+        cursor.execute("PRAGMA table_info(user_preferences)")
+        if 'detected_learning_style' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE user_preferences ADD COLUMN detected_learning_style TEXT')
+            logger.info("Added detected_learning_style column to user_preferences")
+        
         # Commit the changes
         conn.commit()
         
@@ -79,6 +361,56 @@ def update_db_schema():
             logger.error("Failed to create assessment_failures table!")
             return False
         
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_assessment_failures_user_content'")
+        if not cursor.fetchone():
+            logger.error("Failed to create assessment_failures unique index!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_user_knowledge_state_user_kc'")
+        if not cursor.fetchone():
+            logger.error("Failed to create user_knowledge_state unique index!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='kc_parameters'")
+        if not cursor.fetchone():
+            logger.error("Failed to create kc_parameters table!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='irt_item_parameters'")
+        if not cursor.fetchone():
+            logger.error("Failed to create irt_item_parameters table!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='content_tags'")
+        if not cursor.fetchone():
+            logger.error("Failed to create content_tags table!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_neighbour_state'")
+        if not cursor.fetchone():
+            logger.error("Failed to create user_neighbours tables!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='learning_plans'")
+        if not cursor.fetchone():
+            logger.error("Failed to create learning_plans table!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='adapted_content_blobs'")
+        if not cursor.fetchone():
+            logger.error("Failed to create adapted_content_blobs table!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name='trg_content_version'")
+        if not cursor.fetchone():
+            logger.error("Failed to create content version trigger!")
+            return False
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='current_adapted_content'")
+        if not cursor.fetchone():
+            logger.error("Failed to create current_adapted_content table!")
+            return False
+        
         logger.info("Database schema update complete!")
         return True
         
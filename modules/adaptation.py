@@ -1,8 +1,13 @@
-import sqlite3
 import json
 import logging
+import random
 import numpy as np
 from datetime import datetime, timedelta
+from modules.db import get_connection
+from modules.content_index import content_index
+from modules.learning_paths import learning_path_index
+from modules.collaborative_filtering import cf_model
+from modules.user_similarity import get_neighbours
 
 logger = logging.getLogger(__name__)
 
@@ -18,10 +23,8 @@ class AdaptationEngine:
         self.db_path = 'database/adaptive_learning.db'
     
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
     def get_recommendations(self, user_id):
         """
@@ -29,8 +32,8 @@ class AdaptationEngine:
         """
         # First, try to use the AI-powered recommendation system
         try:
-            from modules.content_recommendation import ContentRecommendation
-            recommender = ContentRecommendation()
+            from modules.registry import get_content_recommendation
+            recommender = get_content_recommendation()
             ai_recommendations = recommender.get_diverse_recommendations(user_id)
             
             if ai_recommendations and len(ai_recommendations) >= 3:
@@ -55,79 +58,69 @@ class AdaptationEngine:
         # Create a dictionary of component mastery levels
         mastery_levels = {ks['knowledge_component_id']: ks['mastery_level'] for ks in knowledge_state}
         
-        # Get user's current learning path progress
-        learning_path = conn.execute(
+        # Next item of the user's current (most recently started, unfinished) learning path
+        user_paths = conn.execute(
             '''
-            SELECT lp.id, ulp.current_position
-            FROM user_learning_paths ulp
-            JOIN learning_paths lp ON ulp.learning_path_id = lp.id
-            WHERE ulp.user_id = ? AND ulp.completed = 0
-            ORDER BY ulp.started_at DESC
-            LIMIT 1
+            SELECT learning_path_id, current_position
+            FROM user_learning_paths
+            WHERE user_id = ? AND completed = 0
+            ORDER BY started_at DESC
             ''',
             (user_id,)
-        ).fetchone()
+        ).fetchall()
+        current_path = next((row for row in user_paths if learning_path_index.exists(row['learning_path_id'])), None)
+        next_in_path = None
+        if current_path:
+            next_in_path = learning_path_index.next_item(current_path['learning_path_id'],
+                                                         current_path['current_position'])
         
         recommendations = []
+        recommended_ids = set()
+        
+        def add(content_id, recommendation_type, relevance_score):
+            content = content_index.get(content_id)
+            if content and content_id not in recommended_ids:
+                recommended_ids.add(content_id)
+                recommendations.append(dict(
+                    content,
+                    recommendation_type=recommendation_type,
+                    relevance_score=relevance_score
+                ))
         
         # 1. Next content in learning path
-        if learning_path:
-            path_id = learning_path['id']
-            current_position = learning_path['current_position']
-            
-            next_in_path = conn.execute(
-                '''
-                SELECT lpi.content_id, c.title, c.description, c.difficulty, c.tags
-                FROM learning_path_items lpi
-                JOIN content c ON lpi.content_id = c.id
-                WHERE lpi.learning_path_id = ? AND lpi.sequence_order > ?
-                ORDER BY lpi.sequence_order
-                LIMIT 1
-                ''',
-                (path_id, current_position)
-            ).fetchone()
-            
-            if next_in_path:
-                recommendations.append({
-                    'content_id': next_in_path['content_id'],
-                    'title': next_in_path['title'],
-                    'description': next_in_path['description'],
-                    'difficulty': next_in_path['difficulty'],
-                    'tags': next_in_path['tags'].split(',') if next_in_path['tags'] else [],
-                    'recommendation_type': 'next_in_path',
-                    'relevance_score': 1.0  # Highest priority
-                })
+        if next_in_path:
+            add(next_in_path['content_id'], 'next_in_path', 1.0)  # Highest priority
         
         # 2. Content for knowledge components with low mastery
         weak_components = [(kc_id, mastery) for kc_id, mastery in mastery_levels.items() if mastery < 0.6]
         weak_components.sort(key=lambda x: x[1])  # Sort by mastery level (ascending)
-        
-        for kc_id, mastery in weak_components[:3]:  # Top 3 weak components
-            # Find content that targets this knowledge component
-            remedial_content = conn.execute(
-                '''
-                SELECT c.id, c.title, c.description, c.difficulty, c.tags
-                FROM content c
-                JOIN content_knowledge_map ckm ON c.id = ckm.content_id
-                WHERE ckm.knowledge_component_id = ?
-                ORDER BY c.difficulty ASC
-                LIMIT 1
+        weak_components = weak_components[:3]  # Top 3 weak components
+        
+        if weak_components:
+            # Easiest content targeting each weak component, all in one query
+            placeholders = ','.join('?' * len(weak_components))
+            easiest = conn.execute(
+                f'''
+                SELECT knowledge_component_id, content_id
+                FROM (
+                    SELECT ckm.knowledge_component_id, c.id AS content_id,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY ckm.knowledge_component_id
+                               ORDER BY c.difficulty ASC, c.id
+                           ) AS rank
+                    FROM content c
+                    JOIN content_knowledge_map ckm ON c.id = ckm.content_id
+                    WHERE ckm.knowledge_component_id IN ({placeholders})
+                )
+                WHERE rank = 1
                 ''',
-                (kc_id,)
-            ).fetchone()
+                [kc_id for kc_id, _ in weak_components]
+            ).fetchall()
+            remedial_by_kc = {row['knowledge_component_id']: row['content_id'] for row in easiest}
             
-            if remedial_content:
-                # Check if this content is already in recommendations
-                if not any(r['content_id'] == remedial_content['id'] for r in recommendations):
-                    recommendations.append({
-                        'content_id': remedial_content['id'],
-                        'title': remedial_content['title'],
-                        'description': remedial_content['description'],
-                        'difficulty': remedial_content['difficulty'],
-                        'tags': remedial_content['tags'].split(',') if remedial_content['tags'] else [],
-                        'recommendation_type': 'remedial',
-                        'relevance_score': 0.9 - mastery  # Higher for lower mastery
-                    })
+            for kc_id, mastery in weak_components:
+                if kc_id in remedial_by_kc:
+                    add(remedial_by_kc[kc_id], 'remedial', 0.9 - mastery)  # Higher for lower mastery
         
         # 3. Content similar to recently accessed (content-based filtering)
         recent_content = conn.execute(
@@ -141,51 +134,57 @@ class AdaptationEngine:
             (user_id,)
         ).fetchall()
         
-        recent_content_ids = [rc['content_id'] for rc in recent_content if rc['content_id']]
+        recent_content_ids = list(dict.fromkeys(rc['content_id'] for rc in recent_content if rc['content_id']))
         
-        if recent_content_ids:
-            # For simplicity, we'll just use tag similarity
-            # In a real system, use more sophisticated content-based similarity metrics
-            for content_id in recent_content_ids:
-                content_tags = conn.execute(
-                    'SELECT tags FROM content WHERE id = ?',
-                    (content_id,)
-                ).fetchone()
-                
-                if content_tags and content_tags['tags']:
-                    tags = content_tags['tags'].split(',')
-                    
-                    # Find content with similar tags
-                    tag_conditions = ' OR '.join(['tags LIKE ?' for _ in tags])
-                    tag_params = [f'%{tag}%' for tag in tags]
-                    
-                    similar_content = conn.execute(
-                        f'''
-                        SELECT id, title, description, difficulty, tags
-                        FROM content
-                        WHERE id != ? AND ({tag_conditions})
-                        ORDER BY RANDOM()
-                        LIMIT 2
-                        ''',
-                        [content_id] + tag_params
-                    ).fetchall()
-                    
-                    for sc in similar_content:
-                        if not any(r['content_id'] == sc['id'] for r in recommendations):
-                            recommendations.append({
-                                'content_id': sc['id'],
-                                'title': sc['title'],
-                                'description': sc['description'],
-                                'difficulty': sc['difficulty'],
-                                'tags': sc['tags'].split(',') if sc['tags'] else [],
-                                'recommendation_type': 'similar_content',
-                                'relevance_score': 0.7  # Medium priority
-                            })
-        
-        # 4. Collaborative filtering (users with similar performance patterns)
-        # This is a simplified version - a real implementation would use more sophisticated CF
+        # Two random items sharing a tag with each recent item (in-memory tag index)
+        for content_id in recent_content_ids:
+            content = content_index.get(content_id)
+            if content and content['tags']:
+                similar_ids = sorted(content_index.with_any_tag(content['tags']) - {content_id})
+                for similar_id in random.sample(similar_ids, min(2, len(similar_ids))):
+                    add(similar_id, 'similar_content', 0.7)  # Medium priority
+        
+        # 4. Collaborative filtering: matrix factorization scores for users the
+        # trained model knows, otherwise users with similar performance patterns
         if len(recommendations) < 5:
-            # Find users with similar knowledge states
+            if cf_model.has_user(user_id):
+                seen = conn.execute(
+                    '''
+                    SELECT DISTINCT content_id
+                    FROM user_interaction_log
+                    WHERE user_id = ? AND content_id IS NOT NULL
+                    ''',
+                    (user_id,)
+                ).fetchall()
+                exclude = {row['content_id'] for row in seen} | recommended_ids
+                collaborative_ids = [
+                    content_id for content_id, _ in cf_model.recommend(user_id, limit=5, exclude=exclude)
+                ]
+            else:
+                collaborative_ids = self._similar_user_content(conn, user_id, mastery_levels)
+            
+            for content_id in collaborative_ids:
+                add(content_id, 'collaborative', 0.6)  # Lower priority
+        
+        conn.close()
+        
+        # Sort by relevance score and limit to 5 recommendations
+        recommendations.sort(key=lambda x: x['relevance_score'], reverse=True)
+        return recommendations[:5]
+    
+    def _similar_user_content(self, conn, user_id, mastery_levels):
+        """
+        Content liked by the users most similar to this one (used when the
+        collaborative filtering model doesn't know the user)
+        
+        Returns:
+            List of content IDs the user hasn't interacted with, up to two per similar user
+        """
+        # Neighbours precomputed from mastery vectors (modules/user_similarity.py)
+        similar_user_ids = get_neighbours(conn, user_id, limit=5)
+        
+        if similar_user_ids is None:
+            # Not computed yet: users with the closest average mastery
             user_mastery_avg = sum(mastery_levels.values()) / len(mastery_levels) if mastery_levels else 0
             
             similar_users = conn.execute(
@@ -199,43 +198,44 @@ class AdaptationEngine:
                 ''',
                 (user_id, user_mastery_avg)
             ).fetchall()
-            
-            for similar_user in similar_users:
-                # Find content that this similar user has interacted with positively
-                positive_content = conn.execute(
-                    '''
-                    SELECT DISTINCT uil.content_id, c.title, c.description, c.difficulty, c.tags
-                    FROM user_interaction_log uil
-                    JOIN content c ON uil.content_id = c.id
-                    WHERE uil.user_id = ? 
-                      AND uil.interaction_type IN ('complete', 'like', 'bookmark')
-                      AND uil.content_id NOT IN (
-                          SELECT content_id 
-                          FROM user_interaction_log 
-                          WHERE user_id = ? AND content_id IS NOT NULL
-                      )
-                    LIMIT 2
-                    ''',
-                    (similar_user['user_id'], user_id)
-                ).fetchall()
-                
-                for pc in positive_content:
-                    if not any(r['content_id'] == pc['content_id'] for r in recommendations):
-                        recommendations.append({
-                            'content_id': pc['content_id'],
-                            'title': pc['title'],
-                            'description': pc['description'],
-                            'difficulty': pc['difficulty'],
-                            'tags': pc['tags'].split(',') if pc['tags'] else [],
-                            'recommendation_type': 'collaborative',
-                            'relevance_score': 0.6  # Lower priority
-                        })
+            similar_user_ids = [su['user_id'] for su in similar_users]
+        
+        if not similar_user_ids:
+            return []
+        
+        # Up to two items per similar user that they engaged with positively
+        # and this user hasn't seen; the exclusion subquery runs once
+        placeholders = ','.join('?' * len(similar_user_ids))
+        positive_content = conn.execute(
+            f'''
+            SELECT user_id, content_id
+            FROM (
+                SELECT uil.user_id, uil.content_id,
+                       ROW_NUMBER() OVER (PARTITION BY uil.user_id ORDER BY MIN(uil.id)) AS rank
+                FROM user_interaction_log uil
+                WHERE uil.user_id IN ({placeholders})
+                  AND uil.interaction_type IN ('complete', 'like', 'bookmark')
+                  AND uil.content_id NOT IN (
+                      SELECT content_id
+                      FROM user_interaction_log
+                      WHERE user_id = ? AND content_id IS NOT NULL
+                  )
+                GROUP BY uil.user_id, uil.content_id
+            )
+            WHERE rank <= 2
+            ''',
+            similar_user_ids + [user_id]
+        ).fetchall()
         
-        conn.close()
+        content_by_user = {}
+        for row in positive_content:
+            content_by_user.setdefault(row['user_id'], []).append(row['content_id'])
         
-        # Sort by relevance score and limit to 5 recommendations
-        recommendations.sort(key=lambda x: x['relevance_score'], reverse=True)
-        return recommendations[:5]
+        return [
+            content_id
+            for similar_user_id in similar_user_ids
+            for content_id in content_by_user.get(similar_user_id, [])
+        ]
     
     def get_next_content(self, user_id, current_content_id, assessment_results=None):
         """
@@ -244,9 +244,6 @@ class AdaptationEngine:
         """
         # Try to use ML-enhanced recommendation first
         try:
-            from modules.predictive_analytics import PredictiveAnalytics
-            predictor = PredictiveAnalytics()
-            
             # If we have assessment results and they indicate poor performance
             if assessment_results and not assessment_results.get('mastery_achieved', False):
                 # Get knowledge gaps and provide targeted content
@@ -256,8 +253,8 @@ class AdaptationEngine:
                 
                 if knowledge_gaps:
                     # Use the content recommendation system to find content for the top gap
-                    from modules.content_recommendation import ContentRecommendation
-                    recommender = ContentRecommendation()
+                    from modules.registry import get_content_recommendation
+                    recommender = get_content_recommendation()
                     gap_recommendations = recommender.recommend_for_knowledge_gaps(user_id, limit=1)
                     
                     if gap_recommendations:
@@ -275,16 +272,14 @@ class AdaptationEngine:
         conn = self.get_db_connection()
         
         # Get current learning path
-        learning_path = conn.execute(
-            '''
-            SELECT ulp.id, ulp.learning_path_id, ulp.current_position
-            FROM user_learning_paths ulp
-            JOIN learning_path_items lpi ON ulp.learning_path_id = lpi.learning_path_id
-            WHERE ulp.user_id = ? AND lpi.content_id = ?
-            LIMIT 1
-            ''',
-            (user_id, current_content_id)
-        ).fetchone()
+        user_paths = conn.execute(
+            'SELECT id, learning_path_id, current_position FROM user_learning_paths WHERE user_id = ?',
+            (user_id,)
+        ).fetchall()
+        learning_path = next(
+            (row for row in user_paths if learning_path_index.contains(row['learning_path_id'], current_content_id)),
+            None
+        )
         
         # If we have assessment results, use them to determine if we should move forward
         should_advance = True
@@ -306,20 +301,11 @@ class AdaptationEngine:
             )
             
             # Get the next content in the path
-            next_in_path = conn.execute(
-                '''
-                SELECT lpi.content_id, c.title, c.description
-                FROM learning_path_items lpi
-                JOIN content c ON lpi.content_id = c.id
-                WHERE lpi.learning_path_id = ? AND lpi.sequence_order > ?
-                ORDER BY lpi.sequence_order
-                LIMIT 1
-                ''',
-                (learning_path['learning_path_id'], learning_path['current_position'])
-            ).fetchone()
+            next_in_path = learning_path_index.next_item(learning_path['learning_path_id'],
+                                                         learning_path['current_position'])
             
             if next_in_path:
-                next_content = dict(next_in_path)
+                next_content = next_in_path
             else:
                 # Mark the learning path as completed
                 conn.execute(
@@ -385,8 +371,8 @@ class AdaptationEngine:
         """
         # Try to use ML-enhanced difficulty adjustment first
         try:
-            from modules.predictive_analytics import PredictiveAnalytics
-            predictor = PredictiveAnalytics()
+            from modules.registry import get_predictive_analytics
+            predictor = get_predictive_analytics()
             
             # Get performance prediction
             performance = predictor.predict_performance(user_id)
@@ -450,8 +436,8 @@ class AdaptationEngine:
         """
         # Try to use ML-enhanced disengagement detection first
         try:
-            from modules.predictive_analytics import PredictiveAnalytics
-            predictor = PredictiveAnalytics()
+            from modules.registry import get_predictive_analytics
+            predictor = get_predictive_analytics()
             
             # Get disengagement risk prediction
             risk = predictor.predict_disengagement_risk(user_id)
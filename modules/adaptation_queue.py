@@ -0,0 +1,119 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from modules.assessment import AssessmentEngine
+from modules.content_adaptation import ContentAdaptation
+
+logger = logging.getLogger(__name__)
+
+# Adapted content generated at once; more requests wait in the executor queue
+ADAPTATION_WORKERS = 2
+
+class AdaptationQueue:
+    """
+    Generates adapted content for struggling students in background threads,
+    so failed assessment submissions and learning page views don't pay for it.
+    Requests for a (user, content) pair that is already queued or running
+    share that job instead of generating the same adaptation twice, unless they
+    bring new assessment results: those are adapted from in a follow-up job once
+    the current one finishes.
+    """
+    
+    def __init__(self, executor=None, db_path='database/adaptive_learning.db'):
+        """Initialize the queue with its own (or a custom) executor"""
+        self.db_path = db_path
+        self._executor = executor or ThreadPoolExecutor(max_workers=ADAPTATION_WORKERS,
+                                                        thread_name_prefix='adaptation')
+        self._lock = threading.Lock()
+        # Future of the newest job per (user, content), and the results of
+        # follow-up jobs waiting for the one in flight
+        self._jobs = {}
+        self._follow_ups = {}
+    
+    def submit(self, user_id, content_id, assessment_results=None):
+        """
+        Queue generation of adapted content
+        
+        Args:
+            user_id: The ID of the user
+            content_id: The ID of the content to adapt
+            assessment_results: Results of the failed assessment (default: rebuilt
+                from the user's latest responses when the job runs)
+                
+        Returns:
+            Future resolving to the stored adapted content ID (None if nothing
+            could be generated)
+        """
+        # Content IDs arrive as strings from route parameters
+        key = (int(user_id), int(content_id))
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is not None:
+                if assessment_results is None:
+                    logger.info(f"Adaptation for user {key[0]}, content {key[1]} already queued")
+                    return future
+                if key in self._follow_ups:
+                    # The follow-up hasn't started yet: adapt from the newest failure
+                    self._follow_ups[key] = assessment_results
+                    return future
+                # The job in flight adapts from older results, so generate again after it
+                future = Future()
+                self._jobs[key] = future
+                self._follow_ups[key] = assessment_results
+                logger.info(f"Queued follow-up adaptation for user {key[0]}, content {key[1]}")
+                return future
+            future = Future()
+            self._jobs[key] = future
+        
+        self._run(key, future, assessment_results)
+        return future
+    
+    def _run(self, key, future, assessment_results):
+        """Generate adapted content in the executor, resolving future when done"""
+        job = self._executor.submit(self._generate, key[0], key[1], assessment_results)
+        # The callback runs right away if the job already finished
+        job.add_done_callback(lambda done: self._finished(key, future, done))
+    
+    def _finished(self, key, future, job):
+        with self._lock:
+            follow_up_results = self._follow_ups.pop(key, None)
+            follow_up = self._jobs[key] if follow_up_results is not None else None
+            if follow_up is None and self._jobs.get(key) is future:
+                del self._jobs[key]
+        
+        # Outside the lock, since callers' callbacks on the future run here
+        if job.cancelled():
+            future.cancel()
+        else:
+            future.set_result(job.result())
+        
+        if follow_up is not None:
+            self._run(key, follow_up, follow_up_results)
+    
+    def _generate(self, user_id, content_id, assessment_results):
+        try:
+            content_adaptation = ContentAdaptation(self.db_path)
+            if assessment_results is None:
+                assessment_results = content_adaptation.latest_assessment_results(user_id, content_id)
+                if not assessment_results['questions']:
+                    logger.warning(f"No assessment results to adapt content {content_id} for user {user_id}")
+                    return None
+            
+            adapted_content = content_adaptation.adapt_content_for_struggling_student(
+                user_id, content_id, assessment_results
+            )
+            if not adapted_content:
+                logger.error(f"Failed to create adapted content for user {user_id}, content {content_id}")
+                return None
+            
+            adapted_id = content_adaptation.store_adapted_content(user_id, adapted_content)
+            AssessmentEngine().mark_adaptation_provided(user_id, content_id)
+            logger.info(f"Stored adapted content {adapted_id} for user {user_id}, content {content_id}")
+            return adapted_id
+        except Exception as e:
+            logger.error(f"Error generating adapted content: {e}", exc_info=True)
+            return None
+
+# Shared by all requests so concurrent failures can't spawn unbounded threads
+adaptation_queue = AdaptationQueue()
@@ -0,0 +1,215 @@
+import argparse
+import copy
+import json
+import zlib
+import hashlib
+import logging
+import time
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# adapted_content.storage_version values: full JSON document, or a manifest
+# whose sections live in adapted_content_blobs
+STORAGE_FULL = 1
+STORAGE_MANIFEST = 2
+
+# Adaptations kept per (user, content); older ones are pruned
+ADAPTED_VERSIONS_KEPT = 3
+
+# zlib level for section blobs (sections are small; higher levels gain little)
+BLOB_COMPRESSION_LEVEL = 6
+
+def canonical_json(value):
+    """Stable JSON encoding, so equal sections always hash to the same blob"""
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def section_hash(section):
+    """Content hash identifying a section blob"""
+    return hashlib.sha256(canonical_json(section)).hexdigest()
+
+def split_adapted_content(adapted_content):
+    """
+    Split an adapted content object into a per-user manifest and shared section blobs
+    
+    Sections are stored once however many adaptations contain them (unchanged
+    original sections, the standard practice section, ...); the manifest keeps
+    everything else plus the ordered list of section hashes.
+    
+    Args:
+        adapted_content: The adapted content object
+        
+    Returns:
+        Tuple of (manifest dictionary, {hash: (compressed data, uncompressed size)})
+    """
+    content_data = dict(adapted_content.get('content_data') or {})
+    sections = content_data.pop('sections', [])
+    
+    blobs = {}
+    section_hashes = []
+    for section in sections:
+        data = canonical_json(section)
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in blobs:
+            blobs[digest] = (zlib.compress(data, BLOB_COMPRESSION_LEVEL), len(data))
+        section_hashes.append(digest)
+    
+    manifest = {key: value for key, value in adapted_content.items() if key not in ('content_data', 'id')}
+    manifest['content_fields'] = content_data
+    manifest['section_hashes'] = section_hashes
+    return manifest, blobs
+
+def save_blobs(conn, blobs):
+    """Insert section blobs that aren't stored yet (caller commits)"""
+    conn.executemany(
+        'INSERT OR IGNORE INTO adapted_content_blobs (hash, data, size) VALUES (?, ?, ?)',
+        [(digest, data, size) for digest, (data, size) in blobs.items()]
+    )
+
+def load_sections(conn, section_hashes):
+    """
+    Fetch and decode section blobs
+    
+    Args:
+        conn: Database connection
+        section_hashes: Hashes listed in a manifest
+        
+    Returns:
+        Dictionary of hash to section (missing blobs are left out)
+    """
+    unique = list(dict.fromkeys(section_hashes))
+    if not unique:
+        return {}
+    placeholders = ','.join('?' for _ in unique)
+    rows = conn.execute(
+        f'SELECT hash, data FROM adapted_content_blobs WHERE hash IN ({placeholders})',
+        unique
+    ).fetchall()
+    return {row[0]: json.loads(zlib.decompress(row[1])) for row in rows}
+
+def assemble_adapted_content(manifest, sections):
+    """
+    Rebuild an adapted content object from its manifest
+    
+    Args:
+        manifest: Manifest dictionary from split_adapted_content
+        sections: {hash: section} from load_sections
+        
+    Returns:
+        Adapted content object, or None if a section blob is missing
+    """
+    if any(digest not in sections for digest in manifest['section_hashes']):
+        return None
+    
+    adapted_content = {
+        key: value for key, value in manifest.items()
+        if key not in ('content_fields', 'section_hashes')
+    }
+    content_data = dict(manifest['content_fields'])
+    # Copies, since one decoded section can appear more than once
+    content_data['sections'] = [copy.deepcopy(sections[digest]) for digest in manifest['section_hashes']]
+    adapted_content['content_data'] = content_data
+    return adapted_content
+
+def set_current_adaptation(conn, user_id, original_content_id, adapted_content_id, updated_at):
+    """Point a (user, content) pair at its newest adaptation (caller commits)"""
+    conn.execute(
+        '''
+        INSERT INTO current_adapted_content (user_id, original_content_id, adapted_content_id, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, original_content_id) DO UPDATE SET
+            adapted_content_id = excluded.adapted_content_id,
+            updated_at = excluded.updated_at
+        ''',
+        (user_id, original_content_id, adapted_content_id, updated_at)
+    )
+
+def prune_adapted_versions(conn, user_id, original_content_id, keep=ADAPTED_VERSIONS_KEPT):
+    """
+    Delete all but the newest adaptations of one (user, content) pair (caller commits).
+    Section blobs are left for compact_adapted_content to collect.
+    
+    Returns:
+        Number of adaptations deleted
+    """
+    cursor = conn.execute(
+        '''
+        DELETE FROM adapted_content
+        WHERE user_id = ? AND original_content_id = ?
+          AND id NOT IN (
+              SELECT id FROM adapted_content
+              WHERE user_id = ? AND original_content_id = ?
+              ORDER BY created_at DESC, id DESC
+              LIMIT ?
+          )
+          AND id NOT IN (SELECT adapted_content_id FROM current_adapted_content)
+        ''',
+        (user_id, original_content_id, user_id, original_content_id, keep)
+    )
+    return cursor.rowcount
+
+def compact_adapted_content(db_path='database/adaptive_learning.db', keep=ADAPTED_VERSIONS_KEPT):
+    """
+    Background job: apply the retention policy to every (user, content) pair and
+    delete section blobs no remaining manifest refers to
+    
+    Args:
+        db_path: Path to the SQLite database
+        keep: Adaptations kept per (user, content)
+        
+    Returns:
+        Tuple of (adaptations deleted, blobs deleted)
+    """
+    start = time.perf_counter()
+    conn = get_connection(db_path)
+    try:
+        # Take the write lock before reading references, so an adaptation being
+        # stored can't start using a blob this run is about to delete
+        conn.execute('BEGIN IMMEDIATE')
+        versions = conn.execute(
+            '''
+            DELETE FROM adapted_content
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY user_id, original_content_id
+                        ORDER BY created_at DESC, id DESC
+                    ) AS version_rank
+                    FROM adapted_content
+                )
+                WHERE version_rank > ?
+            )
+            AND id NOT IN (SELECT adapted_content_id FROM current_adapted_content)
+            ''',
+            (keep,)
+        ).rowcount
+        blobs = conn.execute(
+            '''
+            DELETE FROM adapted_content_blobs
+            WHERE hash NOT IN (
+                SELECT section.value
+                FROM adapted_content ac, json_each(ac.adapted_content, '$.section_hashes') section
+                WHERE ac.storage_version = ?
+            )
+            ''',
+            (STORAGE_MANIFEST,)
+        ).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    logger.info(f"Compacted adapted content: removed {versions} old versions and {blobs} unused blobs "
+                f"in {time.perf_counter() - start:.2f}s")
+    return versions, blobs
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Prune old adapted content versions and unused section blobs')
+    parser.add_argument('--keep', type=int, default=ADAPTED_VERSIONS_KEPT, help='adaptations kept per user and content')
+    args = parser.parse_args()
+    
+    compact_adapted_content(keep=max(1, args.keep))
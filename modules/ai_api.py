@@ -1,24 +1,20 @@
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, Response, jsonify, request, session
 import logging
 import os
 import json
 from datetime import datetime
 
-# Import AI modules
-from modules.predictive_analytics import PredictiveAnalytics
-from modules.content_recommendation import ContentRecommendation
-from modules.learning_style_detection import LearningStyleDetection
+# Shared AI components (same instances as app.py, loaded on first use)
+from modules.registry import predictive_analytics, content_recommendation, learning_style_detection
+from modules.auth import admin_api_required
+from modules.content_index import content_index, SIMILARITY_METRICS
+from modules.collaborative_filtering import train_factors
 
 logger = logging.getLogger(__name__)
 
 # Initialize Blueprint
 ai_api = Blueprint('ai_api', __name__, url_prefix='/api/ai')
 
-# Initialize AI components
-predictive_analytics = PredictiveAnalytics()
-content_recommendation = ContentRecommendation()
-learning_style_detection = LearningStyleDetection()
-
 @ai_api.route('/predict/performance', methods=['GET'])
 def predict_performance():
     """API endpoint to predict a user's future performance"""
@@ -86,6 +82,34 @@ def similar_content(content_id):
         'recommendations': recommendations
     })
 
+@ai_api.route('/content/similar-by-tags/<int:content_id>', methods=['GET'])
+def similar_content_by_tags(content_id):
+    """API endpoint to get content sharing the most tags with a given content item"""
+    limit = request.args.get('limit', 5, type=int)
+    metric = request.args.get('metric', 'jaccard')
+    
+    if metric not in SIMILARITY_METRICS:
+        return jsonify({'error': f"metric must be one of: {', '.join(SIMILARITY_METRICS)}"}), 400
+    
+    recommendations = []
+    for similar_id, score, shared_tags in content_index.similar_by_tags(content_id, limit=limit, metric=metric):
+        content = content_index.get(similar_id)
+        recommendations.append({
+            'content_id': similar_id,
+            'title': content['title'],
+            'description': content['description'],
+            'difficulty': content['difficulty'],
+            'tags': content['tags'],
+            'similarity_score': score,
+            'shared_tags': shared_tags
+        })
+    
+    return jsonify({
+        'content_id': content_id,
+        'metric': metric,
+        'recommendations': recommendations
+    })
+
 @ai_api.route('/content/recommend', methods=['GET'])
 def recommend_content():
     """API endpoint to get personalized content recommendations"""
@@ -134,6 +158,29 @@ def get_style_visualization():
         'timestamp': datetime.now().isoformat()
     })
 
+@ai_api.route('/user/learning-style/visualization.<image_format>', methods=['GET'])
+def get_style_visualization_image(image_format):
+    """API endpoint to get the learning style chart as a cacheable PNG or SVG image"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    if image_format not in ('png', 'svg'):
+        return jsonify({'error': 'Unsupported image format'}), 404
+    
+    user_id = session['user_id']
+    
+    try:
+        image, mimetype, etag = learning_style_detection.get_style_chart(user_id, image_format)
+    except Exception as e:
+        logger.error(f"Error rendering learning style chart: {e}")
+        return jsonify({'error': 'Could not generate visualization'}), 500
+    
+    response = Response(image, mimetype=mimetype)
+    response.set_etag(etag)
+    # Per-user image, so only the browser may cache it; revalidate via ETag
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response.make_conditional(request)
+
 @ai_api.route('/user/learning-style/recommendations', methods=['GET'])
 def get_style_recommendations():
     """API endpoint to get recommendations based on learning style"""
@@ -152,16 +199,9 @@ def get_style_recommendations():
     })
 
 @ai_api.route('/train/models', methods=['POST'])
+@admin_api_required
 def train_models():
     """API endpoint to train AI models (admin only)"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not logged in'}), 401
-    
-    # Check if user is admin
-    from app import is_admin
-    if not is_admin(session['user_id']):
-        return jsonify({'error': 'Unauthorized'}), 403
-    
     models_to_train = request.json.get('models', ['all'])
     results = {}
     
@@ -177,6 +217,9 @@ def train_models():
     if 'all' in models_to_train or 'content_vectors' in models_to_train:
         results['content_vectors'] = content_recommendation.build_content_vectors() is not None
     
+    if 'all' in models_to_train or 'collaborative_filtering' in models_to_train:
+        results['collaborative_filtering'] = train_factors()
+    
     return jsonify({
         'success': True,
         'results': results,
@@ -1,8 +1,10 @@
-import sqlite3
-import json
 import logging
 import random
 from datetime import datetime
+from modules.db import get_connection
+from modules.memo import request_memoized, invalidate_request_memo
+from modules.item_bank import item_bank
+from modules.irt import get_irt_engine, CAT_MIN_ITEMS, CAT_MAX_ITEMS, CAT_TARGET_SE
 
 logger = logging.getLogger(__name__)
 
@@ -18,10 +20,8 @@ class AssessmentEngine:
         self.db_path = 'database/adaptive_learning.db'
     
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
     def generate_assessment(self, content_id, user_id):
         """
@@ -50,22 +50,22 @@ class AssessmentEngine:
                 'questions': []
             }
         
-        # Get user's knowledge state for these components
+        # Get user's knowledge state for all of these components in one query
+        placeholders = ','.join('?' * len(kc_ids))
+        states = conn.execute(
+            f'''
+            SELECT knowledge_component_id, mastery_level
+            FROM user_knowledge_state
+            WHERE user_id = ? AND knowledge_component_id IN ({placeholders})
+            ''',
+            (user_id, *kc_ids)
+        ).fetchall()
+        
+        conn.close()
+        
         knowledge_states = {}
-        for kc_id in kc_ids:
-            state = conn.execute(
-                '''
-                SELECT mastery_level
-                FROM user_knowledge_state
-                WHERE user_id = ? AND knowledge_component_id = ?
-                ''',
-                (user_id, kc_id)
-            ).fetchone()
-            
-            if state:
-                knowledge_states[kc_id] = state['mastery_level']
-            else:
-                knowledge_states[kc_id] = 0.0
+        for state in states:
+            knowledge_states.setdefault(state['knowledge_component_id'], state['mastery_level'])
         
         # Select appropriate questions for each knowledge component
         questions = []
@@ -84,39 +84,82 @@ class AssessmentEngine:
             else:
                 target_difficulty = 2.0  # Challenging
             
-            # Find questions close to the target difficulty
-            kc_questions = conn.execute(
-                '''
-                SELECT id, question_text, question_type, options, difficulty, knowledge_component_id
-                FROM assessment_items
-                WHERE knowledge_component_id = ?
-                ORDER BY ABS(difficulty - ?) ASC
-                LIMIT 3
-                ''',
-                (kc_id, target_difficulty)
-            ).fetchall()
+            # Find questions close to the target difficulty (in-memory item bank)
+            kc_questions = item_bank.nearest_items(kc_id, target_difficulty, limit=3)
             
-            # Add questions to the assessment
+            # Add questions to the assessment (answer keys stay server-side)
             for question in kc_questions:
-                questions.append({
-                    'id': question['id'],
-                    'text': question['question_text'],
-                    'type': question['question_type'],
-                    'options': json.loads(question['options']) if question['options'] else None,
-                    'difficulty': question['difficulty'],
-                    'knowledge_component_id': question['knowledge_component_id']
-                })
+                questions.append(self._public_question(question))
         
         # Limit the total number of questions (adjust as needed)
         max_questions = 5
         if len(questions) > max_questions:
             questions = random.sample(questions, max_questions)
         
+        return {
+            'content_id': content_id,
+            'questions': questions
+        }
+    
+    def next_adaptive_question(self, content_id, responses, max_questions=CAT_MAX_ITEMS):
+        """
+        Computerized adaptive testing: choose the next question for an assessment
+        in progress. Ability is re-estimated from the answers so far and the
+        unanswered item with maximum Fisher information at that ability is asked
+        next, until the estimate is precise enough or max_questions is reached.
+        Nothing is written here; the finished responses go to evaluate_assessment.
+        
+        Args:
+            content_id: The ID of the content being assessed
+            responses: Answers so far, [{'question_id', 'answer'}, ...]
+            max_questions: Maximum number of questions to ask
+            
+        Returns:
+            Dictionary with the next question (None when finished), the
+            ability estimate and its standard error
+        """
+        conn = self.get_db_connection()
+        knowledge_components = conn.execute(
+            '''
+            SELECT knowledge_component_id
+            FROM content_knowledge_map
+            WHERE content_id = ?
+            ''',
+            (content_id,)
+        ).fetchall()
         conn.close()
         
+        candidate_ids = [
+            item['id']
+            for kc in knowledge_components
+            for item in item_bank.component_items(kc['knowledge_component_id'])
+        ]
+        
+        # Grade the answers so far against the in-memory answer keys
+        answered_ids = []
+        correct = []
+        for response in responses:
+            item = item_bank.get_item(self._item_id(response.get('question_id')))
+            if item:
+                answered_ids.append(item['id'])
+                correct.append(response.get('answer') == item['correct_answer'])
+        
+        # Picks up parameters stored by a calibration run (python -m modules.irt)
+        irt_engine = get_irt_engine()
+        ability, standard_error = irt_engine.estimate_ability(answered_ids, correct)
+        
+        next_id = None
+        precise_enough = len(answered_ids) >= CAT_MIN_ITEMS and standard_error <= CAT_TARGET_SE
+        if len(answered_ids) < max_questions and not precise_enough:
+            next_id = irt_engine.select_next_item(candidate_ids, ability, exclude=answered_ids)
+        
         return {
             'content_id': content_id,
-            'questions': questions
+            'question': self._public_question(item_bank.get_item(next_id)) if next_id is not None else None,
+            'finished': next_id is None,
+            'questions_answered': len(answered_ids),
+            'ability': ability,
+            'standard_error': standard_error
         }
     
     def evaluate_assessment(self, user_id, content_id, responses):
@@ -127,24 +170,42 @@ class AssessmentEngine:
         """
         conn = None
         try:
+            # Answer keys come from the in-memory item bank; anything it doesn't
+            # know yet (e.g. items added since it was loaded) is fetched in one query
+            item_ids = {self._item_id(r['question_id']) for r in responses} - {None}
+            
+            answer_keys = {}
+            for item_id in item_ids:
+                item = item_bank.get_item(item_id)
+                if item:
+                    answer_keys[item_id] = item
+            
+            missing_ids = item_ids - answer_keys.keys()
+            
             conn = self.get_db_connection()
             
+            if missing_ids:
+                placeholders = ','.join('?' * len(missing_ids))
+                rows = conn.execute(
+                    f'''
+                    SELECT id, correct_answer, explanation, difficulty, knowledge_component_id
+                    FROM assessment_items
+                    WHERE id IN ({placeholders})
+                    ''',
+                    tuple(missing_ids)
+                ).fetchall()
+                for row in rows:
+                    answer_keys[row['id']] = dict(row)
+            
             results = []
+            response_rows = []
             
             for response in responses:
                 question_id = response['question_id']
                 user_answer = response['answer']
                 response_time = response.get('response_time', 0)
                 
-                # Get the question details
-                question = conn.execute(
-                    '''
-                    SELECT question_text, correct_answer, explanation, difficulty, knowledge_component_id
-                    FROM assessment_items
-                    WHERE id = ?
-                    ''',
-                    (question_id,)
-                ).fetchone()
+                question = answer_keys.get(self._item_id(question_id))
                 
                 if not question:
                     continue
@@ -155,15 +216,7 @@ class AssessmentEngine:
                 # Calculate score (0-1)
                 score = 1.0 if is_correct else 0.0
                 
-                # Record the response
-                conn.execute(
-                    '''
-                    INSERT INTO user_responses
-                    (user_id, assessment_item_id, user_response, is_correct, response_time_seconds)
-                    VALUES (?, ?, ?, ?, ?)
-                    ''',
-                    (user_id, question_id, user_answer, is_correct, response_time)
-                )
+                response_rows.append((user_id, question_id, user_answer, is_correct, response_time))
                 
                 # Add to results
                 results.append({
@@ -175,22 +228,31 @@ class AssessmentEngine:
                     'knowledge_component_id': question['knowledge_component_id']
                 })
             
+            # Record all responses at once
+            conn.executemany(
+                '''
+                INSERT INTO user_responses
+                (user_id, assessment_item_id, user_response, is_correct, response_time_seconds)
+                VALUES (?, ?, ?, ?, ?)
+                ''',
+                response_rows
+            )
+            
             # Calculate overall results
             total_score = sum(r['score'] for r in results) / len(results) if results else 0
             mastery_achieved = total_score >= 0.8  # Consider mastery at 80%
             
+            # Record an assessment failure in the same transaction as the responses
+            if not mastery_achieved:
+                self._record_assessment_failure(user_id, content_id, total_score, conn=conn)
+            
             # Commit changes to the database
             conn.commit()
+            invalidate_request_memo()
             
-            # Close connection before calling other methods that use the database
             conn.close()
             conn = None
             
-            # Record assessment success or failure
-            if not mastery_achieved:
-                # This is an assessment failure
-                self._record_assessment_failure(user_id, content_id, total_score)
-            
             assessment_result = {
                 'questions': results,
                 'total_score': total_score,
@@ -212,7 +274,27 @@ class AssessmentEngine:
             if conn:
                 conn.close()
     
-    def _record_assessment_failure(self, user_id, content_id, score):
+    @staticmethod
+    def _public_question(question):
+        """Question fields sent to the learner (answer keys stay server-side)"""
+        return {
+            'id': question['id'],
+            'text': question['text'],
+            'type': question['type'],
+            'options': question['options'],
+            'difficulty': question['difficulty'],
+            'knowledge_component_id': question['knowledge_component_id']
+        }
+    
+    @staticmethod
+    def _item_id(question_id):
+        """Normalize a submitted question ID (often a string) to an item ID"""
+        try:
+            return int(question_id)
+        except (TypeError, ValueError):
+            return None
+    
+    def _record_assessment_failure(self, user_id, content_id, score, conn=None):
         """
         Record an assessment failure for a user and content.
         Updates the failure count and last attempt timestamp.
@@ -221,56 +303,46 @@ class AssessmentEngine:
             user_id: The ID of the user
             content_id: The ID of the content
             score: The score achieved in the assessment
+            conn: Open connection to write with; the caller commits. If omitted,
+                the failure is written and committed on its own connection.
         """
+        own_connection = conn is None
         try:
-            conn = self.get_db_connection()
-            
-            # Check if there's an existing record
-            existing = conn.execute(
-                '''
-                SELECT id, failure_count
-                FROM assessment_failures
-                WHERE user_id = ? AND content_id = ?
-                ''',
-                (user_id, content_id)
-            ).fetchone()
+            if own_connection:
+                conn = self.get_db_connection()
             
             timestamp = datetime.now().isoformat()
             
-            if existing:
-                # Update the existing record
-                conn.execute(
-                    '''
-                    UPDATE assessment_failures
-                    SET failure_count = failure_count + 1,
-                        last_score = ?,
-                        last_attempt_at = ?,
-                        adaptation_provided = 0
-                    WHERE id = ?
-                    ''',
-                    (score, timestamp, existing['id'])
-                )
-            else:
-                # Create a new record
-                conn.execute(
-                    '''
-                    INSERT INTO assessment_failures
-                    (user_id, content_id, failure_count, last_score, last_attempt_at, adaptation_provided)
-                    VALUES (?, ?, 1, ?, ?, 0)
-                    ''',
-                    (user_id, content_id, score, timestamp)
-                )
+            # One statement instead of SELECT then UPDATE/INSERT; relies on the
+            # unique (user_id, content_id) index added by update_db_schema
+            conn.execute(
+                '''
+                INSERT INTO assessment_failures
+                (user_id, content_id, failure_count, last_score, last_attempt_at, adaptation_provided)
+                VALUES (?, ?, 1, ?, ?, 0)
+                ON CONFLICT (user_id, content_id) DO UPDATE SET
+                    failure_count = failure_count + 1,
+                    last_score = excluded.last_score,
+                    last_attempt_at = excluded.last_attempt_at,
+                    adaptation_provided = 0
+                ''',
+                (user_id, content_id, score, timestamp)
+            )
             
-            conn.commit()
-            conn.close()
+            if own_connection:
+                conn.commit()
+                conn.close()
             
             logger.info(f"Recorded assessment failure for user {user_id} on content {content_id} with score {score}")
             
         except Exception as e:
             logger.error(f"Error recording assessment failure: {e}")
             # Make sure to close the connection even if there's an error
-            if 'conn' in locals():
+            if own_connection and conn:
                 conn.close()
+            # A missing failure row means adaptation never triggers, so let the
+            # caller roll back instead of carrying on silently
+            raise
     
     def mark_adaptation_provided(self, user_id, content_id):
         """
@@ -332,6 +404,7 @@ class AssessmentEngine:
         
         return feedback
     
+    @request_memoized
     def get_knowledge_gaps(self, user_id):
         """
         Identify knowledge gaps based on assessment history.
@@ -392,14 +465,14 @@ class AssessmentEngine:
         # First check if there is any adapted content already available
         has_adapted_content = conn.execute(
             '''
-            SELECT COUNT(*) as count
-            FROM adapted_content
+            SELECT 1
+            FROM current_adapted_content
             WHERE user_id = ? AND original_content_id = ?
             ''',
             (user_id, content_id)
         ).fetchone()
         
-        if has_adapted_content and has_adapted_content['count'] > 0:
+        if has_adapted_content:
             # We have adapted content for this user/content
             conn.close()
             return True
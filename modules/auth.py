@@ -0,0 +1,111 @@
+import time
+import logging
+import threading
+from functools import wraps
+
+from flask import session, redirect, url_for, flash, jsonify, has_request_context
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached admin claim is trusted before the users table is checked again
+ADMIN_CLAIM_TTL = 300
+
+# Session key holding the cached claim: {'user_id', 'is_admin', 'checked_at', 'version'}
+ADMIN_CLAIM_KEY = 'admin_claim'
+
+# Bumped whenever a user's role changes so claims cached by this process are
+# dropped immediately; other workers pick the change up within ADMIN_CLAIM_TTL
+_role_versions = {}
+_role_versions_lock = threading.Lock()
+
+def _role_version(user_id):
+    return _role_versions.get(user_id, 0)
+
+def query_is_admin(user_id):
+    """Check the users table for admin privileges"""
+    conn = get_connection()
+    user = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+    
+    return bool(user and user['is_admin'] == 1)
+
+def is_admin(user_id):
+    """
+    Check if a user has admin privileges.
+    For the logged-in user the answer is cached in the (signed) session cookie
+    for ADMIN_CLAIM_TTL seconds, so page renders don't query the database.
+    
+    Args:
+        user_id: ID of the user
+        
+    Returns:
+        True if the user is an admin
+    """
+    if not has_request_context() or session.get('user_id') != user_id:
+        return query_is_admin(user_id)
+    
+    claim = session.get(ADMIN_CLAIM_KEY)
+    now = time.time()
+    
+    if (claim and claim.get('user_id') == user_id
+            and claim.get('version') == _role_version(user_id)
+            and now - claim.get('checked_at', 0) < ADMIN_CLAIM_TTL):
+        return claim['is_admin']
+    
+    admin = query_is_admin(user_id)
+    session[ADMIN_CLAIM_KEY] = {
+        'user_id': user_id,
+        'is_admin': admin,
+        'checked_at': now,
+        'version': _role_version(user_id)
+    }
+    return admin
+
+def invalidate_admin_cache(user_id):
+    """Hook to call whenever a user's role changes"""
+    with _role_versions_lock:
+        _role_versions[user_id] = _role_version(user_id) + 1
+    
+    if has_request_context() and session.get(ADMIN_CLAIM_KEY, {}).get('user_id') == user_id:
+        session.pop(ADMIN_CLAIM_KEY, None)
+
+def set_admin(user_id, admin):
+    """Grant or revoke admin privileges and invalidate any cached claim"""
+    conn = get_connection()
+    conn.execute('UPDATE users SET is_admin = ? WHERE id = ?', (1 if admin else 0, user_id))
+    conn.commit()
+    conn.close()
+    
+    invalidate_admin_cache(user_id)
+    logger.info(f"Set is_admin={bool(admin)} for user ID: {user_id}")
+
+def admin_required(view):
+    """Decorator for admin pages: redirects visitors and non-admin users away"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session:
+            return redirect(url_for('index'))
+        
+        if not is_admin(session['user_id']):
+            flash("You don't have permission to access this page.")
+            return redirect(url_for('dashboard'))
+        
+        return view(*args, **kwargs)
+    
+    return wrapped
+
+def admin_api_required(view):
+    """Decorator for admin API endpoints: returns a JSON error for non-admin users"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not logged in'}), 401
+        
+        if not is_admin(session['user_id']):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        return view(*args, **kwargs)
+    
+    return wrapped
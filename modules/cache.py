@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Small thread-safe least-recently-used cache shared by the learning modules.
+    Keeps at most `maxsize` entries and evicts the oldest one when full.
+    """
+    
+    def __init__(self, maxsize=128):
+        """Initialize an empty cache holding at most maxsize entries"""
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        """Return the cached value for key (marking it recently used) or default"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+    
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entry if needed"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def get_or_create(self, key, factory):
+        """
+        Return the cached value for key, building it with factory() on a miss.
+        The factory runs outside the lock so slow builds don't block readers.
+        """
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            if value is not None:
+                self.set(key, value)
+        return value
+    
+    def pop(self, key, default=None):
+        """Remove and return the value for key"""
+        with self._lock:
+            return self._data.pop(key, default)
+    
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._data.clear()
+    
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,275 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Implicit feedback strength of each interaction type (others count 1.0),
+# the same weights ContentRecommendation.get_user_interests uses
+INTERACTION_WEIGHTS = {
+    'complete': 3.0,
+    'start': 1.5,
+    'like': 4.0,
+    'bookmark': 4.0
+}
+
+FACTORS_PATH = 'models/cf_factors.npz'
+
+# Alternating least squares hyperparameters
+DEFAULT_FACTORS = 32
+DEFAULT_REGULARIZATION = 0.05
+DEFAULT_ITERATIONS = 15
+CONFIDENCE_ALPHA = 10.0    # confidence = 1 + alpha * log(1 + interaction weight)
+CG_STEPS = 3               # conjugate gradient steps per row and half-iteration
+
+# Rows fetched per round trip while loading interactions
+CHUNK_ROWS = 200000
+
+# Non-zeros processed at once in a least squares half-iteration
+BLOCK_NNZ = 200000
+
+def load_interactions(db_path='database/adaptive_learning.db', chunk_rows=CHUNK_ROWS):
+    """
+    Aggregate user_interaction_log into weighted (user, content) pairs
+    
+    Returns:
+        Tuple of (user IDs, content IDs, summed weights) arrays
+    """
+    weight_case = ' '.join(f"WHEN '{interaction_type}' THEN {weight}"
+                           for interaction_type, weight in INTERACTION_WEIGHTS.items())
+    
+    conn = get_connection(db_path)
+    conn.row_factory = None
+    chunks = []
+    try:
+        cursor = conn.execute(
+            f'''
+            SELECT user_id, content_id, SUM(CASE interaction_type {weight_case} ELSE 1.0 END)
+            FROM user_interaction_log
+            WHERE content_id IS NOT NULL
+            GROUP BY user_id, content_id
+            '''
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64).reshape(-1, 3))
+    finally:
+        conn.close()
+    
+    data = np.vstack(chunks) if chunks else np.empty((0, 3))
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+def _least_squares(confidence, fixed, regularization, solution, cg_steps=CG_STEPS, block_nnz=BLOCK_NNZ):
+    """
+    One half-iteration of implicit ALS (Hu, Koren & Volinsky) solved with a few
+    conjugate gradient steps per row (Takacs et al.), vectorized over blocks of
+    rows: for row u, (Y'Y + Y' (C_u - I) Y + lambda I) x_u = Y' C_u p_u.
+    
+    Args:
+        confidence: CSR matrix of confidences (1 + alpha * log1p(weight)) for observed pairs
+        fixed: Factors of the other side (Y)
+        regularization: L2 regularization (lambda)
+        solution: Current factors of this side, updated in place (warm start)
+    """
+    gram = (fixed.T @ fixed + regularization * np.eye(fixed.shape[1], dtype=fixed.dtype)).astype(fixed.dtype)
+    indptr = confidence.indptr
+    
+    start = 0
+    row_count = confidence.shape[0]
+    while start < row_count:
+        end = int(np.searchsorted(indptr, indptr[start] + block_nnz, side='right')) - 1
+        end = min(max(end, start + 1), row_count)
+        
+        block = confidence[start:end]
+        row_lengths = np.diff(block.indptr)
+        extra = block.data - 1.0    # C_u - I on the observed entries
+        fixed_cols = np.take(fixed, block.indices, axis=0)
+        
+        def apply(vectors):
+            # A v for every row of the block at once (CSR rows are contiguous,
+            # so repeating each row's vector lines it up with its entries)
+            dots = np.einsum('ij,ij->i', np.repeat(vectors, row_lengths, axis=0), fixed_cols)
+            weighted = block.copy()
+            weighted.data = extra * dots
+            return vectors @ gram + weighted @ fixed
+        
+        x = solution[start:end]
+        b = block @ fixed          # Y' C_u p_u with p_u = 1 on observed entries
+        residual = b - apply(x)
+        direction = residual.copy()
+        rs_old = np.einsum('ij,ij->i', residual, residual)
+        
+        for _ in range(cg_steps):
+            if rs_old.max(initial=0.0) < 1e-20:
+                break
+            a_direction = apply(direction)
+            denominator = np.einsum('ij,ij->i', direction, a_direction)
+            step = np.divide(rs_old, denominator, out=np.zeros_like(rs_old), where=denominator > 0)
+            x += step[:, None] * direction
+            residual -= step[:, None] * a_direction
+            rs_new = np.einsum('ij,ij->i', residual, residual)
+            beta = np.divide(rs_new, rs_old, out=np.zeros_like(rs_new), where=rs_old > 0)
+            direction = residual + beta[:, None] * direction
+            rs_old = rs_new
+        
+        solution[start:end] = x
+        start = end
+
+def train_factors(db_path='database/adaptive_learning.db', factors=DEFAULT_FACTORS,
+                  regularization=DEFAULT_REGULARIZATION, iterations=DEFAULT_ITERATIONS,
+                  alpha=CONFIDENCE_ALPHA, path=FACTORS_PATH, seed=42):
+    """
+    Train implicit-feedback matrix factorization on the interaction log and
+    save the factors for CFModel.
+    
+    Args:
+        db_path: Path to the SQLite database
+        factors: Number of latent factors
+        regularization: L2 regularization
+        iterations: ALS iterations (each solves users, then content)
+        alpha: Confidence scaling of interaction weights
+        path: Where to save the factors (.npz)
+        seed: Random seed of the initial factors
+        
+    Returns:
+        True if factors were trained and saved
+    """
+    from scipy import sparse
+    
+    start = time.perf_counter()
+    users, contents, weights = load_interactions(db_path)
+    if not len(users):
+        logger.warning("No interactions to train collaborative filtering on")
+        return False
+    
+    user_ids, user_rows = np.unique(users, return_inverse=True)
+    content_ids, content_cols = np.unique(contents, return_inverse=True)
+    confidence = 1.0 + alpha * np.log1p(weights)
+    
+    # float32 halves the memory traffic of the per-entry products, which dominate
+    user_matrix = sparse.csr_matrix((confidence.astype(np.float32), (user_rows, content_cols)),
+                                    shape=(len(user_ids), len(content_ids)))
+    content_matrix = user_matrix.T.tocsr()
+    logger.info(f"Loaded {len(weights)} user/content pairs for {len(user_ids)} users and "
+                f"{len(content_ids)} content items in {time.perf_counter() - start:.1f}s")
+    
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(scale=0.01, size=(len(user_ids), factors)).astype(np.float32)
+    content_factors = rng.normal(scale=0.01, size=(len(content_ids), factors)).astype(np.float32)
+    
+    for iteration in range(iterations):
+        _least_squares(user_matrix, content_factors, regularization, user_factors)
+        _least_squares(content_matrix, user_factors, regularization, content_factors)
+        logger.debug(f"ALS iteration {iteration + 1}/{iterations} done")
+    
+    save_factors(path, user_ids, user_factors, content_ids, content_factors,
+                 factors=factors, regularization=regularization, alpha=alpha)
+    
+    logger.info(f"Trained {factors} factors in {time.perf_counter() - start:.1f}s")
+    return True
+
+def save_factors(path, user_ids, user_factors, content_ids, content_factors, **params):
+    """Write factors atomically so a loading process never sees a partial file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(
+        temp_path,
+        user_ids=user_ids,
+        user_factors=user_factors.astype(np.float32),
+        content_ids=content_ids,
+        content_factors=content_factors.astype(np.float32),
+        trained_at=np.array(datetime.now().isoformat()),
+        **{name: np.array(value) for name, value in params.items()}
+    )
+    os.replace(temp_path, path)
+
+class CFModel:
+    """
+    Scores content for a user with the dot product of their trained factors.
+    The factors file is reloaded whenever it changes on disk.
+    """
+    
+    def __init__(self, path=FACTORS_PATH):
+        """Initialize the model; factors are loaded on first use"""
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._model = None
+    
+    def _current(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        
+        if mtime != self._loaded_mtime:
+            with self._lock:
+                if mtime != self._loaded_mtime:
+                    with np.load(self.path) as data:
+                        self._model = {
+                            'user_rows': {user_id: row for row, user_id in enumerate(data['user_ids'].tolist())},
+                            'user_factors': data['user_factors'],
+                            'content_ids': data['content_ids'],
+                            'content_factors': data['content_factors']
+                        }
+                    self._loaded_mtime = mtime
+                    logger.info(f"Loaded collaborative filtering factors from {self.path}")
+        return self._model
+    
+    def has_user(self, user_id):
+        """Whether the user was part of the training data"""
+        model = self._current()
+        return model is not None and user_id in model['user_rows']
+    
+    def recommend(self, user_id, limit=5, exclude=()):
+        """
+        Top-scoring content for a user
+        
+        Args:
+            user_id: ID of the user
+            limit: Maximum number of results
+            exclude: Content IDs to leave out (e.g. already seen)
+            
+        Returns:
+            List of (content_id, score) tuples, best first; empty for users the
+            model does not know
+        """
+        model = self._current()
+        if model is None or user_id not in model['user_rows']:
+            return []
+        
+        scores = model['content_factors'] @ model['user_factors'][model['user_rows'][user_id]]
+        content_ids = model['content_ids']
+        if exclude:
+            scores = np.where(np.isin(content_ids, list(exclude)), -np.inf, scores)
+        
+        count = min(limit, int(np.isfinite(scores).sum()))
+        if count <= 0:
+            return []
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return list(zip(content_ids[top].tolist(), scores[top].astype(float).tolist()))
+
+# Shared by every engine in the process
+cf_model = CFModel()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Train collaborative filtering factors from user_interaction_log')
+    parser.add_argument('--factors', type=int, default=DEFAULT_FACTORS)
+    parser.add_argument('--regularization', type=float, default=DEFAULT_REGULARIZATION)
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--alpha', type=float, default=CONFIDENCE_ALPHA)
+    args = parser.parse_args()
+    
+    train_factors(factors=args.factors, regularization=args.regularization,
+                  iterations=args.iterations, alpha=args.alpha)
@@ -1,9 +1,68 @@
-import sqlite3
-import json
 import logging
+from modules.db import get_connection
+from modules.cache import LRUCache
+from modules.parsed_content import get_parsed_content, content_version_column, freeze, thaw
+from modules.content_index import content_index, normalize_tag, parse_tags, invalidate_content_index
+from modules.learning_paths import learning_path_index, invalidate_learning_path_index
+from modules.prerequisites import (prerequisite_graph, parse_prerequisites, invalidate_prerequisite_graph,
+                                   CycleError)
 
 logger = logging.getLogger(__name__)
 
+# Styles content has a prepared presentation for
+LEARNING_STYLES = ('visual', 'auditory', 'kinesthetic')
+
+# Style variants kept per (content ID, content version)
+STYLE_VARIANT_CACHE_SIZE = 1024
+_style_variants = LRUCache(maxsize=STYLE_VARIANT_CACHE_SIZE)
+
+def style_content_data(content_data, style):
+    """
+    Present content data for a learning style
+    
+    Args:
+        content_data: Mutable content data (changed in place)
+        style: One of LEARNING_STYLES (other styles leave it unchanged)
+        
+    Returns:
+        The content data
+    """
+    if 'sections' not in content_data:
+        return content_data
+    
+    if style == 'visual':
+        # Emphasize visual elements, diagrams, and illustrations
+        # Move sections with media to the top
+        sections = content_data['sections']
+        visual_sections = [s for s in sections if s.get('media_url')]
+        text_sections = [s for s in sections if not s.get('media_url')]
+        content_data['sections'] = visual_sections + text_sections
+    
+    elif style == 'auditory':
+        # Emphasize explanations, discussions, and audio elements
+        # Add note about reading aloud or discussing the content
+        for section in content_data['sections']:
+            if 'learning_tips' not in section:
+                section['learning_tips'] = []
+            section['learning_tips'].append(
+                "Try reading this section aloud or discussing it with someone to enhance understanding."
+            )
+    
+    elif style == 'kinesthetic':
+        # Emphasize interactive elements, examples, and practice exercises
+        for section in content_data['sections']:
+            if 'learning_tips' not in section:
+                section['learning_tips'] = []
+            section['learning_tips'].append(
+                "Try applying this concept with hands-on practice or create your own examples."
+            )
+    
+    return content_data
+
+def build_style_variants(content_data):
+    """Frozen presentation of content data for every style in LEARNING_STYLES"""
+    return {style: freeze(style_content_data(thaw(content_data), style)) for style in LEARNING_STYLES}
+
 class ContentModule:
     """
     Manages the learning content, including retrieval, organization, and metadata.
@@ -15,10 +74,8 @@ class ContentModule:
         self.db_path = 'database/adaptive_learning.db'
     
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
     def get_content(self, content_id):
         """Get content by ID with all metadata and formatted for display"""
@@ -26,8 +83,9 @@ class ContentModule:
         
         # Get content data
         content = conn.execute(
-            '''
-            SELECT id, title, description, content_type, difficulty, tags, prerequisites, content_data
+            f'''
+            SELECT id, title, description, content_type, difficulty, tags, prerequisites, content_data,
+                   {content_version_column(conn)}
             FROM content
             WHERE id = ?
             ''',
@@ -62,8 +120,8 @@ class ContentModule:
         
         conn.close()
         
-        # Parse content data
-        content_data = json.loads(content['content_data'])
+        # Parsed once per content version and shared (read-only) between requests
+        content_data = get_parsed_content(content['id'], content['version'], content['content_data'])
         
         # Parse tags and prerequisites
         tags = content['tags'].split(',') if content['tags'] else []
@@ -80,7 +138,8 @@ class ContentModule:
             'prerequisites': prerequisites,
             'knowledge_components': [dict(kc) for kc in knowledge_components],
             'has_assessment': assessment_items['assessment_count'] > 0,
-            'content_data': content_data
+            'content_data': content_data,
+            'version': content['version']
         }
         
         return content_obj
@@ -109,8 +168,8 @@ class ContentModule:
                 params.append(filters['difficulty'])
             
             if 'tag' in filters:
-                where_clauses.append('tags LIKE ?')
-                params.append(f'%{filters["tag"]}%')
+                where_clauses.append('id IN (SELECT content_id FROM content_tags WHERE tag = ?)')
+                params.append(normalize_tag(filters['tag']))
             
             if 'knowledge_component' in filters:
                 query = '''
@@ -145,43 +204,174 @@ class ContentModule:
         
         return result
     
-    def get_prerequisites(self, content_id):
-        """Get prerequisite content items for a given content ID"""
+    def update_tags(self, content_id, tags):
+        """
+        Replace the tags of a content item, keeping content.tags and the
+        normalized content_tags table in step
+        
+        Args:
+            content_id: ID of the content
+            tags: List of tag strings
+        """
+        tags_value = ','.join(tag.strip() for tag in tags if tag.strip())
+        
         conn = self.get_db_connection()
+        try:
+            conn.execute('UPDATE content SET tags = ? WHERE id = ?', (tags_value or None, content_id))
+            conn.execute('DELETE FROM content_tags WHERE content_id = ?', (content_id,))
+            conn.executemany(
+                'INSERT INTO content_tags (content_id, tag) VALUES (?, ?)',
+                [(content_id, tag) for tag in parse_tags(tags_value)]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
-        # Get the content to check prerequisites
-        content = conn.execute(
-            'SELECT prerequisites FROM content WHERE id = ?',
-            (content_id,)
-        ).fetchone()
+        invalidate_content_index()
+    
+    def update_prerequisites(self, content_id, prerequisite_ids):
+        """
+        Replace the prerequisites of a content item
+        
+        Args:
+            content_id: ID of the content
+            prerequisite_ids: List of prerequisite content IDs
+            
+        Raises:
+            CycleError: If the content would (indirectly) become its own prerequisite
+        """
+        prerequisite_ids = list(dict.fromkeys(int(prerequisite_id) for prerequisite_id in prerequisite_ids))
+        if prerequisite_graph.would_create_cycle(content_id, prerequisite_ids):
+            raise CycleError(f"Content {content_id} cannot depend on {prerequisite_ids}: prerequisites would form a cycle")
         
-        if not content or not content['prerequisites']:
+        conn = self.get_db_connection()
+        try:
+            conn.execute(
+                'UPDATE content SET prerequisites = ? WHERE id = ?',
+                (','.join(map(str, prerequisite_ids)), content_id)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
-            return []
         
-        # Parse prerequisites and get their details
-        prerequisite_ids = content['prerequisites'].split(',')
+        invalidate_prerequisite_graph()
+    
+    def set_learning_path_items(self, learning_path_id, content_ids):
+        """
+        Replace the items of a learning path
         
-        # Get prerequisite content details
-        prereq_content = []
-        for prereq_id in prerequisite_ids:
-            if not prereq_id.strip():
-                continue
-                
+        Args:
+            learning_path_id: ID of the learning path
+            content_ids: Content IDs in the order they should be learned
+        """
+        conn = self.get_db_connection()
+        try:
+            conn.execute('DELETE FROM learning_path_items WHERE learning_path_id = ?', (learning_path_id,))
+            conn.executemany(
+                'INSERT INTO learning_path_items (learning_path_id, content_id, sequence_order) VALUES (?, ?, ?)',
+                [(learning_path_id, content_id, order) for order, content_id in enumerate(content_ids, start=1)]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        invalidate_learning_path_index()
+    
+    def get_prerequisites(self, content_id, transitive=False):
+        """
+        Get prerequisite content items for a given content ID
+        
+        Args:
+            content_id: ID of the content
+            transitive: Also include prerequisites of prerequisites (in the
+                order they should be learned)
+        """
+        conn = self.get_db_connection()
+        
+        if transitive:
+            prerequisite_ids = prerequisite_graph.all_prerequisites(content_id)
+        else:
             content = conn.execute(
-                '''
-                SELECT id, title, description, content_type, difficulty
-                FROM content
-                WHERE id = ?
-                ''',
-                (prereq_id,)
+                'SELECT prerequisites FROM content WHERE id = ?',
+                (content_id,)
             ).fetchone()
+            prerequisite_ids = parse_prerequisites(content['prerequisites']) if content else []
+        
+        if not prerequisite_ids:
+            conn.close()
+            return []
+        
+        # Fetch every prerequisite in one query, then restore the listed order
+        placeholders = ','.join('?' * len(prerequisite_ids))
+        rows = conn.execute(
+            f'''
+            SELECT id, title, description, content_type, difficulty
+            FROM content
+            WHERE id IN ({placeholders})
+            ''',
+            prerequisite_ids
+        ).fetchall()
+        conn.close()
+        
+        by_id = {row['id']: dict(row) for row in rows}
+        return [by_id[prerequisite_id] for prerequisite_id in prerequisite_ids if prerequisite_id in by_id]
+    
+    def get_unlocked_content(self, user_id, include_mastered=False):
+        """
+        Get content whose prerequisites the user has mastered
+        
+        Args:
+            user_id: ID of the user
+            include_mastered: Also return content the user has already mastered
             
+        Returns:
+            List of content dictionaries, each after its prerequisites
+        """
+        conn = self.get_db_connection()
+        mastery_levels = dict(conn.execute(
+            'SELECT knowledge_component_id, mastery_level FROM user_knowledge_state WHERE user_id = ?',
+            (user_id,)
+        ).fetchall())
+        conn.close()
+        
+        result = []
+        for content_id in prerequisite_graph.unlocked_content(mastery_levels, include_mastered=include_mastered):
+            content = content_index.get(content_id)
             if content:
-                prereq_content.append(dict(content))
+                result.append({
+                    'id': content_id,
+                    'title': content['title'],
+                    'description': content['description'],
+                    'difficulty': content['difficulty']
+                })
+        return result
+    
+    def get_style_variants(self, content_id, version, content_data):
+        """
+        Get the presentation of a content item for every learning style,
+        prepared once per content version
         
-        conn.close()
-        return prereq_content
+        Args:
+            content_id: ID of the content
+            version: The content's version column
+            content_data: Parsed content data of that version
+            
+        Returns:
+            Dictionary of style to frozen content data
+        """
+        return _style_variants.get_or_create(
+            (int(content_id), version),
+            lambda: build_style_variants(content_data)
+        )
     
     def format_content_for_style(self, content, learning_style):
         """
@@ -193,44 +383,17 @@ class ContentModule:
         
         # Clone the content to avoid modifying the original
         formatted_content = dict(content)
+        content_data = content.get('content_data', {})
+        style = learning_style['style']
+        
+        if content.get('id') is not None and content.get('version') is not None:
+            # Content from get_content: pick its prepared variant
+            variants = self.get_style_variants(content['id'], content['version'], content_data)
+            formatted_content['content_data'] = variants.get(style, content_data)
+        else:
+            # Content without a version (e.g. adapted content) is styled on a copy
+            formatted_content['content_data'] = style_content_data(thaw(content_data), style)
         
-        # Get the content data
-        content_data = formatted_content.get('content_data', {})
-        
-        # Adjust based on learning style
-        if learning_style['style'] == 'visual':
-            # Emphasize visual elements, diagrams, and illustrations
-            # Reorder sections to prioritize visual content
-            if 'sections' in content_data:
-                # Move sections with media to the top
-                sections = content_data['sections']
-                visual_sections = [s for s in sections if s.get('media_url')]
-                text_sections = [s for s in sections if not s.get('media_url')]
-                content_data['sections'] = visual_sections + text_sections
-        
-        elif learning_style['style'] == 'auditory':
-            # Emphasize explanations, discussions, and audio elements
-            # Add note about reading aloud or discussing the content
-            if 'sections' in content_data:
-                for section in content_data['sections']:
-                    if 'learning_tips' not in section:
-                        section['learning_tips'] = []
-                    section['learning_tips'].append(
-                        "Try reading this section aloud or discussing it with someone to enhance understanding."
-                    )
-        
-        elif learning_style['style'] == 'kinesthetic':
-            # Emphasize interactive elements, examples, and practice exercises
-            # Prioritize sections with exercises or activities
-            if 'sections' in content_data:
-                for section in content_data['sections']:
-                    if 'learning_tips' not in section:
-                        section['learning_tips'] = []
-                    section['learning_tips'].append(
-                        "Try applying this concept with hands-on practice or create your own examples."
-                    )
-        
-        formatted_content['content_data'] = content_data
         return formatted_content
     
     def get_next_content(self, user_id, learning_path_id=None):
@@ -273,22 +436,7 @@ class ContentModule:
             else:
                 current_position = user_path['current_position']
         
-        # Get the next content in the path
-        next_item = conn.execute(
-            '''
-            SELECT lpi.content_id, c.title, c.description
-            FROM learning_path_items lpi
-            JOIN content c ON lpi.content_id = c.id
-            WHERE lpi.learning_path_id = ? AND lpi.sequence_order > ?
-            ORDER BY lpi.sequence_order
-            LIMIT 1
-            ''',
-            (learning_path_id, current_position)
-        ).fetchone()
-        
         conn.close()
         
-        if next_item:
-            return dict(next_item)
-        else:
-            return None
\ No newline at end of file
+        # Get the next content in the path
+        return learning_path_index.next_item(learning_path_id, current_position)
\ No newline at end of file
@@ -1,16 +1,23 @@
-import sqlite3
+import copy
 import json
 import logging
 import numpy as np
 from datetime import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-from nltk.tokenize import sent_tokenize
+from modules.db import get_connection
+from modules.cache import LRUCache
+from modules.parsed_content import get_parsed_content, content_version_column, thaw
+from modules.adapted_storage import (
+    STORAGE_FULL, STORAGE_MANIFEST, split_adapted_content, save_blobs,
+    load_sections, assemble_adapted_content, set_current_adaptation, prune_adapted_versions
+)
 
 # Initialize logging
 logger = logging.getLogger(__name__)
 
+# Adapted bodies kept per (content version, struggled components, related content versions)
+ADAPTATION_CACHE_SIZE = 1024
+_adaptation_cache = LRUCache(maxsize=ADAPTATION_CACHE_SIZE)
+
 class ContentAdaptation:
     """
     ContentAdaptation class handles adapting learning content for students
@@ -21,13 +28,19 @@ class ContentAdaptation:
     def __init__(self, db_path='database/adaptive_learning.db'):
         """Initialize ContentAdaptation with database path"""
         self.db_path = db_path
-        self.vectorizer = TfidfVectorizer(stop_words='english')
+        self._vectorizer = None
+    
+    @property
+    def vectorizer(self):
+        """TF-IDF vectorizer, created on first use"""
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            self._vectorizer = TfidfVectorizer(stop_words='english')
+        return self._vectorizer
     
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
     def adapt_content_for_struggling_student(self, user_id, content_id, assessment_results):
         """
@@ -47,7 +60,7 @@ class ContentAdaptation:
             # Get the original content
             conn = self.get_db_connection()
             content = conn.execute(
-                'SELECT title, content_data FROM content WHERE id = ?',
+                f'SELECT title, content_data, {content_version_column(conn)} FROM content WHERE id = ?',
                 (content_id,)
             ).fetchone()
             
@@ -55,15 +68,6 @@ class ContentAdaptation:
                 conn.close()
                 logger.error(f"Content {content_id} not found")
                 return None
-            
-            # Parse the content data
-            try:
-                content_data = json.loads(content['content_data'])
-                logger.info(f"Successfully loaded content data with {len(content_data.get('sections', []))} sections")
-            except json.JSONDecodeError:
-                conn.close()
-                logger.error(f"Failed to parse content data for content {content_id}")
-                return None
                 
             title = content['title']
             
@@ -98,23 +102,41 @@ class ContentAdaptation:
                 else:
                     logger.error(f"Could not find any knowledge components for content {content_id}")
             
+            conn.close()
+            
             # Get related knowledge components and content
             related_content = self._get_related_content(struggled_kcs)
             logger.info(f"Found related content for {len(related_content)} knowledge components")
             
-            conn.close()
-            
-            # Adapt the content
-            logger.info("Simplifying content...")
-            adapted_content = self._simplify_content(content_data, struggled_kcs)
-            
-            # Add additional explanations
-            logger.info("Adding explanations...")
-            adapted_content = self._add_explanations(adapted_content, struggled_kcs, related_content)
+            # The adapted body only depends on the content, the struggled components'
+            # text and the related content, so learners failing the same ones share it
+            related_versions = tuple(
+                (kc_id, tuple((item['id'], item['version']) for item in items))
+                for kc_id, items in related_content.items()
+            )
+            cache_key = (
+                int(content_id),
+                content['version'],
+                tuple((kc['id'], kc['name'], kc['description']) for kc in struggled_kcs),
+                related_versions
+            )
+            adapted_content = _adaptation_cache.get(cache_key)
+            if adapted_content is None:
+                adapted_content = self._build_adapted_body(content_id, content['version'], content['content_data'],
+                                                           struggled_kcs, related_content)
+                if adapted_content is None:
+                    return None
+                # Unversioned content (schema not updated) can't be told apart after edits
+                if content['version'] is not None and all(
+                    version is not None for _, items in related_versions for _, version in items
+                ):
+                    _adaptation_cache.set(cache_key, adapted_content)
+            else:
+                logger.info(f"Using cached adaptation of content {content_id} "
+                            f"for components {[kc['id'] for kc in struggled_kcs]}")
             
-            # Adjust the difficulty level
-            logger.info("Adjusting difficulty...")
-            adapted_content = self._adjust_difficulty(adapted_content)
+            # Callers may modify what they get back; the cached body stays intact
+            adapted_content = copy.deepcopy(adapted_content)
             
             # Create the adapted content object
             adapted_content_obj = {
@@ -133,6 +155,40 @@ class ContentAdaptation:
             logger.error(f"Error adapting content: {e}", exc_info=True)
             return None
         
+    def _build_adapted_body(self, content_id, version, content_data_json, struggled_kcs, related_content):
+        """
+        Build adapted content data for a set of struggled knowledge components
+        
+        Args:
+            content_id: The ID of the content to adapt
+            version: The content's version column
+            content_data_json: The content's content_data column
+            struggled_kcs: Knowledge components the student struggled with
+            related_content: Related content for each knowledge component
+            
+        Returns:
+            Adapted content data, or None if the content data can't be parsed
+        """
+        # Adapting edits the document, so work on a copy of the shared parsed one
+        try:
+            content_data = thaw(get_parsed_content(content_id, version, content_data_json))
+            logger.info(f"Successfully loaded content data with {len(content_data.get('sections', []))} sections")
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse content data for content {content_id}")
+            return None
+        
+        # Adapt the content
+        logger.info("Simplifying content...")
+        adapted_content = self._simplify_content(content_data, struggled_kcs)
+        
+        # Add additional explanations
+        logger.info("Adding explanations...")
+        adapted_content = self._add_explanations(adapted_content, struggled_kcs, related_content)
+        
+        # Adjust the difficulty level
+        logger.info("Adjusting difficulty...")
+        return self._adjust_difficulty(adapted_content)
+    
     def _identify_struggled_components(self, user_id, assessment_results):
         """
         Identify knowledge components where the student struggled based on assessment results.
@@ -179,6 +235,8 @@ class ContentAdaptation:
                 if kc_id:
                     kc_ids.append(kc_id)
         
+        # Each component once, in ID order, however many of its questions were missed
+        kc_ids = sorted(set(kc_ids))
         logger.info(f"Extracted {len(kc_ids)} knowledge component IDs")
         
         # If no specific KCs identified, return empty list
@@ -239,8 +297,8 @@ class ContentAdaptation:
             
             # Find easier content that targets this knowledge component
             content_items = conn.execute(
-                '''
-                SELECT c.id, c.title, c.content_data, c.difficulty
+                f'''
+                SELECT c.id, c.title, c.content_data, c.difficulty, {content_version_column(conn, 'c')}
                 FROM content c
                 JOIN content_knowledge_map ckm ON c.id = ckm.content_id
                 WHERE ckm.knowledge_component_id = ?
@@ -267,6 +325,10 @@ class ContentAdaptation:
         Returns:
             Simplified content data
         """
+        from modules.content_recommendation import ensure_nltk_resources
+        ensure_nltk_resources()
+        from nltk.tokenize import sent_tokenize
+        
         # Create a deep copy to avoid modifying the original
         simplified_content = dict(content_data)
         
@@ -375,7 +437,8 @@ class ContentAdaptation:
             # Extract explanations and examples from related content
             if kc_id in related_content:
                 for content_item in related_content[kc_id]:
-                    item_data = json.loads(content_item['content_data'])
+                    item_data = get_parsed_content(content_item['id'], content_item['version'],
+                                                   content_item['content_data'])
                     
                     for section in item_data.get('sections', []):
                         # Find sections that contain examples
@@ -469,6 +532,49 @@ class ContentAdaptation:
         
         return adjusted_content
     
+    def latest_assessment_results(self, user_id, content_id):
+        """
+        Rebuild failed-assessment results from the user's most recent responses
+        on a content item, for adapting content outside an assessment submission.
+        
+        Args:
+            user_id: The ID of the user
+            content_id: The ID of the content
+            
+        Returns:
+            Assessment results in the format evaluate_assessment returns
+        """
+        conn = self.get_db_connection()
+        last_assessment = conn.execute(
+            '''
+            SELECT ur.user_response, ur.is_correct, ai.id as question_id, 
+                   ai.knowledge_component_id, ai.correct_answer, ai.explanation
+            FROM user_responses ur
+            JOIN assessment_items ai ON ur.assessment_item_id = ai.id
+            JOIN content_knowledge_map ckm ON ai.knowledge_component_id = ckm.knowledge_component_id
+            WHERE ur.user_id = ? AND ckm.content_id = ?
+            ORDER BY ur.timestamp DESC
+            LIMIT 5
+            ''',
+            (user_id, content_id)
+        ).fetchall()
+        conn.close()
+        
+        return {
+            'questions': [
+                {
+                    'question_id': row['question_id'],
+                    'is_correct': bool(row['is_correct']),
+                    'correct_answer': row['correct_answer'],
+                    'explanation': row['explanation'],
+                    'knowledge_component_id': row['knowledge_component_id']
+                }
+                for row in last_assessment
+            ],
+            'total_score': 0.0,  # Assume failed assessment
+            'mastery_achieved': False
+        }
+    
     def store_adapted_content(self, user_id, adapted_content):
         """
         Store the adapted content in the database so it can be retrieved later.
@@ -482,28 +588,35 @@ class ContentAdaptation:
         """
         conn = self.get_db_connection()
         
-        # Convert adapted content to JSON
-        adapted_content_json = json.dumps(adapted_content)
+        # Sections go to shared, content-addressed blobs; the row only keeps a manifest
+        manifest, blobs = split_adapted_content(adapted_content)
+        save_blobs(conn, blobs)
         
         # Insert the adapted content
+        created_at = datetime.now().isoformat()
         cursor = conn.cursor()
         cursor.execute(
             '''
             INSERT INTO adapted_content 
-            (user_id, original_content_id, adapted_content, created_at) 
-            VALUES (?, ?, ?, ?)
+            (user_id, original_content_id, adapted_content, created_at, storage_version) 
+            VALUES (?, ?, ?, ?, ?)
             ''',
             (
                 user_id, 
                 adapted_content['original_content_id'], 
-                adapted_content_json, 
-                datetime.now().isoformat()
+                json.dumps(manifest), 
+                created_at,
+                STORAGE_MANIFEST
             )
         )
         
         # Get the ID of the inserted content
         adapted_content_id = cursor.lastrowid
         
+        # Make it the one served, and drop versions beyond the retention limit
+        set_current_adaptation(conn, user_id, adapted_content['original_content_id'], adapted_content_id, created_at)
+        prune_adapted_versions(conn, user_id, adapted_content['original_content_id'])
+        
         conn.commit()
         conn.close()
         
@@ -523,31 +636,40 @@ class ContentAdaptation:
         try:
             conn = self.get_db_connection()
             
-            # Get the most recent adapted content
+            # Get the current adapted content
             adapted_content_row = conn.execute(
                 '''
-                SELECT id, adapted_content 
-                FROM adapted_content 
-                WHERE user_id = ? AND original_content_id = ? 
-                ORDER BY created_at DESC 
-                LIMIT 1
+                SELECT ac.id, ac.adapted_content, ac.storage_version 
+                FROM current_adapted_content cur
+                JOIN adapted_content ac ON ac.id = cur.adapted_content_id
+                WHERE cur.user_id = ? AND cur.original_content_id = ?
                 ''',
                 (user_id, original_content_id)
             ).fetchone()
             
-            conn.close()
-            
             if not adapted_content_row:
+                conn.close()
                 logger.info(f"No adapted content found for user {user_id}, content {original_content_id}")
                 return None
             
             # Parse the JSON content
             try:
                 adapted_content = json.loads(adapted_content_row['adapted_content'])
+                if adapted_content_row['storage_version'] != STORAGE_FULL:
+                    manifest = adapted_content
+                    adapted_content = assemble_adapted_content(
+                        manifest, load_sections(conn, manifest['section_hashes'])
+                    )
+                    if adapted_content is None:
+                        conn.close()
+                        logger.error(f"Missing section blobs for adapted content ID {adapted_content_row['id']}")
+                        return None
+                conn.close()
                 adapted_content['id'] = adapted_content_row['id']
                 logger.info(f"Successfully retrieved adapted content with ID {adapted_content_row['id']}")
                 return adapted_content
             except json.JSONDecodeError:
+                conn.close()
                 logger.error(f"Failed to parse adapted content JSON for ID {adapted_content_row['id']}")
                 return None
         except Exception as e:
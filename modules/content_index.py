@@ -0,0 +1,228 @@
+import time
+import sqlite3
+import logging
+import threading
+
+import numpy as np
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Safety net for content edits made outside this process (seconds)
+CONTENT_INDEX_MAX_AGE = 600
+
+SIMILARITY_METRICS = ('jaccard', 'overlap')
+
+def normalize_tag(tag):
+    """Canonical form used to match tags ("Math " and "math" are the same tag)"""
+    return tag.strip().lower()
+
+def parse_tags(tags):
+    """Distinct normalized tags of a comma-separated content.tags value"""
+    if not tags:
+        return []
+    return list(dict.fromkeys(tag for tag in map(normalize_tag, tags.split(',')) if tag))
+
+class ContentIndex:
+    """
+    In-memory copy of the content catalogue fields used for recommendations,
+    with an inverted index from tag to a bitmap of content positions (a Python
+    int with bit i set when the i-th content item has the tag). Filtering by
+    tags is a handful of OR/AND operations instead of a `tags LIKE '%tag%'` scan.
+    Tags come from the normalized content_tags table.
+    """
+    
+    def __init__(self, db_path='database/adaptive_learning.db', max_age=CONTENT_INDEX_MAX_AGE):
+        """Initialize an empty index; content is loaded on first use"""
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # Swapped as one object so readers always see a consistent snapshot
+        self._index = {
+            'content': {},
+            'ids': np.empty(0, dtype=np.int64),
+            'positions': {},
+            'tag_counts': np.empty(0, dtype=np.int64),
+            'tags': {},
+            'bitmaps': {}
+        }
+    
+    def refresh(self):
+        """Reload every content item and its tags from the database"""
+        conn = get_connection(self.db_path)
+        rows = conn.execute('SELECT id, title, description, difficulty, tags FROM content ORDER BY id').fetchall()
+        try:
+            tag_rows = conn.execute('SELECT content_id, tag FROM content_tags').fetchall()
+        except sqlite3.OperationalError as e:
+            # Schema not updated yet (run database/update_db.py)
+            logger.warning(f"Deriving tags from content.tags: {e}")
+            tag_rows = [(row['id'], tag) for row in rows for tag in parse_tags(row['tags'])]
+        conn.close()
+        
+        content = {}
+        for row in rows:
+            content[row['id']] = {
+                'content_id': row['id'],
+                'title': row['title'],
+                'description': row['description'],
+                'difficulty': row['difficulty'],
+                'tags': row['tags'].split(',') if row['tags'] else []
+            }
+        
+        ids = np.fromiter(content, dtype=np.int64, count=len(content))
+        positions = {content_id: position for position, content_id in enumerate(content)}
+        tag_counts = np.zeros(len(ids), dtype=np.int64)
+        
+        # Collect the positions per tag, then build each bitmap in one go
+        tag_positions = {}
+        tags_by_content = {}
+        for content_id, tag in tag_rows:
+            position = positions.get(content_id)
+            if position is not None:
+                tag_positions.setdefault(tag, []).append(position)
+                tags_by_content.setdefault(content_id, []).append(tag)
+                tag_counts[position] += 1
+        
+        bitmaps = {tag: self._to_bitmap(members, len(ids)) for tag, members in tag_positions.items()}
+        
+        with self._lock:
+            self._index = {
+                'content': content,
+                'ids': ids,
+                'positions': positions,
+                'tag_counts': tag_counts,
+                'tags': tags_by_content,
+                'bitmaps': bitmaps
+            }
+            self._loaded_at = time.monotonic()
+        
+        logger.info(f"Indexed {len(content)} content items with {len(bitmaps)} tags")
+    
+    @staticmethod
+    def _to_bitmap(positions, size):
+        bits = np.zeros(size, dtype=bool)
+        bits[positions] = True
+        return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+    
+    @staticmethod
+    def _from_bitmap(bitmap, size):
+        """Positions of the set bits of a bitmap, ascending"""
+        if not bitmap:
+            return np.empty(0, dtype=np.int64)
+        packed = np.frombuffer(bitmap.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(packed, bitorder='little')[:size])
+    
+    def invalidate(self):
+        """Mark the index stale so the next lookup reloads it (call after content changes)"""
+        with self._lock:
+            self._loaded_at = None
+    
+    def _snapshot(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.max_age:
+            self.refresh()
+        return self._index
+    
+    def get(self, content_id):
+        """Get the indexed fields of a content item (None if it does not exist)"""
+        return self._snapshot()['content'].get(content_id)
+    
+    def tags_of(self, content_id):
+        """Normalized tags of a content item"""
+        return list(self._snapshot()['tags'].get(content_id, []))
+    
+    def with_any_tag(self, tags):
+        """
+        Get the IDs of every content item sharing at least one of the given tags
+        
+        Args:
+            tags: Tag strings (matched after normalize_tag)
+            
+        Returns:
+            Set of content IDs
+        """
+        index = self._snapshot()
+        bitmap = 0
+        for tag in tags:
+            bitmap |= index['bitmaps'].get(normalize_tag(tag), 0)
+        return set(index['ids'][self._from_bitmap(bitmap, len(index['ids']))].tolist())
+    
+    def with_all_tags(self, tags):
+        """Get the IDs of every content item having all of the given tags"""
+        index = self._snapshot()
+        if not tags:
+            return set(index['content'])
+        bitmap = -1
+        for tag in tags:
+            bitmap &= index['bitmaps'].get(normalize_tag(tag), 0)
+        return set(index['ids'][self._from_bitmap(bitmap, len(index['ids']))].tolist())
+    
+    def similar_by_tags(self, content_id, limit=5, metric='jaccard'):
+        """
+        Rank other content items by how many tags they share with a content item
+        
+        Args:
+            content_id: ID of the reference content
+            limit: Maximum number of results
+            metric: 'jaccard' (shared / combined tags) or 'overlap' (shared tags)
+            
+        Returns:
+            List of (content_id, score, shared tag count) tuples, best first
+            (ties broken by content ID)
+        """
+        if metric not in SIMILARITY_METRICS:
+            raise ValueError(f"Unknown similarity metric: {metric}")
+        
+        index = self._snapshot()
+        position = index['positions'].get(content_id)
+        if position is None:
+            return []
+        
+        query_tags = index['tags'].get(content_id, [])
+        bitmaps = [index['bitmaps'][tag] for tag in query_tags if tag in index['bitmaps']]
+        size = len(index['ids'])
+        
+        # Bit-sliced counting: at_least[k] has the items sharing >= k + 1 tags
+        at_least = []
+        for bitmap in bitmaps:
+            at_least.append(0)
+            for k in range(len(at_least) - 1, 0, -1):
+                at_least[k] |= at_least[k - 1] & bitmap
+            at_least[0] |= bitmap
+        
+        exclude = ~(1 << position)
+        results = []
+        for k in range(len(at_least), 0, -1):
+            # Items sharing exactly k tags score at most k / |query tags| (Jaccard) or k
+            if len(results) >= limit and results[limit - 1][1] > self._score(metric, k, len(query_tags), k):
+                break
+            
+            exact = at_least[k - 1] & exclude
+            if k < len(at_least):
+                exact &= ~at_least[k]
+            members = self._from_bitmap(exact, size)
+            if not len(members):
+                continue
+            
+            scores = self._score(metric, k, len(query_tags), index['tag_counts'][members])
+            results.extend(zip(index['ids'][members].tolist(), np.broadcast_to(scores, members.shape).tolist(),
+                               [k] * len(members)))
+            results.sort(key=lambda result: (-result[1], result[0]))
+            del results[limit:]
+        
+        return results
+    
+    @staticmethod
+    def _score(metric, shared, query_count, candidate_count):
+        if metric == 'overlap':
+            return np.full(np.shape(candidate_count), float(shared))
+        return shared / (query_count + candidate_count - shared)
+
+# Shared by every engine in the process
+content_index = ContentIndex()
+
+def invalidate_content_index():
+    """Reload content on next use (call after adding or editing content)"""
+    content_index.invalidate()
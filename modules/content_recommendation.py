@@ -1,26 +1,41 @@
 import numpy as np
-import sqlite3
 import logging
-import json
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-
-# Make sure NLTK resources are downloaded
-try:
-    nltk.data.find('corpora/stopwords')
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('corpora/wordnet')
-except LookupError:
-    nltk.download('stopwords')
-    nltk.download('punkt')
-    nltk.download('wordnet')
+import threading
+from modules.db import get_connection
+from modules.parsed_content import get_parsed_content, content_version_column
+from modules.memo import request_memoized
+from modules.collaborative_filtering import INTERACTION_WEIGHTS
 
 logger = logging.getLogger(__name__)
 
+_nltk_ready = False
+_nltk_lock = threading.Lock()
+
+def ensure_nltk_resources():
+    """
+    Make sure NLTK resources are downloaded.
+    Runs once per process, on first use rather than at import time.
+    """
+    global _nltk_ready
+    if _nltk_ready:
+        return
+    
+    with _nltk_lock:
+        if _nltk_ready:
+            return
+        
+        import nltk
+        try:
+            nltk.data.find('corpora/stopwords')
+            nltk.data.find('tokenizers/punkt')
+            nltk.data.find('corpora/wordnet')
+        except LookupError:
+            nltk.download('stopwords')
+            nltk.download('punkt')
+            nltk.download('wordnet')
+        
+        _nltk_ready = True
+
 class ContentRecommendation:
     """
     Provides enhanced content recommendations using NLP techniques 
@@ -30,22 +45,49 @@ class ContentRecommendation:
     def __init__(self, db_path='database/adaptive_learning.db'):
         """Initialize with database path"""
         self.db_path = db_path
-        self.vectorizer = TfidfVectorizer(stop_words='english')
         self.content_vectors = None
         self.content_ids = None
-        self.lemmatizer = WordNetLemmatizer()
-        self.stop_words = set(stopwords.words('english'))
+        self._vectorizer = None
+        self._lemmatizer = None
+        self._stop_words = None
+    
+    @property
+    def vectorizer(self):
+        """TF-IDF vectorizer, created on first use"""
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            self._vectorizer = TfidfVectorizer(stop_words='english')
+        return self._vectorizer
+    
+    @property
+    def lemmatizer(self):
+        """WordNet lemmatizer, created on first use"""
+        if self._lemmatizer is None:
+            ensure_nltk_resources()
+            from nltk.stem import WordNetLemmatizer
+            self._lemmatizer = WordNetLemmatizer()
+        return self._lemmatizer
+    
+    @property
+    def stop_words(self):
+        """English stopword set, loaded on first use"""
+        if self._stop_words is None:
+            ensure_nltk_resources()
+            from nltk.corpus import stopwords
+            self._stop_words = set(stopwords.words('english'))
+        return self._stop_words
     
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
     def preprocess_text(self, text):
         """Preprocess text for NLP analysis"""
         if not text:
             return ""
+        ensure_nltk_resources()
+        from nltk.tokenize import word_tokenize
+        
         # Tokenize
         tokens = word_tokenize(text.lower())
         # Remove stopwords and lemmatize
@@ -60,8 +102,8 @@ class ContentRecommendation:
         conn = self.get_db_connection()
         
         # Get all content
-        contents = conn.execute('''
-            SELECT id, title, description, content_data, tags
+        contents = conn.execute(f'''
+            SELECT id, title, description, content_data, tags, {content_version_column(conn)}
             FROM content
         ''').fetchall()
         
@@ -73,7 +115,7 @@ class ContentRecommendation:
             content_text = f"{content['title']} {content['description']} "
             
             # Extract text from content_data (JSON)
-            content_data = json.loads(content['content_data'])
+            content_data = get_parsed_content(content['id'], content['version'], content['content_data'])
             for section in content_data.get('sections', []):
                 section_text = section.get('content', '')
                 content_text += section_text + " "
@@ -98,6 +140,8 @@ class ContentRecommendation:
     
     def get_content_similarity(self, content_id):
         """Calculate similarity between a content item and all others"""
+        from sklearn.metrics.pairwise import cosine_similarity
+        
         if self.content_vectors is None:
             self.build_content_vectors()
         
@@ -126,6 +170,7 @@ class ContentRecommendation:
         
         return content_similarities
     
+    @request_memoized
     def get_user_interests(self, user_id):
         """Extract user interests based on interaction history"""
         conn = self.get_db_connection()
@@ -150,13 +195,7 @@ class ContentRecommendation:
             count = interaction['interaction_count']
             
             # Weight different interaction types
-            weight = 1.0
-            if interaction_type == 'complete':
-                weight = 3.0
-            elif interaction_type == 'start':
-                weight = 1.5
-            elif interaction_type == 'like' or interaction_type == 'bookmark':
-                weight = 4.0
+            weight = INTERACTION_WEIGHTS.get(interaction_type, 1.0)
             
             if content_id not in content_interest:
                 content_interest[content_id] = 0
@@ -227,6 +266,8 @@ class ContentRecommendation:
     
     def recommend_for_user_interests(self, user_id, limit=5):
         """Recommend content based on user interests"""
+        from sklearn.metrics.pairwise import cosine_similarity
+        
         user_vector = self.get_user_content_vector(user_id)
         
         if user_vector is None or self.content_vectors is None:
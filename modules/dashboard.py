@@ -0,0 +1,267 @@
+import logging
+import threading
+import time
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from modules.user import UserProfile
+from modules.adaptation import AdaptationEngine
+from modules.registry import get_learning_style_detection, get_predictive_analytics
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on dashboard work running at once across all requests
+MAX_WORKERS = 8
+
+# Seconds a component may wait for a free worker before the dashboard falls
+# back to its default (the wait doesn't count towards its run time below)
+QUEUE_TIMEOUT = 1.0
+
+# Seconds each component may run before the dashboard falls back to its default
+COMPONENT_TIMEOUTS = {
+    'profile': 2.0,
+    'recommendations': 2.0,
+    'learning_style': 3.0,
+    'risk_assessment': 3.0,
+    'performance_prediction': 3.0,
+    'progress': 2.0
+}
+
+# Shared by all requests so concurrent dashboards can't spawn unbounded threads
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='dashboard')
+
+def default_learning_style():
+    """Learning style shown when AI detection is unavailable"""
+    return {
+        'style': 'visual',
+        'confidence': 0.5,
+        'description': 'Default learning style (AI not yet available)'
+    }
+
+def default_risk_assessment():
+    """Risk assessment shown when the disengagement model is unavailable"""
+    return {
+        'disengagement_risk': 'low',
+        'reason': 'Not enough data for analysis',
+        'intervention': None
+    }
+
+def default_performance_prediction():
+    """Prediction shown when the performance model is unavailable"""
+    return {
+        'predicted_performance': 0.75,
+        'confidence': 0.5,
+        'features_importance': {}
+    }
+
+class ComponentTask:
+    """
+    A dashboard component submitted to the executor. Its timeout counts from
+    when it starts running, so time spent queued behind other requests doesn't
+    use up its budget; a task still queued after QUEUE_TIMEOUT is cancelled.
+    """
+    
+    def __init__(self, executor, func):
+        """Submit func, run in a copy of the current (request) context so it shares the request memo"""
+        self._started = threading.Event()
+        self._started_at = None
+        self.future = executor.submit(copy_context().run, self._run, func)
+    
+    def _run(self, func):
+        self._started_at = time.perf_counter()
+        self._started.set()
+        return DashboardService._timed(func)
+    
+    def result(self, timeout):
+        """
+        Wait for the component
+        
+        Args:
+            timeout: Seconds it may run once started
+            
+        Returns:
+            Tuple of (result, elapsed seconds)
+            
+        Raises:
+            concurrent.futures.TimeoutError: If it never got a worker or ran too long
+        """
+        if not self._started.wait(QUEUE_TIMEOUT) and self.future.cancel():
+            raise FutureTimeoutError()
+        # Not cancellable means it has just started
+        self._started.wait()
+        remaining = timeout - (time.perf_counter() - self._started_at)
+        return self.future.result(timeout=max(remaining, 0))
+
+class DashboardService:
+    """
+    Builds the student dashboard by running its independent parts concurrently.
+    Each component opens its own pooled connection, has its own timeout and falls
+    back to a safe default, so the page costs roughly its slowest part.
+    """
+    
+    def __init__(self, executor=None):
+        """Initialize the service with the shared (or a custom) executor"""
+        self.executor = executor or _executor
+        self.user_profile = UserProfile()
+        self.adaptation_engine = AdaptationEngine()
+    
+    def _components(self, user_id):
+        """Map component name -> (callable, default factory)"""
+        return {
+            'profile': (
+                lambda: self.user_profile.get_profile(user_id, include_learning_style=False),
+                lambda: {'user_info': {}, 'knowledge_state': [], 'learning_path': {}, 'learning_style': None}
+            ),
+            'recommendations': (
+                lambda: self.adaptation_engine.get_recommendations(user_id),
+                list
+            ),
+            'learning_style': (
+                lambda: get_learning_style_detection().detect_learning_style(user_id),
+                default_learning_style
+            ),
+            'risk_assessment': (
+                lambda: get_predictive_analytics().predict_disengagement_risk(user_id),
+                default_risk_assessment
+            ),
+            'performance_prediction': (
+                lambda: get_predictive_analytics().predict_performance(user_id),
+                default_performance_prediction
+            ),
+            'progress': (
+                lambda: self.user_profile.get_progress_metrics(user_id),
+                lambda: {'average_mastery': 0, 'path_completion': 0, 'assessment_accuracy': 0, 'recent_activity': []}
+            )
+        }
+    
+    @staticmethod
+    def _timed(func):
+        """Run func and return (result, elapsed seconds)"""
+        start = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - start
+    
+    def get_dashboard_data(self, user_id):
+        """
+        Compute all dashboard components for a user in parallel
+        
+        Args:
+            user_id: ID of the user
+            
+        Returns:
+            Tuple of (data, timings) where data maps component name to its result
+            (or default) and timings maps component name to elapsed milliseconds
+        """
+        components = self._components(user_id)
+        start = time.perf_counter()
+        
+        tasks = {name: ComponentTask(self.executor, func) for name, (func, _) in components.items()}
+        
+        data = {}
+        timings = {}
+        
+        for name, task in tasks.items():
+            default = components[name][1]
+            
+            try:
+                data[name], elapsed = task.result(COMPONENT_TIMEOUTS[name])
+                timings[name] = elapsed * 1000
+            except FutureTimeoutError:
+                task.future.cancel()
+                logger.warning(f"Dashboard component {name} timed out for user {user_id}")
+                timings[name] = (time.perf_counter() - start) * 1000
+                data[name] = default()
+            except Exception as e:
+                logger.error(f"Error getting dashboard component {name}: {e}")
+                timings[name] = (time.perf_counter() - start) * 1000
+                data[name] = default()
+        
+        timings['total'] = (time.perf_counter() - start) * 1000
+        logger.info(
+            f"Dashboard for user {user_id} built in {timings['total']:.1f} ms ("
+            + ', '.join(f"{name}={ms:.1f}ms" for name, ms in timings.items() if name != 'total')
+            + ')'
+        )
+        
+        # The AI-detected style replaces the profile's own
+        data['profile']['learning_style'] = data['learning_style']
+        
+        return data, timings
+    
+    def get_analytics_bundle(self, user_id):
+        """
+        Compute every AI panel of the dashboard in one pass. The performance and
+        disengagement predictions share a single extract_features call, while the
+        learning style (which uses its own features) runs alongside on the pool.
+        
+        Args:
+            user_id: ID of the user
+            
+        Returns:
+            Tuple of (bundle, timings); prediction panels that could not be computed
+            carry the same error payload as the individual /api/ai endpoints
+        """
+        start = time.perf_counter()
+        timings = {}
+        
+        style_task = ComponentTask(
+            self.executor, lambda: get_learning_style_detection().detect_learning_style(user_id)
+        )
+        
+        analytics = get_predictive_analytics()
+        predictions = {'performance': None, 'disengagement': None}
+        
+        try:
+            features, elapsed = self._timed(lambda: analytics.extract_features(user_id))
+            timings['features'] = elapsed * 1000
+        except Exception as e:
+            logger.error(f"Error extracting dashboard features: {e}")
+            features = None
+        
+        if features is not None:
+            predictors = {
+                'performance': analytics.predict_performance,
+                'disengagement': analytics.predict_disengagement_risk
+            }
+            for name, predict in predictors.items():
+                try:
+                    predictions[name], elapsed = self._timed(lambda: predict(user_id, features))
+                    timings[name] = elapsed * 1000
+                except Exception as e:
+                    logger.error(f"Error getting dashboard component {name}: {e}")
+        
+        try:
+            learning_style, elapsed = style_task.result(COMPONENT_TIMEOUTS['learning_style'])
+            timings['learning_style'] = elapsed * 1000
+        except FutureTimeoutError:
+            style_task.future.cancel()
+            logger.warning(f"Dashboard component learning_style timed out for user {user_id}")
+            learning_style = default_learning_style()
+        except Exception as e:
+            logger.error(f"Error getting dashboard component learning_style: {e}")
+            learning_style = default_learning_style()
+        
+        timings['total'] = (time.perf_counter() - start) * 1000
+        
+        bundle = {
+            'user_id': user_id,
+            'performance': predictions['performance'] or self._prediction_error(),
+            'disengagement': predictions['disengagement'] or self._prediction_error(),
+            'learning_style': learning_style,
+            'learning_style_visualization': '/api/ai/user/learning-style/visualization.png'
+        }
+        
+        return bundle, timings
+    
+    @staticmethod
+    def _prediction_error():
+        """Error payload used when a prediction is unavailable"""
+        return {
+            'error': 'Could not generate prediction',
+            'message': 'Not enough data available or model not trained'
+        }
+    
+    @staticmethod
+    def server_timing_header(timings):
+        """Format component timings as a Server-Timing header value"""
+        return ', '.join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
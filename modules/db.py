@@ -0,0 +1,107 @@
+import queue
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = 'database/adaptive_learning.db'
+
+# Idle connections kept per database file; extra connections are closed on release
+POOL_SIZE = 8
+
+class PooledConnection(sqlite3.Connection):
+    """
+    SQLite connection that returns itself to its pool when closed, so the
+    existing `conn = get_db_connection() ... conn.close()` pattern reuses
+    connections instead of reopening the database file every time.
+    """
+    
+    def close(self):
+        """Hand the connection back to its pool (or really close it if unpooled)"""
+        pool = getattr(self, 'pool', None)
+        if pool is None:
+            super().close()
+        else:
+            pool.release(self)
+    
+    def discard(self):
+        """Close the underlying connection for good"""
+        self.pool = None
+        super().close()
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections for one database file.
+    Connections may be used from any thread, but only by one thread at a time.
+    """
+    
+    def __init__(self, db_path, size=POOL_SIZE):
+        """Initialize an empty pool for the given database path"""
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, factory=PooledConnection, check_same_thread=False)
+        conn.pool = self
+        return conn
+    
+    def acquire(self):
+        """Get an idle connection, opening a new one if none is available"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        
+        conn.row_factory = sqlite3.Row
+        conn.checked_out = True
+        return conn
+    
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted changes"""
+        # Guard against double close() handing the same connection out twice
+        if not getattr(conn, 'checked_out', False):
+            return
+        conn.checked_out = False
+        
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.discard()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            conn.discard()
+    
+    def close_all(self):
+        """Close every idle connection in the pool"""
+        while True:
+            try:
+                self._idle.get_nowait().discard()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection(db_path=DEFAULT_DB_PATH):
+    """
+    Get a pooled connection for the given database.
+    Rows are returned as sqlite3.Row and close() hands the connection back.
+    
+    Args:
+        db_path: Path to the SQLite database file
+        
+    Returns:
+        A PooledConnection
+    """
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[db_path] = pool
+    
+    return pool.acquire()
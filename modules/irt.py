@@ -0,0 +1,440 @@
+import argparse
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from modules.db import get_connection
+from modules.item_bank import item_bank
+
+logger = logging.getLogger(__name__)
+
+# Ability grid used for ability estimation and the precomputed information tables
+THETA_GRID = np.linspace(-4.0, 4.0, 81)
+
+# Quadrature points for marginal maximum likelihood calibration
+CALIBRATION_NODES = np.linspace(-4.0, 4.0, 41)
+
+# Rows fetched from user_responses per round trip while loading
+CHUNK_ROWS = 200000
+
+# Responses expanded over the quadrature points at once during the E-step
+BLOCK_RESPONSES = 100000
+
+# Items with fewer responses keep the parameters derived from their difficulty
+MIN_ITEM_RESPONSES = 30
+
+PARAM_BOUNDS = {
+    'discrimination': (0.2, 4.0),
+    'difficulty': (-4.0, 4.0)
+}
+
+# Weak normal priors keeping items that everyone (or no one) answers correctly finite
+DISCRIMINATION_PRIOR = (1.0, 1.0)    # (mean, standard deviation)
+INTERCEPT_PRIOR_SD = 5.0
+
+# assessment_items.difficulty (1 easy .. 2 challenging) mapped onto the ability
+# scale for items that have not been calibrated yet
+HEURISTIC_DIFFICULTY_CENTER = 1.5
+HEURISTIC_DIFFICULTY_SCALE = 2.0
+
+# Computerized adaptive testing: stop once the ability estimate is this precise
+# (after at least CAT_MIN_ITEMS answers) or after CAT_MAX_ITEMS answers
+CAT_MIN_ITEMS = 2
+CAT_MAX_ITEMS = 5
+CAT_TARGET_SE = 0.5
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def _log_prior(points):
+    """Standard normal log-density on a grid, normalized over the grid"""
+    log_density = -0.5 * points ** 2
+    return log_density - np.log(np.exp(log_density).sum())
+
+def heuristic_parameters(difficulty):
+    """(discrimination, difficulty) of an uncalibrated item from its difficulty rating"""
+    b = (difficulty - HEURISTIC_DIFFICULTY_CENTER) * HEURISTIC_DIFFICULTY_SCALE
+    return 1.0, float(np.clip(b, *PARAM_BOUNDS['difficulty']))
+
+class IRTEngine:
+    """
+    Two-parameter logistic (2PL) item response model:
+    P(correct | theta) = 1 / (1 + exp(-a * (theta - b))).
+    
+    Item information a^2 * P * (1 - P) and the answer log-likelihoods are
+    precomputed for every item at every point of THETA_GRID, so estimating
+    ability and picking the most informative next item are array lookups.
+    """
+    
+    def __init__(self, db_path='database/adaptive_learning.db'):
+        """Initialize the engine; parameters and tables are loaded on first use"""
+        self.db_path = db_path
+        self.parameters = {}
+        # item_parameters_marker when the parameters were loaded
+        self._parameters_marker = None
+        self._lock = threading.Lock()
+        self._log_prior = _log_prior(THETA_GRID)
+        # Tables are rebuilt whenever the item bank reloads its items
+        self._tables = None
+        self._tables_source = None
+    
+    def load_parameters(self):
+        """Load calibrated item parameters from the irt_item_parameters table"""
+        # Marker first, so a calibration finishing meanwhile is picked up by the next refresh
+        marker = item_parameters_marker(self.db_path)
+        self.parameters = load_item_parameters(self.db_path)
+        with self._lock:
+            self._tables = None
+        self._parameters_marker = marker
+        logger.info(f"Loaded IRT parameters for {len(self.parameters)} assessment items")
+    
+    def refresh_parameters(self):
+        """Reload item parameters if a calibration run stored new ones since they were loaded"""
+        if item_parameters_marker(self.db_path) != self._parameters_marker:
+            self.load_parameters()
+    
+    def _get_tables(self):
+        items = item_bank.get_items()
+        tables = self._tables
+        if tables is not None and self._tables_source is items:
+            return tables
+        
+        with self._lock:
+            if self._tables is not None and self._tables_source is items:
+                return self._tables
+            
+            item_ids = sorted(items)
+            a = np.empty(len(item_ids))
+            b = np.empty(len(item_ids))
+            for row, item_id in enumerate(item_ids):
+                params = self.parameters.get(item_id)
+                if params is None:
+                    params = heuristic_parameters(items[item_id]['difficulty'] or HEURISTIC_DIFFICULTY_CENTER)
+                a[row], b[row] = params
+            
+            p = _sigmoid(a[:, None] * (THETA_GRID[None, :] - b[:, None]))
+            p = np.clip(p, 1e-9, 1 - 1e-9)
+            tables = {
+                'rows': {item_id: row for row, item_id in enumerate(item_ids)},
+                'log_p': np.log(p),
+                'log_q': np.log1p(-p),
+                'information': (a ** 2)[:, None] * p * (1 - p)
+            }
+            self._tables = tables
+            self._tables_source = items
+            return tables
+    
+    def estimate_ability(self, item_ids, correct):
+        """
+        Expected a posteriori (EAP) ability estimate with a standard normal prior
+        
+        Args:
+            item_ids: IDs of the answered items
+            correct: Whether each answer was correct
+            
+        Returns:
+            Tuple of (ability, standard error)
+        """
+        tables = self._get_tables()
+        log_posterior = self._log_prior.copy()
+        
+        rows = [tables['rows'][item_id] for item_id in item_ids if item_id in tables['rows']]
+        if rows:
+            outcomes = np.array([bool(c) for item_id, c in zip(item_ids, correct)
+                                 if item_id in tables['rows']])
+            log_posterior += np.where(
+                outcomes[:, None], tables['log_p'][rows], tables['log_q'][rows]
+            ).sum(axis=0)
+        
+        posterior = np.exp(log_posterior - log_posterior.max())
+        posterior /= posterior.sum()
+        theta = float(posterior @ THETA_GRID)
+        se = float(np.sqrt(posterior @ (THETA_GRID - theta) ** 2))
+        return theta, se
+    
+    def select_next_item(self, candidate_ids, theta, exclude=()):
+        """
+        Pick the candidate item with maximum Fisher information at an ability
+        
+        Args:
+            candidate_ids: IDs of the items that may be asked
+            theta: Current ability estimate
+            exclude: IDs of items already asked
+            
+        Returns:
+            ID of the most informative item, or None if no candidate is left
+        """
+        tables = self._get_tables()
+        exclude = set(exclude)
+        candidates = sorted(item_id for item_id in candidate_ids
+                            if item_id not in exclude and item_id in tables['rows'])
+        if not candidates:
+            return None
+        
+        point = int(np.clip(np.searchsorted(THETA_GRID, theta), 0, len(THETA_GRID) - 1))
+        if point > 0 and theta - THETA_GRID[point - 1] < THETA_GRID[point] - theta:
+            point -= 1
+        
+        information = tables['information'][[tables['rows'][item_id] for item_id in candidates], point]
+        return candidates[int(np.argmax(information))]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_irt_engine():
+    """Get the shared IRT engine, with the latest calibrated parameters"""
+    global _engine
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            engine = _engine
+            if engine is None:
+                engine = IRTEngine()
+                engine.load_parameters()
+                _engine = engine
+                return engine
+    engine.refresh_parameters()
+    return engine
+
+def item_parameters_marker(db_path='database/adaptive_learning.db'):
+    """
+    Change marker of the irt_item_parameters table: (row count, latest calibrated_at),
+    or None if it can't be read
+    """
+    try:
+        conn = get_connection(db_path)
+        try:
+            return tuple(conn.execute('SELECT COUNT(*), MAX(calibrated_at) FROM irt_item_parameters').fetchone())
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return None
+
+def load_item_parameters(db_path='database/adaptive_learning.db'):
+    """
+    Read calibrated 2PL parameters
+    
+    Returns:
+        Dictionary {item_id: (discrimination, difficulty)}; empty if none are stored
+    """
+    try:
+        conn = get_connection(db_path)
+        try:
+            rows = conn.execute(
+                'SELECT assessment_item_id, discrimination, difficulty FROM irt_item_parameters'
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError as e:
+        # No database or schema not updated yet (run database/update_db.py)
+        logger.warning(f"Using heuristic IRT parameters: {e}")
+        rows = []
+    
+    return {row['assessment_item_id']: (row['discrimination'], row['difficulty']) for row in rows}
+
+def load_responses(db_path, chunk_rows=CHUNK_ROWS):
+    """
+    Stream every graded response ordered by user
+    
+    Returns:
+        Tuple of (user starts, item IDs, outcomes) arrays; user_starts[k] is the
+        first response of the k-th user
+    """
+    conn = get_connection(db_path)
+    conn.row_factory = None
+    chunks = []
+    
+    try:
+        cursor = conn.execute(
+            '''
+            SELECT ur.user_id, ur.assessment_item_id, ur.is_correct
+            FROM user_responses ur
+            JOIN assessment_items ai ON ur.assessment_item_id = ai.id
+            ORDER BY ur.user_id
+            '''
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 3))
+    finally:
+        conn.close()
+    
+    data = np.vstack(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+    users = data[:, 0]
+    user_starts = np.flatnonzero(np.concatenate(([True], users[1:] != users[:-1]))) if len(users) else users
+    return user_starts, data[:, 1], (data[:, 2] != 0).astype(np.uint8)
+
+def _response_blocks(user_starts, total, block_responses):
+    """Yield (start, end, local user starts) for groups of whole users"""
+    ends = np.append(user_starts[1:], total)
+    first = 0
+    while first < len(user_starts):
+        start = user_starts[first]
+        last = int(np.searchsorted(ends, start + block_responses, side='right'))
+        last = max(last, first + 1)
+        yield start, ends[last - 1], user_starts[first:last] - start
+        first = last
+
+def calibrate(user_starts, item_rows, outcomes, item_count, max_iter=100, tolerance=1e-3,
+              block_responses=BLOCK_RESPONSES):
+    """
+    Marginal maximum likelihood calibration of 2PL items with EM (Bock-Aitkin).
+    The E-step works on blocks of whole users, so memory is bounded by
+    block_responses x quadrature points; the M-step is a vectorized Newton
+    step per item.
+    
+    Args:
+        user_starts: Index of each user's first response
+        item_rows: Item row (0..item_count-1) of each response
+        outcomes: 1 for a correct response, 0 otherwise
+        item_count: Number of items
+        max_iter: Maximum EM iterations
+        tolerance: Stop when no parameter moves more than this
+        block_responses: Responses expanded over the quadrature points at once
+        
+    Returns:
+        Tuple of (discrimination array, difficulty array, marginal log-likelihood)
+    """
+    nodes = CALIBRATION_NODES
+    node_count = len(nodes)
+    log_prior = _log_prior(nodes)
+    
+    # Start every item at unit discrimination and the difficulty implied by its p-value
+    correct = np.bincount(item_rows, weights=outcomes, minlength=item_count)
+    seen = np.bincount(item_rows, minlength=item_count)
+    p_value = (correct + 0.5) / (seen + 1.0)
+    a = np.ones(item_count)
+    c = np.log(p_value / (1 - p_value))    # logit = a * theta + c, so b = -c / a
+    log_likelihood = None
+    
+    flat_nodes = np.arange(node_count)
+    a_mean, a_sd = DISCRIMINATION_PRIOR
+    
+    for iteration in range(max_iter):
+        p = np.clip(_sigmoid(a[:, None] * nodes[None, :] + c[:, None]), 1e-9, 1 - 1e-9)
+        log_p, log_q = np.log(p), np.log1p(-p)
+        
+        # E-step: expected number of responses (n) and correct responses (r)
+        # per item at each quadrature point
+        n = np.zeros(item_count * node_count)
+        r = np.zeros(item_count * node_count)
+        log_likelihood = 0.0
+        
+        for start, end, local_starts in _response_blocks(user_starts, len(item_rows), block_responses):
+            rows = item_rows[start:end]
+            observed = outcomes[start:end].astype(bool)
+            
+            user_log = np.add.reduceat(np.where(observed[:, None], log_p[rows], log_q[rows]), local_starts, axis=0)
+            user_log += log_prior
+            peak = user_log.max(axis=1, keepdims=True)
+            posterior = np.exp(user_log - peak)
+            total = posterior.sum(axis=1, keepdims=True)
+            posterior /= total
+            log_likelihood += float((peak + np.log(total)).sum())
+            
+            lengths = np.diff(np.append(local_starts, end - start))
+            weights = np.repeat(posterior, lengths, axis=0)
+            cells = (rows[:, None] * node_count + flat_nodes[None, :]).ravel()
+            n += np.bincount(cells, weights=weights.ravel(), minlength=item_count * node_count)
+            r += np.bincount(cells, weights=(weights * observed[:, None]).ravel(), minlength=item_count * node_count)
+        
+        n = n.reshape(item_count, node_count)
+        r = r.reshape(item_count, node_count)
+        
+        # M-step: Newton steps on (a, c) for every item at once
+        previous_a, previous_b = a.copy(), -c / a
+        for _ in range(5):
+            p = _sigmoid(a[:, None] * nodes[None, :] + c[:, None])
+            residual = r - n * p
+            weight = n * p * (1 - p)
+            
+            grad_a = (residual * nodes).sum(axis=1) - (a - a_mean) / a_sd ** 2
+            grad_c = residual.sum(axis=1) - c / INTERCEPT_PRIOR_SD ** 2
+            h_aa = -(weight * nodes ** 2).sum(axis=1) - 1 / a_sd ** 2
+            h_ac = -(weight * nodes).sum(axis=1)
+            h_cc = -weight.sum(axis=1) - 1 / INTERCEPT_PRIOR_SD ** 2
+            det = h_aa * h_cc - h_ac ** 2
+            
+            a = a - (h_cc * grad_a - h_ac * grad_c) / det
+            c = c - (h_aa * grad_c - h_ac * grad_a) / det
+            
+            a = np.clip(a, *PARAM_BOUNDS['discrimination'])
+            c = -a * np.clip(-c / a, *PARAM_BOUNDS['difficulty'])
+        
+        change = max(np.abs(a - previous_a).max(initial=0.0), np.abs(-c / a - previous_b).max(initial=0.0))
+        if change < tolerance:
+            logger.info(f"IRT calibration converged after {iteration + 1} iterations")
+            break
+    
+    return a, -c / a, log_likelihood
+
+def calibrate_items(db_path='database/adaptive_learning.db', min_responses=MIN_ITEM_RESPONSES, max_iter=100):
+    """
+    Calibrate 2PL parameters for every assessment item from user_responses and
+    store them in irt_item_parameters, where shared engines pick them up.
+    
+    Args:
+        db_path: Path to the SQLite database
+        min_responses: Items with fewer responses are not stored
+        max_iter: Maximum EM iterations
+        
+    Returns:
+        Dictionary {item_id: (discrimination, difficulty)} of the stored items
+    """
+    start = time.perf_counter()
+    user_starts, item_ids, outcomes = load_responses(db_path)
+    if not len(item_ids):
+        logger.info("No responses to calibrate items with")
+        return {}
+    
+    unique_ids, item_rows = np.unique(item_ids, return_inverse=True)
+    counts = np.bincount(item_rows, minlength=len(unique_ids))
+    logger.info(f"Loaded {len(item_ids)} responses for {len(unique_ids)} items "
+                f"in {time.perf_counter() - start:.1f}s")
+    
+    a, b, log_likelihood = calibrate(user_starts, item_rows, outcomes, len(unique_ids), max_iter=max_iter)
+    
+    timestamp = datetime.now()
+    calibrated = {}
+    rows = []
+    for item_id, discrimination, difficulty, count in zip(unique_ids.tolist(), a.tolist(), b.tolist(), counts.tolist()):
+        if count < min_responses:
+            continue
+        calibrated[item_id] = (discrimination, difficulty)
+        rows.append((item_id, discrimination, difficulty, count, timestamp))
+    
+    conn = get_connection(db_path)
+    conn.executemany(
+        '''
+        INSERT INTO irt_item_parameters
+        (assessment_item_id, discrimination, difficulty, response_count, calibrated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (assessment_item_id) DO UPDATE SET
+            discrimination = excluded.discrimination,
+            difficulty = excluded.difficulty,
+            response_count = excluded.response_count,
+            calibrated_at = excluded.calibrated_at
+        ''',
+        rows
+    )
+    conn.commit()
+    conn.close()
+    
+    logger.info(f"Calibrated {len(calibrated)} items (log-likelihood {log_likelihood:.1f}) "
+                f"in {time.perf_counter() - start:.1f}s")
+    return calibrated
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Calibrate 2PL item parameters from user_responses')
+    parser.add_argument('--min-responses', type=int, default=MIN_ITEM_RESPONSES)
+    parser.add_argument('--max-iter', type=int, default=100)
+    args = parser.parse_args()
+    
+    calibrate_items(min_responses=args.min_responses, max_iter=args.max_iter)
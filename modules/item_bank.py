@@ -0,0 +1,141 @@
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Safety net for item edits made outside this process (seconds)
+ITEM_BANK_MAX_AGE = 600
+
+class ItemBank:
+    """
+    In-memory copy of the assessment_items table.
+    Items are bucketed by knowledge component with their difficulties kept in
+    sorted arrays, so the items nearest to a target difficulty are found with a
+    bisect instead of an `ORDER BY ABS(difficulty - ?)` scan.
+    """
+    
+    def __init__(self, db_path='database/adaptive_learning.db', max_age=ITEM_BANK_MAX_AGE):
+        """Initialize an empty bank; items are loaded on first use"""
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.items = {}
+        # (buckets, difficulties) swapped as one object so readers see a consistent pair
+        self._index = ({}, {})
+    
+    def refresh(self):
+        """Reload every item from the database"""
+        conn = get_connection(self.db_path)
+        rows = conn.execute(
+            '''
+            SELECT id, question_text, question_type, options, correct_answer,
+                   explanation, difficulty, knowledge_component_id
+            FROM assessment_items
+            '''
+        ).fetchall()
+        conn.close()
+        
+        items = {}
+        buckets = {}
+        for row in rows:
+            item = {
+                'id': row['id'],
+                'text': row['question_text'],
+                'type': row['question_type'],
+                'options': json.loads(row['options']) if row['options'] else None,
+                'correct_answer': row['correct_answer'],
+                'explanation': row['explanation'],
+                'difficulty': row['difficulty'],
+                'knowledge_component_id': row['knowledge_component_id']
+            }
+            items[item['id']] = item
+            buckets.setdefault(item['knowledge_component_id'], []).append(item)
+        
+        difficulties = {}
+        for kc_id, bucket in buckets.items():
+            bucket.sort(key=lambda item: (item['difficulty'], item['id']))
+            difficulties[kc_id] = [item['difficulty'] for item in bucket]
+        
+        with self._lock:
+            self.items = items
+            self._index = (buckets, difficulties)
+            self._loaded_at = time.monotonic()
+        
+        logger.info(f"Loaded {len(items)} assessment items for {len(buckets)} knowledge components")
+    
+    def invalidate(self):
+        """Mark the bank stale so the next lookup reloads it (call after item changes)"""
+        with self._lock:
+            self._loaded_at = None
+    
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.max_age:
+            self.refresh()
+    
+    def get_item(self, item_id):
+        """Get a single item by ID (None if it does not exist)"""
+        self._ensure_loaded()
+        return self.items.get(item_id)
+    
+    def get_items(self):
+        """
+        Get every item keyed by ID. The dictionary is replaced (never modified)
+        when the bank reloads, so callers may cache values derived from it
+        for as long as get_items() returns the same object.
+        """
+        self._ensure_loaded()
+        return self.items
+    
+    def component_items(self, kc_id):
+        """Get every item of a knowledge component ordered by difficulty"""
+        self._ensure_loaded()
+        return list(self._index[0].get(kc_id, []))
+    
+    def nearest_items(self, kc_id, target_difficulty, limit=3):
+        """
+        Get the items of a knowledge component closest to a target difficulty
+        
+        Args:
+            kc_id: ID of the knowledge component
+            target_difficulty: Desired item difficulty
+            limit: Maximum number of items to return
+            
+        Returns:
+            List of item dictionaries ordered by distance from the target
+        """
+        self._ensure_loaded()
+        buckets, difficulties_by_kc = self._index
+        bucket = buckets.get(kc_id)
+        if not bucket:
+            return []
+        difficulties = difficulties_by_kc[kc_id]
+        
+        # Only the `limit` items on either side of the insertion point can be
+        # nearest; widen to whole runs of equal difficulty so ties break by id
+        position = bisect_left(difficulties, target_difficulty)
+        low = bisect_left(difficulties, difficulties[max(position - limit, 0)])
+        high = bisect_right(difficulties, difficulties[min(position + limit, len(bucket)) - 1])
+        
+        candidates = bucket[low:high]
+        candidates.sort(key=lambda item: (abs(item['difficulty'] - target_difficulty), item['id']))
+        
+        return candidates[:limit]
+
+# Shared by every AssessmentEngine in the process
+item_bank = ItemBank()
+
+def invalidate_item_bank():
+    """
+    Reload assessment items on next use. The app itself never writes
+    assessment_items, so items added or edited in the database (database/init_db.py,
+    admin scripts, by hand) reach running processes only once the bank is
+    ITEM_BANK_MAX_AGE seconds old; code that writes items in-process should call this.
+    """
+    item_bank.invalidate()
@@ -0,0 +1,389 @@
+import argparse
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Bayesian Knowledge Tracing parameters used for components without fitted values
+DEFAULT_BKT_PARAMS = {
+    'p_init': 0.0,    # probability the component is already known (new users start at 0 mastery)
+    'p_learn': 0.1,   # probability of learning it after each practice opportunity
+    'p_slip': 0.1,    # probability of answering wrong despite knowing it
+    'p_guess': 0.2    # probability of answering right without knowing it
+}
+
+# Learning rate of the original fixed-step mastery update
+LINEAR_LEARNING_RATE = 0.1
+
+DEFAULT_ENGINE = 'bkt'
+
+class KnowledgeTracingEngine(ABC):
+    """
+    Base class for mastery models. An engine only defines how one observation
+    moves mastery (`step`, vectorized over numpy arrays); updating a single
+    submission and replaying whole response histories share the same loop.
+    """
+    
+    name = None
+    
+    def __init__(self, parameters=None):
+        """Initialize the engine with optional per-KC parameters {kc_id: {name: value}}"""
+        self.parameters = dict(parameters or {})
+        # Database the parameters were loaded from, and its kc_parameters_marker then
+        self.db_path = None
+        self._parameters_marker = None
+    
+    def set_parameters(self, parameters):
+        """Replace the per-KC parameters"""
+        self.parameters = dict(parameters)
+    
+    def load_parameters(self, db_path='database/adaptive_learning.db'):
+        """Load stored per-KC parameters (engines without fitted parameters keep defaults)"""
+    
+    def refresh_parameters(self):
+        """Reload stored parameters if they changed since they were loaded"""
+    
+    def params_for(self, kc_ids):
+        """Per-KC parameter arrays aligned with kc_ids"""
+        return {}
+    
+    def initial_mastery(self, params, count):
+        """Mastery of `count` components before any observation"""
+        return np.zeros(count)
+    
+    @abstractmethod
+    def step(self, mastery, outcomes, params):
+        """Return mastery after observing outcomes (arrays of equal length)"""
+    
+    @abstractmethod
+    def weight_params(self, params, weights):
+        """
+        Parameter arrays adjusted for how relevant the content is to each component
+        
+        Args:
+            params: Parameter arrays from params_for
+            weights: Relevance weight per component, aligned with the arrays
+        """
+    
+    def run_sequences(self, mastery, params, outcomes, offsets, lengths):
+        """
+        Apply observation sequences to many mastery values at once.
+        
+        Args:
+            mastery: Starting mastery, one value per sequence
+            params: Parameter arrays, one value per sequence
+            outcomes: Flat array of all observations (1 correct, 0 wrong, or a score)
+            offsets: Start of each sequence in outcomes
+            lengths: Length of each sequence
+            
+        Returns:
+            Array of final mastery values, one per sequence
+        """
+        mastery = np.asarray(mastery, dtype=float)
+        lengths = np.asarray(lengths)
+        if not len(lengths):
+            return mastery
+        
+        # Longest sequences first: at step t only the first `active` sequences
+        # still have observations, so every step works on contiguous slices
+        order = np.argsort(-lengths, kind='stable')
+        sorted_lengths = lengths[order]
+        current = mastery[order]
+        sorted_params = {name: values[order] for name, values in params.items()}
+        sorted_offsets = np.asarray(offsets)[order]
+        
+        for t in range(int(sorted_lengths[0])):
+            active = np.searchsorted(-sorted_lengths, -t, side='left')
+            step_params = {name: values[:active] for name, values in sorted_params.items()}
+            current[:active] = self.step(current[:active], outcomes[sorted_offsets[:active] + t], step_params)
+        
+        result = np.empty_like(current)
+        result[order] = current
+        return result
+    
+    def update(self, kc_ids, prior, observations, weights=None):
+        """
+        Online update for one submission.
+        
+        Args:
+            kc_ids: Knowledge components being updated
+            prior: Current mastery for each of kc_ids
+            observations: (kc_id, score) pairs in answer order
+            weights: Optional {kc_id: relevance weight} of the content for each component,
+                applied through weight_params
+            
+        Returns:
+            Array of updated mastery values aligned with kc_ids
+        """
+        positions = {kc_id: i for i, kc_id in enumerate(kc_ids)}
+        grouped = [[] for _ in kc_ids]
+        for kc_id, score in observations:
+            if kc_id in positions:
+                grouped[positions[kc_id]].append(score)
+        
+        lengths = np.array([len(scores) for scores in grouped])
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(lengths) else lengths
+        outcomes = np.array([score for scores in grouped for score in scores], dtype=float)
+        
+        params = self.params_for(kc_ids)
+        if weights:
+            params = self.weight_params(params, np.array([weights.get(kc_id, 1.0) for kc_id in kc_ids], dtype=float))
+        
+        return self.run_sequences(np.asarray(prior, dtype=float), params, outcomes, offsets, lengths)
+    
+    def replay(self, kc_ids, outcomes, offsets, lengths):
+        """
+        Recompute mastery from scratch for many (user, component) response sequences.
+        
+        Args:
+            kc_ids: Knowledge component of each sequence
+            outcomes: Flat array of all responses, each sequence in time order
+            offsets: Start of each sequence in outcomes
+            lengths: Length of each sequence
+            
+        Returns:
+            Array of final mastery values, one per sequence
+        """
+        params = self.params_for(kc_ids)
+        return self.run_sequences(self.initial_mastery(params, len(kc_ids)), params, outcomes, offsets, lengths)
+
+class BKTEngine(KnowledgeTracingEngine):
+    """Bayesian Knowledge Tracing with per-KC init/learn/slip/guess probabilities"""
+    
+    name = 'bkt'
+    
+    def params_for(self, kc_ids):
+        """Per-KC BKT parameter arrays, falling back to DEFAULT_BKT_PARAMS"""
+        return {
+            param: np.array([
+                self.parameters.get(kc_id, {}).get(param, default) for kc_id in kc_ids
+            ], dtype=float)
+            for param, default in DEFAULT_BKT_PARAMS.items()
+        }
+    
+    def load_parameters(self, db_path='database/adaptive_learning.db'):
+        """Load fitted parameters from the kc_parameters table"""
+        # Marker first, so a fit finishing meanwhile is picked up by the next refresh
+        marker = kc_parameters_marker(db_path)
+        self.set_parameters(load_kc_parameters(db_path))
+        self.db_path = db_path
+        self._parameters_marker = marker
+        logger.info(f"Loaded BKT parameters for {len(self.parameters)} knowledge components")
+    
+    def refresh_parameters(self):
+        """Reload fitted parameters if a fitting run stored new ones since they were loaded"""
+        if self.db_path is not None and kc_parameters_marker(self.db_path) != self._parameters_marker:
+            self.load_parameters(self.db_path)
+    
+    def initial_mastery(self, params, count):
+        return params['p_init'].copy()
+    
+    def weight_params(self, params, weights):
+        """Scale the chance to learn from each practice opportunity by content relevance"""
+        weighted = dict(params)
+        weighted['p_learn'] = np.clip(params['p_learn'] * weights, 0.0, 1.0)
+        return weighted
+    
+    def step(self, mastery, outcomes, params):
+        slip = params['p_slip']
+        guess = params['p_guess']
+        correct = outcomes >= 0.5
+        
+        # Posterior probability of knowing the component given the answer
+        known = np.where(correct, mastery * (1 - slip), mastery * slip)
+        unknown = np.where(correct, (1 - mastery) * guess, (1 - mastery) * (1 - guess))
+        total = known + unknown
+        posterior = np.divide(known, total, out=mastery.copy(), where=total > 0)
+        
+        # Chance to learn the component from this practice opportunity
+        return posterior + (1 - posterior) * params['p_learn']
+
+class LinearEngine(KnowledgeTracingEngine):
+    """The original fixed learning-rate update: mastery moves 10% towards the score"""
+    
+    name = 'linear'
+    
+    def params_for(self, kc_ids):
+        return {
+            'rate': np.array([
+                self.parameters.get(kc_id, {}).get('rate', LINEAR_LEARNING_RATE) for kc_id in kc_ids
+            ], dtype=float)
+        }
+    
+    def step(self, mastery, outcomes, params):
+        return np.clip(mastery + params['rate'] * (outcomes - mastery), 0.0, 1.0)
+    
+    def weight_params(self, params, weights):
+        """Scale the learning rate by content relevance"""
+        return {'rate': params['rate'] * weights}
+    
+    def update(self, kc_ids, prior, observations, weights=None):
+        """One step per component towards its average score, scaled by relevance weight"""
+        weights = weights or {}
+        totals = {}
+        for kc_id, score in observations:
+            totals.setdefault(kc_id, []).append(score)
+        
+        prior = np.asarray(prior, dtype=float)
+        rates = self.weight_params(self.params_for(kc_ids),
+                                   np.array([weights.get(kc_id, 1.0) for kc_id in kc_ids]))['rate']
+        averages = np.array([np.mean(totals[kc_id]) if kc_id in totals else 0.0 for kc_id in kc_ids])
+        has_scores = np.array([kc_id in totals for kc_id in kc_ids], dtype=bool)
+        
+        updated = self.step(prior, averages, {'rate': rates})
+        return np.where(has_scores, updated, prior)
+
+ENGINES = {
+    BKTEngine.name: BKTEngine,
+    LinearEngine.name: LinearEngine
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(name=DEFAULT_ENGINE):
+    """Get the shared instance of a knowledge tracing engine, with its latest stored parameters"""
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = ENGINES[name]()
+                engine.load_parameters()
+                _engines[name] = engine
+                return engine
+    engine.refresh_parameters()
+    return engine
+
+def kc_parameters_marker(db_path='database/adaptive_learning.db'):
+    """
+    Change marker of the kc_parameters table: (row count, latest fitted_at),
+    or None if it can't be read
+    """
+    try:
+        conn = get_connection(db_path)
+        try:
+            return tuple(conn.execute('SELECT COUNT(*), MAX(fitted_at) FROM kc_parameters').fetchone())
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return None
+
+def load_kc_parameters(db_path='database/adaptive_learning.db'):
+    """
+    Read fitted BKT parameters
+    
+    Returns:
+        Dictionary {kc_id: {p_init, p_learn, p_slip, p_guess}}; empty if none are stored
+    """
+    try:
+        conn = get_connection(db_path)
+        try:
+            rows = conn.execute(
+                'SELECT knowledge_component_id, p_init, p_learn, p_slip, p_guess FROM kc_parameters'
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError as e:
+        # No database or schema not updated yet (run database/update_db.py)
+        logger.warning(f"Using default BKT parameters: {e}")
+        rows = []
+    
+    return {
+        row['knowledge_component_id']: {param: row[param] for param in DEFAULT_BKT_PARAMS}
+        for row in rows
+    }
+
+def replay_history(engine=None, db_path='database/adaptive_learning.db', user_ids=None, chunk_users=1000):
+    """
+    Recompute every user's mastery from the full user_responses history,
+    e.g. after knowledge tracing parameters change.
+    
+    Args:
+        engine: Engine to replay with (defaults to the shared default engine)
+        db_path: Path to the SQLite database
+        user_ids: Only replay these users (default: everyone with responses)
+        chunk_users: Number of users loaded and written per batch
+        
+    Returns:
+        Number of (user, knowledge component) states written
+    """
+    engine = engine or get_engine()
+    conn = get_connection(db_path)
+    # Plain tuples are much cheaper than sqlite3.Row for bulk reads
+    conn.row_factory = None
+    
+    try:
+        if user_ids is None:
+            user_ids = [row[0] for row in conn.execute(
+                'SELECT DISTINCT user_id FROM user_responses ORDER BY user_id'
+            )]
+        
+        start = time.perf_counter()
+        written = 0
+        
+        for i in range(0, len(user_ids), chunk_users):
+            chunk = user_ids[i:i + chunk_users]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'''
+                SELECT ur.user_id, ai.knowledge_component_id, ur.is_correct
+                FROM user_responses ur
+                JOIN assessment_items ai ON ur.assessment_item_id = ai.id
+                WHERE ur.user_id IN ({placeholders})
+                ORDER BY ur.user_id, ai.knowledge_component_id, ur.timestamp, ur.id
+                ''',
+                chunk
+            ).fetchall()
+            
+            if not rows:
+                continue
+            
+            data = np.array(rows, dtype=float)
+            users = data[:, 0].astype(np.int64)
+            kcs = data[:, 1].astype(np.int64)
+            outcomes = data[:, 2]
+            
+            # A new sequence starts wherever the (user, component) pair changes
+            boundaries = np.flatnonzero((np.diff(users) != 0) | (np.diff(kcs) != 0)) + 1
+            offsets = np.concatenate(([0], boundaries))
+            lengths = np.diff(np.concatenate((offsets, [len(outcomes)])))
+            
+            mastery = engine.replay(kcs[offsets].tolist(), outcomes, offsets, lengths)
+            
+            timestamp = datetime.now()
+            conn.executemany(
+                '''
+                INSERT INTO user_knowledge_state (user_id, knowledge_component_id, mastery_level, last_updated)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, knowledge_component_id) DO UPDATE SET
+                    mastery_level = excluded.mastery_level,
+                    last_updated = excluded.last_updated
+                ''',
+                zip(users[offsets].tolist(), kcs[offsets].tolist(), mastery.tolist(), [timestamp] * len(offsets))
+            )
+            conn.commit()
+            written += len(offsets)
+        
+        logger.info(f"Replayed {written} knowledge states for {len(user_ids)} users "
+                    f"with {engine.name} in {time.perf_counter() - start:.1f}s")
+        return written
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Recompute all mastery states from user_responses')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default=DEFAULT_ENGINE)
+    parser.add_argument('--chunk-users', type=int, default=1000, help='users loaded per batch')
+    args = parser.parse_args()
+    
+    replay_history(get_engine(args.engine), chunk_users=args.chunk_users)
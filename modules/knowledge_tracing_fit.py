@@ -0,0 +1,367 @@
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from modules.db import get_connection
+from modules.knowledge_tracing import DEFAULT_BKT_PARAMS, get_engine, replay_history
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from user_responses per round trip while streaming
+CHUNK_ROWS = 200000
+
+# Responses loaded into memory at once while fitting one knowledge component
+FIT_BATCH_RESPONSES = 1000000
+
+# Components with fewer responses keep the default parameters
+MIN_RESPONSES = 50
+
+# Bounds keeping EM away from degenerate solutions (e.g. slip/guess above 0.5
+# would mean "knowing" a component makes wrong answers more likely)
+PARAM_BOUNDS = {
+    'p_init': (1e-4, 0.99),
+    'p_learn': (1e-4, 0.99),
+    'p_slip': (1e-4, 0.45),
+    'p_guess': (1e-4, 0.45)
+}
+
+def spill_sequences(db_path, work_dir, chunk_rows=CHUNK_ROWS):
+    """
+    Stream user_responses ordered by (user_id, timestamp) and split them into
+    one on-disk shard per knowledge component. Each shard holds the outcomes of
+    every (user, component) sequence back to back plus the sequence lengths, so
+    memory use is bounded by one chunk no matter how large the history is.
+    
+    Args:
+        db_path: Path to the SQLite database
+        work_dir: Directory for the shard files
+        chunk_rows: Rows fetched per round trip
+        
+    Returns:
+        Dictionary {kc_id: number of responses}
+    """
+    conn = get_connection(db_path)
+    conn.row_factory = None
+    counts = {}
+    
+    try:
+        cursor = conn.execute(
+            '''
+            SELECT ur.user_id, ai.knowledge_component_id, ur.is_correct
+            FROM user_responses ur
+            JOIN assessment_items ai ON ur.assessment_item_id = ai.id
+            ORDER BY ur.user_id, ur.timestamp, ur.id
+            '''
+        )
+        
+        carry = np.empty((0, 3), dtype=np.int64)
+        
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            data = np.vstack((carry, np.array(rows, dtype=np.int64).reshape(-1, 3)))
+            
+            if rows:
+                # The last user may continue in the next chunk; hold their rows back
+                last_user = data[-1, 0]
+                cut = np.searchsorted(data[:, 0], last_user, side='left')
+                data, carry = data[:cut], data[cut:]
+            else:
+                carry = carry[:0]
+            
+            _write_shards(data, work_dir, counts)
+            
+            if not rows:
+                break
+    finally:
+        conn.close()
+    
+    return counts
+
+def _write_shards(data, work_dir, counts):
+    """Append the (user, component) sequences in data to the per-component shards"""
+    if not len(data):
+        return
+    
+    # Stable sort keeps each user's responses in time order within a component
+    order = np.lexsort((data[:, 1], data[:, 0]))
+    data = data[order]
+    
+    users, kcs, outcomes = data[:, 0], data[:, 1], data[:, 2].astype(np.uint8)
+    starts = np.flatnonzero(np.concatenate(([True], (np.diff(users) != 0) | (np.diff(kcs) != 0))))
+    lengths = np.diff(np.concatenate((starts, [len(data)]))).astype(np.int32)
+    sequence_kcs = kcs[starts]
+    
+    for kc_id in np.unique(sequence_kcs):
+        selected = sequence_kcs == kc_id
+        kc_lengths = lengths[selected]
+        kc_outcomes = np.concatenate([
+            outcomes[start:start + length] for start, length in zip(starts[selected], kc_lengths)
+        ])
+        
+        base = os.path.join(work_dir, f'kc_{kc_id}')
+        with open(base + '.outcomes', 'ab') as f:
+            kc_outcomes.tofile(f)
+        with open(base + '.lengths', 'ab') as f:
+            kc_lengths.tofile(f)
+        
+        counts[int(kc_id)] = counts.get(int(kc_id), 0) + len(kc_outcomes)
+
+def _batches(outcomes, lengths, batch_responses):
+    """Yield (outcomes, offsets, lengths) for groups of whole sequences"""
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)[:-1]))
+    start = 0
+    while start < len(lengths):
+        end = start + 1
+        total = int(lengths[start])
+        while end < len(lengths) and total + lengths[end] <= batch_responses:
+            total += int(lengths[end])
+            end += 1
+        
+        first = offsets[start]
+        yield (
+            np.asarray(outcomes[first:first + total], dtype=float),
+            offsets[start:end] - first,
+            np.asarray(lengths[start:end], dtype=np.int64)
+        )
+        start = end
+
+def _expected_counts(outcomes, offsets, lengths, params):
+    """
+    Forward-backward pass of the two-state BKT model over many sequences.
+    Sequences are processed longest first so step t works on a contiguous slice.
+    
+    Returns:
+        Dictionary of expected sufficient statistics and the log-likelihood
+    """
+    p_init, p_learn = params['p_init'], params['p_learn']
+    p_slip, p_guess = params['p_slip'], params['p_guess']
+    
+    order = np.argsort(-lengths, kind='stable')
+    lengths = lengths[order]
+    offsets = offsets[order]
+    steps = int(lengths[0])
+    active = [int(np.searchsorted(-lengths, -t, side='left')) for t in range(steps)]
+    
+    def emissions(t):
+        observed = outcomes[offsets[:active[t]] + t]
+        known = np.where(observed == 1, 1 - p_slip, p_slip)
+        unknown = np.where(observed == 1, p_guess, 1 - p_guess)
+        return observed, known, unknown
+    
+    # Forward pass with per-step normalization; alpha = P(state | answers so far)
+    alphas = []
+    emission_cache = []
+    log_likelihood = 0.0
+    known_alpha = unknown_alpha = None
+    
+    for t in range(steps):
+        observed, e_known, e_unknown = emissions(t)
+        emission_cache.append((observed, e_known, e_unknown))
+        if t == 0:
+            prior_known = np.full(active[0], p_init)
+        else:
+            n = active[t]
+            prior_known = known_alpha[:n] + unknown_alpha[:n] * p_learn
+        
+        known_alpha = prior_known * e_known
+        unknown_alpha = (1 - prior_known) * e_unknown
+        scale = known_alpha + unknown_alpha
+        known_alpha /= scale
+        unknown_alpha /= scale
+        log_likelihood += np.log(scale).sum()
+        alphas.append((known_alpha, unknown_alpha))
+    
+    counts = {
+        'init_known': 0.0,
+        'learn': 0.0, 'learn_from': 0.0,
+        'slip': 0.0, 'known': 0.0,
+        'guess': 0.0, 'unknown': 0.0
+    }
+    
+    # Backward pass; beta is kept relative to the forward normalization
+    known_beta = unknown_beta = None
+    
+    for t in range(steps - 1, -1, -1):
+        n = active[t]
+        known_alpha, unknown_alpha = alphas[t]
+        
+        if t == steps - 1:
+            known_beta = np.ones(n)
+            unknown_beta = np.ones(n)
+        else:
+            m = active[t + 1]
+            _, e_known, e_unknown = emission_cache[t + 1]
+            
+            # Expected 0 -> 1 transitions between t and t + 1 (only the first m
+            # sequences continue past t)
+            to_known = e_known * known_beta
+            to_unknown = e_unknown * unknown_beta
+            stay_known = known_alpha[:m] * to_known
+            learn = unknown_alpha[:m] * p_learn * to_known
+            stay_unknown = unknown_alpha[:m] * (1 - p_learn) * to_unknown
+            total = stay_known + learn + stay_unknown
+            counts['learn'] += (learn / total).sum()
+            counts['learn_from'] += ((learn + stay_unknown) / total).sum()
+            
+            # Sequences that end at t start their backward pass here
+            new_known_beta = np.ones(n)
+            new_unknown_beta = np.ones(n)
+            new_known_beta[:m] = to_known
+            new_unknown_beta[:m] = p_learn * to_known + (1 - p_learn) * to_unknown
+            scale = known_alpha[:m] * new_known_beta[:m] + unknown_alpha[:m] * new_unknown_beta[:m]
+            new_known_beta[:m] /= scale
+            new_unknown_beta[:m] /= scale
+            known_beta, unknown_beta = new_known_beta, new_unknown_beta
+        
+        # Posterior state probabilities at t
+        gamma_known = known_alpha * known_beta
+        gamma_unknown = unknown_alpha * unknown_beta
+        norm = gamma_known + gamma_unknown
+        gamma_known /= norm
+        gamma_unknown /= norm
+        
+        observed = emission_cache[t][0]
+        counts['slip'] += (gamma_known * (observed == 0)).sum()
+        counts['known'] += gamma_known.sum()
+        counts['guess'] += (gamma_unknown * (observed == 1)).sum()
+        counts['unknown'] += gamma_unknown.sum()
+        if t == 0:
+            counts['init_known'] += gamma_known.sum()
+    
+    counts['sequences'] = active[0]
+    counts['log_likelihood'] = log_likelihood
+    return counts
+
+def fit_kc(kc_id, work_dir, max_iter=50, tolerance=1e-4, batch_responses=FIT_BATCH_RESPONSES):
+    """
+    Fit BKT parameters for one knowledge component with expectation-maximization.
+    Runs in a worker process; the shard is memory-mapped and visited in batches,
+    so memory stays bounded even for very large components.
+    
+    Returns:
+        Tuple of (kc_id, parameters, log-likelihood, response count)
+    """
+    base = os.path.join(work_dir, f'kc_{kc_id}')
+    outcomes = np.memmap(base + '.outcomes', dtype=np.uint8, mode='r')
+    lengths = np.fromfile(base + '.lengths', dtype=np.int32)
+    
+    params = dict(DEFAULT_BKT_PARAMS)
+    # EM cannot move a probability away from exactly 0
+    params['p_init'] = max(params['p_init'], 0.1)
+    previous = None
+    log_likelihood = None
+    
+    for _ in range(max_iter):
+        totals = {}
+        for batch in _batches(outcomes, lengths, batch_responses):
+            for key, value in _expected_counts(*batch, params).items():
+                totals[key] = totals.get(key, 0.0) + value
+        
+        log_likelihood = totals['log_likelihood']
+        updated = {
+            'p_init': totals['init_known'] / totals['sequences'],
+            'p_learn': totals['learn'] / totals['learn_from'] if totals['learn_from'] else params['p_learn'],
+            'p_slip': totals['slip'] / totals['known'] if totals['known'] else params['p_slip'],
+            'p_guess': totals['guess'] / totals['unknown'] if totals['unknown'] else params['p_guess']
+        }
+        params = {
+            name: float(np.clip(value, *PARAM_BOUNDS[name])) for name, value in updated.items()
+        }
+        
+        if previous is not None and abs(log_likelihood - previous) < tolerance * abs(previous):
+            break
+        previous = log_likelihood
+    
+    return kc_id, params, log_likelihood, len(outcomes)
+
+def fit_parameters(db_path='database/adaptive_learning.db', workers=None, chunk_rows=CHUNK_ROWS,
+                   min_responses=MIN_RESPONSES, max_iter=50):
+    """
+    Fit per-KC BKT parameters from the user_responses history and store them
+    in kc_parameters, where the knowledge tracing engine picks them up.
+    
+    Args:
+        db_path: Path to the SQLite database
+        workers: Number of fitting processes (default: CPU count)
+        chunk_rows: Rows streamed from the database per round trip
+        min_responses: Components with fewer responses are skipped
+        max_iter: Maximum EM iterations per component
+        
+    Returns:
+        Dictionary {kc_id: parameters} of the components that were fitted
+    """
+    start = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix='kc_fit_')
+    fitted = {}
+    
+    try:
+        counts = spill_sequences(db_path, work_dir, chunk_rows)
+        kc_ids = [kc_id for kc_id, count in counts.items() if count >= min_responses]
+        logger.info(f"Streamed {sum(counts.values())} responses for {len(counts)} knowledge components "
+                    f"in {time.perf_counter() - start:.1f}s; fitting {len(kc_ids)}")
+        
+        # Largest components first so one big component doesn't finish last alone
+        kc_ids.sort(key=lambda kc_id: counts[kc_id], reverse=True)
+        
+        timestamp = datetime.now()
+        rows = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fit_kc, kc_id, work_dir, max_iter) for kc_id in kc_ids]
+            for future in futures:
+                kc_id, params, log_likelihood, response_count = future.result()
+                fitted[kc_id] = params
+                rows.append((
+                    kc_id, params['p_init'], params['p_learn'], params['p_slip'], params['p_guess'],
+                    log_likelihood, response_count, timestamp
+                ))
+        
+        conn = get_connection(db_path)
+        conn.executemany(
+            '''
+            INSERT INTO kc_parameters
+            (knowledge_component_id, p_init, p_learn, p_slip, p_guess, log_likelihood, response_count, fitted_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (knowledge_component_id) DO UPDATE SET
+                p_init = excluded.p_init,
+                p_learn = excluded.p_learn,
+                p_slip = excluded.p_slip,
+                p_guess = excluded.p_guess,
+                log_likelihood = excluded.log_likelihood,
+                response_count = excluded.response_count,
+                fitted_at = excluded.fitted_at
+            ''',
+            rows
+        )
+        conn.commit()
+        conn.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    # Running processes use the new parameters from now on
+    get_engine('bkt').load_parameters(db_path)
+    
+    logger.info(f"Fitted BKT parameters for {len(fitted)} knowledge components in {time.perf_counter() - start:.1f}s")
+    return fitted
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Fit per-KC knowledge tracing parameters from user_responses')
+    parser.add_argument('--workers', type=int, default=None, help='fitting processes (default: CPU count)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='rows streamed per round trip')
+    parser.add_argument('--min-responses', type=int, default=MIN_RESPONSES)
+    parser.add_argument('--max-iter', type=int, default=50)
+    parser.add_argument('--replay', action='store_true', help='recompute all mastery states afterwards')
+    args = parser.parse_args()
+    
+    fit_parameters(workers=args.workers, chunk_rows=args.chunk_rows,
+                   min_responses=args.min_responses, max_iter=args.max_iter)
+    
+    if args.replay:
+        replay_history(get_engine('bkt'))
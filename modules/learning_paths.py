@@ -0,0 +1,152 @@
+import time
+import logging
+import threading
+from bisect import bisect_right
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Safety net for path edits made outside this process (seconds)
+LEARNING_PATH_INDEX_MAX_AGE = 600
+
+class LearningPathIndex:
+    """
+    In-memory copy of every learning path as arrays ordered by sequence_order
+    (content IDs, sequence orders and the title/description shown for each
+    item), plus item counts. Finding the item after a user's position is a
+    binary search and the completion percentage a dictionary lookup, instead
+    of an ORDER BY ... LIMIT 1 or COUNT query per request.
+    """
+    
+    def __init__(self, db_path='database/adaptive_learning.db', max_age=LEARNING_PATH_INDEX_MAX_AGE):
+        """Initialize an empty index; paths are loaded on first use"""
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._paths = {}
+    
+    def refresh(self):
+        """Reload every learning path and its items from the database"""
+        conn = get_connection(self.db_path)
+        path_rows = conn.execute('SELECT id, name FROM learning_paths').fetchall()
+        item_rows = conn.execute(
+            '''
+            SELECT lpi.learning_path_id, lpi.sequence_order, lpi.content_id, c.title, c.description
+            FROM learning_path_items lpi
+            LEFT JOIN content c ON lpi.content_id = c.id
+            ORDER BY lpi.learning_path_id, lpi.sequence_order, lpi.id
+            '''
+        ).fetchall()
+        conn.close()
+        
+        paths = {
+            row['id']: {
+                'name': row['name'],
+                'total_items': 0,
+                'orders': [],
+                'items': [],
+                'content_ids': set()
+            }
+            for row in path_rows
+        }
+        
+        for row in item_rows:
+            path = paths.get(row['learning_path_id'])
+            if path is None:
+                # Items of a deleted path can still be followed but the path
+                # itself doesn't exist (name None)
+                path = paths[row['learning_path_id']] = {
+                    'name': None,
+                    'total_items': 0,
+                    'orders': [],
+                    'items': [],
+                    'content_ids': set()
+                }
+            # Items whose content was deleted still count towards the path
+            # length but are never served as the next item
+            path['total_items'] += 1
+            path['content_ids'].add(row['content_id'])
+            if row['title'] is None:
+                continue
+            path['orders'].append(row['sequence_order'])
+            path['items'].append({
+                'content_id': row['content_id'],
+                'title': row['title'],
+                'description': row['description']
+            })
+        
+        with self._lock:
+            self._paths = paths
+            self._loaded_at = time.monotonic()
+        
+        logger.info(f"Indexed {len(paths)} learning paths with {len(item_rows)} items")
+    
+    def invalidate(self):
+        """Mark the index stale so the next lookup reloads it (call after path or content edits)"""
+        with self._lock:
+            self._loaded_at = None
+    
+    def _snapshot(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.max_age:
+            self.refresh()
+        return self._paths
+    
+    def _path(self, learning_path_id):
+        # IDs may arrive as strings from route parameters
+        try:
+            return self._snapshot().get(int(learning_path_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def next_item(self, learning_path_id, current_position):
+        """
+        Get the first item of a path after a position
+        
+        Args:
+            learning_path_id: ID of the learning path
+            current_position: The user's current_position (a sequence_order)
+            
+        Returns:
+            Dictionary with content_id, title and description, or None at the
+            end of the path
+        """
+        path = self._path(learning_path_id)
+        if path is None:
+            return None
+        index = bisect_right(path['orders'], current_position)
+        if index == len(path['items']):
+            return None
+        return dict(path['items'][index])
+    
+    def total_items(self, learning_path_id):
+        """Number of items in a learning path (0 if it does not exist)"""
+        path = self._path(learning_path_id)
+        return path['total_items'] if path and path['name'] is not None else 0
+    
+    def name(self, learning_path_id):
+        """Name of a learning path (None if it does not exist)"""
+        path = self._path(learning_path_id)
+        return path['name'] if path else None
+    
+    def contains(self, learning_path_id, content_id):
+        """Whether a content item is part of a learning path"""
+        path = self._path(learning_path_id)
+        try:
+            return path is not None and int(content_id) in path['content_ids']
+        except (TypeError, ValueError):
+            return False
+    
+    def exists(self, learning_path_id):
+        """Whether a learning path exists"""
+        path = self._path(learning_path_id)
+        return path is not None and path['name'] is not None
+
+# Shared by every module in the process
+learning_path_index = LearningPathIndex()
+
+def invalidate_learning_path_index():
+    """Reload learning paths on next use (call after editing paths or their content)"""
+    learning_path_index.invalidate()
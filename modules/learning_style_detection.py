@@ -1,23 +1,38 @@
-import matplotlib
-matplotlib.use('Agg')  # Non-interactive backend that doesn't require a GUI
-
 import numpy as np
-import pandas as pd
-import sqlite3
 import json
 import logging
-from sklearn.cluster import KMeans
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import Pipeline
-import joblib
-import matplotlib.pyplot as plt
 import io
+import math
 import base64
+import hashlib
+from html import escape
 from datetime import datetime, timedelta
 
+from modules.cache import LRUCache
+from modules.db import get_connection
+from modules.parsed_content import get_parsed_content, content_version_column
+from modules.memo import request_memoized
+
 logger = logging.getLogger(__name__)
 
+# Radar chart layout shared by the PNG and SVG renderers
+CHART_CATEGORIES = ['Visual', 'Auditory', 'Kinesthetic', 'Reading/Writing']
+CHART_STYLE_KEYS = ['visual', 'auditory', 'kinesthetic', 'reading/writing']
+CHART_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Scores are rounded before rendering so near-identical profiles share one image
+CHART_SCORE_PRECISION = 2
+
+# Rendered charts keyed by (format, style, rounded scores)
+_chart_cache = LRUCache(maxsize=512)
+
+def _load_pyplot():
+    """Import pyplot on first use; charts are the only thing that needs matplotlib"""
+    import matplotlib
+    matplotlib.use('Agg')  # Non-interactive backend that doesn't require a GUI
+    import matplotlib.pyplot as plt
+    return plt
+
 class LearningStyleDetection:
     """
     Uses machine learning to detect and adapt to student learning styles.
@@ -29,14 +44,25 @@ class LearningStyleDetection:
         """Initialize with database path"""
         self.db_path = db_path
         self.style_model = None
-        self.scaler = StandardScaler()
+        self._scaler = None
+    
+    @property
+    def scaler(self):
+        """Feature scaler, created on first use so sklearn is only imported when needed"""
+        if self._scaler is None:
+            from sklearn.preprocessing import StandardScaler
+            self._scaler = StandardScaler()
+        return self._scaler
+    
+    @scaler.setter
+    def scaler(self, value):
+        self._scaler = value
         
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
+    @request_memoized
     def extract_learning_style_features(self, user_id):
         """Extract features related to learning style preferences"""
         conn = self.get_db_connection()
@@ -54,8 +80,8 @@ class LearningStyleDetection:
         
         for interaction in interactions:
             if interaction['content_id'] not in content_types:
-                content_data = conn.execute('''
-                    SELECT content_type, content_data
+                content_data = conn.execute(f'''
+                    SELECT content_type, content_data, {content_version_column(conn)}
                     FROM content
                     WHERE id = ?
                 ''', (interaction['content_id'],)).fetchone()
@@ -63,7 +89,8 @@ class LearningStyleDetection:
                 if content_data:
                     content_types[interaction['content_id']] = {
                         'type': content_data['content_type'],
-                        'data': json.loads(content_data['content_data']) if content_data['content_data'] else {}
+                        'data': get_parsed_content(interaction['content_id'], content_data['version'],
+                                                   content_data['content_data'])
                     }
         
         # Initialize feature counters
@@ -166,6 +193,12 @@ class LearningStyleDetection:
     
     def train_style_model(self):
         """Train a model to classify learning styles"""
+        from sklearn.cluster import KMeans
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.pipeline import Pipeline
+        import joblib
+        
         conn = self.get_db_connection()
         
         # Get all users with significant interaction data
@@ -242,6 +275,7 @@ class LearningStyleDetection:
         """Detect a user's learning style"""
         if not self.style_model:
             try:
+                import joblib
                 self.style_model = joblib.load('models/learning_style_model.pkl')
                 self.scaler = joblib.load('models/learning_style_scaler.pkl')
             except:
@@ -286,6 +320,8 @@ class LearningStyleDetection:
             'reading/writing': 'Learns best through reading and writing text-based content'
         }
         
+        self._store_detected_style(user_id, predicted_style)
+        
         return {
             'style': predicted_style,
             'confidence': float(confidence),
@@ -295,6 +331,38 @@ class LearningStyleDetection:
             'features': features
         }
     
+    def _store_detected_style(self, user_id, style):
+        """
+        Save the detected style in user_preferences.detected_learning_style, so
+        every worker can present content in it without running the model
+        """
+        try:
+            conn = get_connection(self.db_path)
+            try:
+                updated = conn.execute(
+                    '''
+                    UPDATE user_preferences SET detected_learning_style = ?
+                    WHERE user_id = ? AND detected_learning_style IS NOT ?
+                    ''',
+                    (style, user_id, style)
+                ).rowcount
+                if not updated:
+                    # No preferences saved yet: create them with the settings page defaults
+                    conn.execute(
+                        '''
+                        INSERT INTO user_preferences (user_id, learning_style, detected_learning_style)
+                        SELECT ?, 'auto', ?
+                        WHERE NOT EXISTS (SELECT 1 FROM user_preferences WHERE user_id = ?)
+                        ''',
+                        (user_id, style, user_id)
+                    )
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            # Detection still works; content is just presented unstyled until this succeeds
+            logger.warning(f"Could not store detected learning style for user {user_id}: {e}")
+    
     def _get_default_style(self):
         """Return default style when not enough data is available"""
         return {
@@ -311,60 +379,135 @@ class LearningStyleDetection:
             'features': {}
         }
     
-    def generate_style_visualization(self, user_id):
+    def get_style_chart(self, user_id, image_format='png'):
         """
-        Generate a visualization of the user's learning style preferences.
-        Uses a non-interactive backend to avoid GUI thread issues.
+        Get the learning style radar chart for a user as raw image bytes.
+        Charts are cached by their rounded style-score vector, so users with
+        identical profiles share a single rendered image.
         
         Args:
             user_id: The ID of the user
+            image_format: 'png' (matplotlib) or 'svg' (built without matplotlib)
             
         Returns:
-            Base64 encoded image data for the visualization
+            Tuple of (image bytes, mimetype, etag)
         """
+        style_data = self.detect_learning_style(user_id)
+        return self.render_style_chart(style_data, image_format)
+    
+    def render_style_chart(self, style_data, image_format='png'):
+        """Render (or fetch from cache) the radar chart for the given style data"""
+        if image_format not in CHART_MIMETYPES:
+            raise ValueError(f"Unsupported chart format: {image_format}")
+        
+        style = style_data.get('style', 'visual')
+        scores = tuple(
+            round(float(style_data['style_scores'].get(key, 0)), CHART_SCORE_PRECISION)
+            for key in CHART_STYLE_KEYS
+        )
+        cache_key = (image_format, style, scores)
+        
+        def render():
+            if image_format == 'svg':
+                image = self._render_svg_chart(style, scores)
+            else:
+                image = self._render_png_chart(style, scores)
+            etag = hashlib.sha1(repr(cache_key).encode('utf-8')).hexdigest()
+            return image, etag
+        
+        image, etag = _chart_cache.get_or_create(cache_key, render)
+        return image, CHART_MIMETYPES[image_format], etag
+    
+    def _render_png_chart(self, style, values):
+        """Render the radar chart to PNG bytes with matplotlib"""
+        plt = _load_pyplot()
+        
+        # Create a new figure with the Agg backend
+        fig = plt.figure(figsize=(8, 8))
+        
         try:
-            # Get the learning style data
-            style_data = self.detect_learning_style(user_id)
-            
-            # Create a new figure with the Agg backend
-            fig = plt.figure(figsize=(8, 8))
-            
-            # Create data for radar chart
-            categories = ['Visual', 'Auditory', 'Kinesthetic', 'Reading/Writing']
-            values = [
-                style_data['style_scores'].get('visual', 0),
-                style_data['style_scores'].get('auditory', 0),
-                style_data['style_scores'].get('kinesthetic', 0),
-                style_data['style_scores'].get('reading/writing', 0)
-            ]
-            
             # Duplicate the first value to close the loop
-            values += values[:1]
+            values = list(values) + [values[0]]
             
             # Calculate angles for the radar chart
-            angles = np.linspace(0, 2*np.pi, len(categories), endpoint=False).tolist()
+            angles = np.linspace(0, 2*np.pi, len(CHART_CATEGORIES), endpoint=False).tolist()
             angles += angles[:1]  # Close the loop
             
             # Plot the radar chart
             ax = fig.add_subplot(111, polar=True)
             ax.plot(angles, values, 'o-', linewidth=2)
             ax.fill(angles, values, alpha=0.25)
-            ax.set_thetagrids(np.degrees(angles[:-1]), categories)
+            ax.set_thetagrids(np.degrees(angles[:-1]), CHART_CATEGORIES)
             
             ax.set_ylim(0, 1)
-            ax.set_title(f"Learning Style Profile: {style_data['style'].title()}")
+            ax.set_title(f"Learning Style Profile: {style.title()}")
             
-            # Convert plot to base64 image
             buf = io.BytesIO()
             fig.savefig(buf, format='png', bbox_inches='tight')
-            buf.seek(0)
-            img_str = base64.b64encode(buf.read()).decode('utf-8')
-            
+            return buf.getvalue()
+        finally:
             # Make sure to close the figure to free up resources
             plt.close(fig)
+    
+    def _render_svg_chart(self, style, values):
+        """Build the radar chart as SVG markup directly, without matplotlib"""
+        size = 400
+        center = size / 2
+        radius = 140
+        count = len(CHART_CATEGORIES)
+        
+        def point(fraction, index):
+            # Start at 3 o'clock and go counter-clockwise, like the polar plot
+            angle = 2 * math.pi * index / count
+            return (center + radius * fraction * math.cos(angle),
+                    center - radius * fraction * math.sin(angle))
+        
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+            f'viewBox="0 0 {size} {size}" font-family="sans-serif" font-size="13">',
+            f'<text x="{center}" y="24" text-anchor="middle" font-size="16">'
+            f'Learning Style Profile: {escape(style.title())}</text>'
+        ]
+        
+        # Grid rings and spokes
+        for ring in (0.2, 0.4, 0.6, 0.8, 1.0):
+            ring_points = ' '.join('%.1f,%.1f' % point(ring, i) for i in range(count))
+            parts.append(f'<polygon points="{ring_points}" fill="none" stroke="#ddd"/>')
+        for i, category in enumerate(CHART_CATEGORIES):
+            x, y = point(1.0, i)
+            lx, ly = point(1.18, i)
+            parts.append(f'<line x1="{center}" y1="{center}" x2="{x:.1f}" y2="{y:.1f}" stroke="#ddd"/>')
+            parts.append(f'<text x="{lx:.1f}" y="{ly:.1f}" text-anchor="middle" '
+                         f'dominant-baseline="middle">{escape(category)}</text>')
+        
+        # Score polygon
+        score_points = ' '.join('%.1f,%.1f' % point(max(0.0, min(1.0, v)), i) for i, v in enumerate(values))
+        parts.append(f'<polygon points="{score_points}" fill="#1f77b4" fill-opacity="0.25" '
+                     f'stroke="#1f77b4" stroke-width="2"/>')
+        for i, v in enumerate(values):
+            x, y = point(max(0.0, min(1.0, v)), i)
+            parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="4" fill="#1f77b4"/>')
+        
+        parts.append('</svg>')
+        return '\n'.join(parts).encode('utf-8')
+    
+    def generate_style_visualization(self, user_id):
+        """
+        Generate a visualization of the user's learning style preferences.
+        Uses a non-interactive backend to avoid GUI thread issues.
+        
+        Args:
+            user_id: The ID of the user
+            
+        Returns:
+            Base64 encoded image data for the visualization
+        """
+        try:
+            image, mimetype, _ = self.get_style_chart(user_id, 'png')
+            img_str = base64.b64encode(image).decode('utf-8')
             
             # Return as data URI
-            return f"data:image/png;base64,{img_str}"
+            return f"data:{mimetype};base64,{img_str}"
         
         except Exception as e:
             logger.error(f"Error generating learning style visualization: {e}")
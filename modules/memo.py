@@ -0,0 +1,108 @@
+import contextvars
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Memo for the request currently being handled (None outside a request scope)
+_current_memo = contextvars.ContextVar('request_memo', default=None)
+
+class RequestMemo:
+    """
+    Values computed during a single request, keyed by (function, arguments).
+    Safe to share with worker threads: concurrent callers asking for the same
+    key wait for the first computation instead of repeating it.
+    """
+    
+    def __init__(self):
+        """Initialize an empty memo"""
+        self._values = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_or_compute(self, key, factory):
+        """Return the memoized value for key, computing it with factory() once"""
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    return self._values[key]
+                self.misses += 1
+            
+            # Exceptions propagate and are not memoized, so a later caller retries
+            value = factory()
+            
+            with self._lock:
+                self._values[key] = value
+            return value
+    
+    def clear(self):
+        """Forget every memoized value (e.g. after the request writes new data)"""
+        with self._lock:
+            self._values.clear()
+            self._key_locks.clear()
+
+def begin_request_memo():
+    """
+    Start a fresh memo for the current request.
+    
+    Returns:
+        Token to pass to end_request_memo
+    """
+    return _current_memo.set(RequestMemo())
+
+def end_request_memo(token):
+    """Discard the memo started with begin_request_memo"""
+    memo = _current_memo.get()
+    if memo is not None and (memo.hits or memo.misses):
+        logger.debug(f"Request memo: {memo.hits} hits, {memo.misses} misses")
+    _current_memo.reset(token)
+
+@contextmanager
+def request_memo_scope():
+    """Context manager running a block (e.g. a script or job) with its own memo"""
+    token = begin_request_memo()
+    try:
+        yield _current_memo.get()
+    finally:
+        end_request_memo(token)
+
+def invalidate_request_memo():
+    """Drop memoized values after the current request has changed user data"""
+    memo = _current_memo.get()
+    if memo is not None:
+        memo.clear()
+
+def request_memoized(method):
+    """
+    Decorator memoizing a method per request, keyed by the method and its arguments
+    (typically the user ID). Outside a request scope the method runs normally.
+    Memoized results are shared between callers, so they must not be mutated.
+    """
+    key_prefix = f"{method.__module__}.{method.__qualname__}"
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        memo = _current_memo.get()
+        if memo is None:
+            return method(self, *args, **kwargs)
+        
+        key = (key_prefix, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        
+        return memo.get_or_compute(key, lambda: method(self, *args, **kwargs))
+    
+    return wrapper
@@ -0,0 +1,101 @@
+import json
+import logging
+from types import MappingProxyType
+
+from modules.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Parsed content_data documents kept per (content ID, content version)
+PARSED_CONTENT_CACHE_SIZE = 2048
+
+# Databases known to have (or, already warned about, lack) the content.version column
+_versioned_databases = set()
+_unversioned_databases = set()
+
+def content_version_column(conn, table_alias=None):
+    """
+    SELECT expression for content.version, or NULL AS version on databases
+    whose schema hasn't been updated yet (run database/update_db.py)
+    
+    Args:
+        conn: Database connection the query will run on
+        table_alias: Alias of the content table in the query, if any
+    """
+    pool = getattr(conn, 'pool', None)
+    db_path = pool.db_path if pool is not None else None
+    if db_path is None or db_path not in _versioned_databases:
+        if not any(column[1] == 'version' for column in conn.execute('PRAGMA table_info(content)')):
+            if db_path not in _unversioned_databases:
+                _unversioned_databases.add(db_path)
+                logger.warning("content.version is missing; parsed content won't be cached")
+            return 'NULL AS version'
+        if db_path is not None:
+            _versioned_databases.add(db_path)
+    return f"{table_alias}.version" if table_alias else 'version'
+
+def freeze(value):
+    """Read-only copy of decoded JSON (dicts become mapping proxies, lists tuples)"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    """Mutable deep copy of frozen (or plain) decoded JSON, for callers that edit content"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+class ParsedContentCache:
+    """
+    Process-wide cache of parsed content.content_data documents.
+    Entries are keyed by (content ID, version) and frozen, so every reader can
+    share one parsed copy; callers that need to change a document take thaw().
+    The version column is bumped on every content edit, so stale entries are
+    never served and simply age out. Content without a version (schema not
+    updated) is parsed on every call.
+    """
+    
+    def __init__(self, maxsize=PARSED_CONTENT_CACHE_SIZE):
+        """Initialize an empty cache"""
+        self._cache = LRUCache(maxsize=maxsize)
+    
+    def get(self, content_id, version, content_data):
+        """
+        Get the parsed content_data of a content item
+        
+        Args:
+            content_id: ID of the content
+            version: The content's version column (None: parse without caching)
+            content_data: The raw content_data JSON, parsed on a cache miss
+            
+        Returns:
+            Frozen document (an empty one if content_data is empty)
+            
+        Raises:
+            json.JSONDecodeError: If content_data isn't valid JSON
+        """
+        if version is None:
+            return freeze(json.loads(content_data) if content_data else {})
+        
+        key = (int(content_id), version)
+        document = self._cache.get(key)
+        if document is None:
+            document = freeze(json.loads(content_data) if content_data else {})
+            self._cache.set(key, document)
+        return document
+    
+    def clear(self):
+        """Drop every parsed document"""
+        self._cache.clear()
+
+# Shared by every module in the process
+parsed_content_cache = ParsedContentCache()
+
+def get_parsed_content(content_id, version, content_data):
+    """Frozen parsed content_data of a content item (see ParsedContentCache.get)"""
+    return parsed_content_cache.get(content_id, version, content_data)
@@ -0,0 +1,405 @@
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from modules.cache import LRUCache
+from modules.db import get_connection
+from modules.prerequisites import prerequisite_graph, bitmap_positions, MASTERY_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Mastery a component gains when content is studied, per unit of relevance
+# weight: content with weight 1.0 is taken to master its components, lower
+# weights cover a proportional share of the gap
+STUDY_GAIN = 1.0
+
+# Plans are computed from mastery rounded down to this step, so users in the
+# same bucket share a cached plan
+MASTERY_BUCKET = 0.05
+
+PLAN_CACHE_SIZE = 4096
+
+def goal_key(goal_kcs, target):
+    """Stable text form of a goal, used as cache and learning_plans key"""
+    components = ','.join(map(str, sorted(goal_kcs))) if goal_kcs else 'all'
+    return f'{components}@{target:g}'
+
+def _ranges(indptr, keys):
+    """Concatenated indptr[k]:indptr[k + 1] ranges of the given keys"""
+    starts = indptr[keys]
+    lengths = indptr[keys + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+class PathPlanner:
+    """
+    Plans a short, cheap sequence of content that takes a user from their
+    current mastery to a target mastery in a set of knowledge components.
+    
+    Greedy weighted set cover over the prerequisite graph: each step takes the
+    content item whose bundle (the item plus its not yet mastered or planned
+    prerequisites) covers the most remaining mastery deficit per unit of cost
+    (content difficulty), and adds the bundle in prerequisite order.
+    """
+    
+    def __init__(self, db_path='database/adaptive_learning.db', cache_size=PLAN_CACHE_SIZE):
+        """Initialize the planner; tables are built from the prerequisite graph on first use"""
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._graph = None
+        self._tables = None
+        self._cache = LRUCache(maxsize=cache_size)
+    
+    def _get_tables(self):
+        """Gain/cost/bundle tables, rebuilt whenever the prerequisite graph is rebuilt"""
+        from scipy import sparse
+        
+        graph = prerequisite_graph.snapshot()
+        if graph is self._graph:
+            return self._tables
+        
+        with self._lock:
+            if graph is self._graph:
+                return self._tables
+            
+            conn = get_connection(self.db_path)
+            kc_rows = conn.execute(
+                'SELECT content_id, knowledge_component_id, relevance_weight FROM content_knowledge_map'
+            ).fetchall()
+            difficulty = dict(conn.execute('SELECT id, difficulty FROM content').fetchall())
+            conn.close()
+            
+            ids = graph['ids']
+            positions = graph['positions']
+            kc_ids = sorted({row['knowledge_component_id'] for row in kc_rows})
+            kc_columns = {kc_id: column for column, kc_id in enumerate(kc_ids)}
+            
+            # Sparse (content, component) gain entries, ordered by content, with
+            # an index by component so a deficit change touches only its entries
+            gains = {}
+            for row in kc_rows:
+                position = positions.get(row['content_id'])
+                if position is not None:
+                    weight = row['relevance_weight'] if row['relevance_weight'] is not None else 1.0
+                    key = (position, kc_columns[row['knowledge_component_id']])
+                    gains[key] = max(gains.get(key, 0.0), min(1.0, STUDY_GAIN * weight))
+            entries = sorted(gains)
+            gain_rows = np.array([position for position, _ in entries], dtype=np.int64)
+            gain_kcs = np.array([column for _, column in entries], dtype=np.int64)
+            gain_values = np.array([gains[entry] for entry in entries])
+            content_indptr = np.concatenate(([0], np.cumsum(np.bincount(gain_rows, minlength=len(ids)))))
+            kc_order = np.argsort(gain_kcs, kind='stable')
+            kc_indptr = np.concatenate(([0], np.cumsum(np.bincount(gain_kcs, minlength=len(kc_ids)))))
+            
+            costs = np.array([max(1.0, float(difficulty.get(content_id) or 1)) for content_id in ids])
+            
+            # bundles[c, p] = 1 when p must be learned for c (c itself included)
+            rows, columns = [], []
+            for position, closure in enumerate(graph['closure']):
+                members = bitmap_positions(closure)
+                members.append(position)
+                rows.extend([position] * len(members))
+                columns.extend(members)
+            bundles = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(ids), len(ids)))
+            
+            ranks = np.empty(len(ids), dtype=np.int64)
+            for rank, content_id in enumerate(graph['order']):
+                ranks[positions[content_id]] = rank
+            
+            self._tables = {
+                'ids': ids,
+                'kc_ids': kc_ids,
+                'kc_columns': kc_columns,
+                'gain_rows': gain_rows,
+                'gain_kcs': gain_kcs,
+                'gain_values': gain_values,
+                'content_indptr': content_indptr,
+                'kc_order': kc_order,
+                'kc_indptr': kc_indptr,
+                'costs': costs,
+                'bundles': bundles,
+                # Column view: the bundles each content item belongs to
+                'bundle_columns': bundles.tocsc(),
+                'ranks': ranks
+            }
+            self._graph = graph
+            self._cache.clear()
+            logger.info(f"Built planner tables for {len(ids)} content items and {len(kc_ids)} knowledge components")
+            return self._tables
+    
+    def _mastery_vector(self, tables, mastery_levels):
+        vector = np.zeros(len(tables['kc_ids']))
+        for kc_id, level in mastery_levels.items():
+            column = tables['kc_columns'].get(kc_id)
+            if column is not None and level is not None:
+                vector[column] = level
+        return vector
+    
+    @staticmethod
+    def _buckets(vectors):
+        """Bucket index of each mastery value (rounded down)"""
+        return np.floor(np.clip(vectors, 0.0, 1.0) / MASTERY_BUCKET + 1e-9).astype(np.uint8)
+    
+    def plan(self, mastery_levels, goal_kcs=None, target=MASTERY_THRESHOLD):
+        """
+        Plan the content a user should study to reach a goal
+        
+        Args:
+            mastery_levels: {kc_id: mastery} of the user
+            goal_kcs: Knowledge components to master (default: every mapped component)
+            target: Mastery to reach in each goal component
+            
+        Returns:
+            Dictionary with content_ids (in study order), estimated_cost and
+            unreachable_kcs (goal components no content can bring to target)
+        """
+        tables = self._get_tables()
+        bucket = self._buckets(self._mastery_vector(tables, mastery_levels))
+        plan = self._plan_bucket(tables, bucket, goal_kcs, target)
+        # Cached plans are shared, so hand out copies
+        return {
+            'content_ids': list(plan['content_ids']),
+            'estimated_cost': plan['estimated_cost'],
+            'unreachable_kcs': list(plan['unreachable_kcs'])
+        }
+    
+    def _plan_bucket(self, tables, bucket, goal_kcs, target):
+        key = (goal_key(goal_kcs, target), bucket.tobytes())
+        return self._cache.get_or_create(
+            key, lambda: self._greedy(tables, bucket.astype(float) * MASTERY_BUCKET, goal_kcs, target)
+        )
+    
+    def _greedy(self, tables, mastery, goal_kcs, target):
+        rows = tables['gain_rows']
+        kcs = tables['gain_kcs']
+        values = tables['gain_values']
+        content_indptr = tables['content_indptr']
+        costs = tables['costs']
+        bundles = tables['bundles']
+        
+        goal = np.zeros(len(tables['kc_ids']), dtype=bool)
+        # Goal components no content teaches can never be reached
+        unmapped = []
+        if goal_kcs:
+            for kc_id in goal_kcs:
+                column = tables['kc_columns'].get(kc_id)
+                if column is not None:
+                    goal[column] = True
+                else:
+                    unmapped.append(kc_id)
+        else:
+            goal[:] = True
+        deficit = np.where(goal, np.maximum(target - mastery, 0.0), 0.0)
+        
+        # Content counts as done once every one of its components is mastered
+        done = np.bincount(rows, weights=mastery[kcs] < MASTERY_THRESHOLD, minlength=len(costs)) == 0
+        
+        # Deficit each entry would cover, summed per content item
+        covered = np.minimum(values, deficit[kcs])
+        single = np.bincount(rows, weights=covered, minlength=len(costs))
+        
+        # Bundle totals over available content, kept up to date incrementally
+        available_single = single * ~done
+        benefit = bundles @ available_single
+        cost = bundles @ (costs * ~done)
+        columns = tables['bundle_columns']
+        column_sizes = np.diff(columns.indptr)
+        
+        plan = []
+        while deficit.max(initial=0.0) > 1e-9:
+            candidates = available_single > 1e-9
+            if not candidates.any():
+                break
+            # Rounded so float noise from the incremental sums can't break ties
+            score = np.where(candidates, np.round(benefit / np.maximum(cost, 1e-9), 9), -np.inf)
+            choice = int(np.argmax(score))
+            
+            row = bundles.indices[bundles.indptr[choice]:bundles.indptr[choice + 1]]
+            members = row[~done[row]]
+            members = members[np.argsort(tables['ranks'][members], kind='stable')]
+            changed = []
+            for position in members:
+                entries = slice(content_indptr[position], content_indptr[position + 1])
+                changed.append(kcs[entries])
+                deficit[kcs[entries]] = np.maximum(deficit[kcs[entries]] - values[entries], 0.0)
+            done[members] = True
+            plan.extend(members.tolist())
+            
+            # Only entries of components whose deficit moved need rescoring
+            changed = np.unique(np.concatenate(changed)) if changed else np.empty(0, dtype=np.int64)
+            touched = tables['kc_order'][_ranges(tables['kc_indptr'], changed)]
+            update = np.minimum(values[touched], deficit[kcs[touched]])
+            single += np.bincount(rows[touched], weights=update - covered[touched], minlength=len(costs))
+            covered[touched] = update
+            
+            # Push the changes into every bundle containing the affected content
+            affected = np.union1d(rows[touched], members)
+            delta = single[affected] * ~done[affected] - available_single[affected]
+            available_single[affected] += delta
+            entries = _ranges(columns.indptr, affected)
+            benefit += np.bincount(columns.indices[entries], weights=np.repeat(delta, column_sizes[affected]),
+                                   minlength=len(costs))
+            entries = _ranges(columns.indptr, members)
+            cost -= np.bincount(columns.indices[entries], weights=np.repeat(costs[members], column_sizes[members]),
+                                minlength=len(costs))
+        
+        unreachable = [tables['kc_ids'][column] for column in np.flatnonzero(deficit > 1e-9)] + unmapped
+        return {
+            'content_ids': [tables['ids'][position] for position in plan],
+            'estimated_cost': float(costs[plan].sum()) if plan else 0.0,
+            'unreachable_kcs': unreachable
+        }
+    
+    def plan_for_user(self, user_id, goal_kcs=None, target=MASTERY_THRESHOLD):
+        """
+        Plan for a user from their stored knowledge state. The plan stored by
+        plan_all_users is served while the user's mastery hasn't changed since;
+        otherwise the user is planned live.
+        """
+        conn = get_connection(self.db_path)
+        try:
+            stored = self._stored_plan(conn, user_id, goal_key(goal_kcs, target))
+            if stored is not None:
+                return stored
+            mastery_levels = dict(conn.execute(
+                'SELECT knowledge_component_id, mastery_level FROM user_knowledge_state WHERE user_id = ?',
+                (user_id,)
+            ).fetchall())
+        finally:
+            conn.close()
+        return self.plan(mastery_levels, goal_kcs, target)
+    
+    @staticmethod
+    def _stored_plan(conn, user_id, goal):
+        """Plan from learning_plans if it is newer than the user's knowledge state, else None"""
+        try:
+            row = conn.execute(
+                '''
+                SELECT lp.content_ids, lp.estimated_cost, lp.unreachable_kcs, lp.planned_at,
+                       (SELECT MAX(last_updated) FROM user_knowledge_state WHERE user_id = lp.user_id) AS mastery_updated_at
+                FROM learning_plans lp
+                WHERE lp.user_id = ? AND lp.goal = ?
+                ''',
+                (user_id, goal)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            # Schema not updated yet (run database/update_db.py)
+            logger.warning(f"Planning user {user_id} live: {e}")
+            return None
+        if row is None:
+            return None
+        
+        try:
+            stale = (row['mastery_updated_at'] is not None and
+                     datetime.fromisoformat(str(row['mastery_updated_at'])) > datetime.fromisoformat(str(row['planned_at'])))
+        except ValueError:
+            stale = True
+        if stale:
+            return None
+        
+        return {
+            'content_ids': json.loads(row['content_ids']),
+            'estimated_cost': row['estimated_cost'],
+            'unreachable_kcs': json.loads(row['unreachable_kcs'])
+        }
+    
+    def plan_cohort(self, user_ids, mastery_vectors, goal_kcs=None, target=MASTERY_THRESHOLD):
+        """
+        Plan for many users at once; users in the same mastery bucket share one plan
+        
+        Args:
+            user_ids: User IDs aligned with the rows of mastery_vectors
+            mastery_vectors: (users, components) array in the order of kc_ids()
+            goal_kcs: Knowledge components to master (default: every mapped component)
+            target: Mastery to reach in each goal component
+            
+        Returns:
+            Dictionary {user_id: plan}
+        """
+        tables = self._get_tables()
+        buckets = self._buckets(np.asarray(mastery_vectors, dtype=float))
+        states, inverse = np.unique(buckets.reshape(len(user_ids), -1), axis=0, return_inverse=True)
+        plans = [self._plan_bucket(tables, state, goal_kcs, target) for state in states]
+        logger.info(f"Planned {len(states)} distinct mastery states for {len(user_ids)} users")
+        return {user_id: plans[state] for user_id, state in zip(user_ids, inverse.reshape(-1).tolist())}
+    
+    def kc_ids(self):
+        """Knowledge components in the column order plan_cohort expects"""
+        return list(self._get_tables()['kc_ids'])
+
+# Shared by every module in the process
+path_planner = PathPlanner()
+
+def plan_all_users(db_path='database/adaptive_learning.db', goal_kcs=None, target=MASTERY_THRESHOLD):
+    """
+    Nightly batch: plan for every user and store the plans in learning_plans
+    
+    Args:
+        db_path: Path to the SQLite database
+        goal_kcs: Knowledge components to master (default: every mapped component)
+        target: Mastery to reach in each goal component
+        
+    Returns:
+        Number of users planned
+    """
+    start = time.perf_counter()
+    planner = path_planner if db_path == path_planner.db_path else PathPlanner(db_path)
+    kc_columns = {kc_id: column for column, kc_id in enumerate(planner.kc_ids())}
+    
+    conn = get_connection(db_path)
+    try:
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+        user_rows = {user_id: row for row, user_id in enumerate(user_ids)}
+        vectors = np.zeros((len(user_ids), len(kc_columns)))
+        for user_id, kc_id, level in conn.execute(
+            'SELECT user_id, knowledge_component_id, mastery_level FROM user_knowledge_state'
+        ):
+            if user_id in user_rows and kc_id in kc_columns and level is not None:
+                vectors[user_rows[user_id], kc_columns[kc_id]] = level
+        
+        plans = planner.plan_cohort(user_ids, vectors, goal_kcs, target)
+        
+        goal = goal_key(goal_kcs, target)
+        # Local time, like user_knowledge_state.last_updated, which _stored_plan compares it with
+        planned_at = datetime.now()
+        conn.executemany(
+            '''
+            INSERT INTO learning_plans (user_id, goal, content_ids, estimated_cost, unreachable_kcs, planned_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, goal) DO UPDATE SET
+                content_ids = excluded.content_ids,
+                estimated_cost = excluded.estimated_cost,
+                unreachable_kcs = excluded.unreachable_kcs,
+                planned_at = excluded.planned_at
+            ''',
+            [
+                (user_id, goal, json.dumps(plan['content_ids']), plan['estimated_cost'],
+                 json.dumps(plan['unreachable_kcs']), planned_at)
+                for user_id, plan in plans.items()
+            ]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    logger.info(f"Stored learning plans for {len(user_ids)} users in {time.perf_counter() - start:.1f}s")
+    return len(user_ids)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Plan learning paths for every user and store them in learning_plans')
+    parser.add_argument('--goal', default='', help='comma-separated knowledge component IDs (default: all)')
+    parser.add_argument('--target', type=float, default=MASTERY_THRESHOLD, help='mastery to reach')
+    args = parser.parse_args()
+    
+    plan_all_users(goal_kcs=[int(kc_id) for kc_id in args.goal.split(',') if kc_id.strip()] or None,
+                   target=args.target)
@@ -1,13 +1,8 @@
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingRegressor
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split
-import joblib
 import logging
-import sqlite3
 from datetime import datetime, timedelta
+from modules.db import get_connection
+from modules.memo import request_memoized
 
 logger = logging.getLogger(__name__)
 
@@ -22,14 +17,25 @@ class PredictiveAnalytics:
         self.db_path = db_path
         self.performance_model = None
         self.engagement_model = None
-        self.scaler = StandardScaler()
+        self._scaler = None
+    
+    @property
+    def scaler(self):
+        """Feature scaler, created on first use so sklearn is only imported when needed"""
+        if self._scaler is None:
+            from sklearn.preprocessing import StandardScaler
+            self._scaler = StandardScaler()
+        return self._scaler
+    
+    @scaler.setter
+    def scaler(self, value):
+        self._scaler = value
         
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
+    @request_memoized
     def extract_features(self, user_id):
         """Extract features for a specific user to use in predictions"""
         conn = self.get_db_connection()
@@ -149,6 +155,12 @@ class PredictiveAnalytics:
     
     def train_performance_model(self):
         """Train a model to predict future assessment performance"""
+        from sklearn.ensemble import GradientBoostingRegressor
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.pipeline import Pipeline
+        from sklearn.model_selection import train_test_split
+        import joblib
+        
         conn = self.get_db_connection()
         
         # Get all users
@@ -211,6 +223,12 @@ class PredictiveAnalytics:
     
     def train_engagement_model(self):
         """Train a model to predict student disengagement"""
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.pipeline import Pipeline
+        from sklearn.model_selection import train_test_split
+        import joblib
+        
         conn = self.get_db_connection()
         
         # Get all users
@@ -269,16 +287,24 @@ class PredictiveAnalytics:
         
         return True
     
-    def predict_performance(self, user_id):
-        """Predict future assessment performance for a user"""
+    def predict_performance(self, user_id, features=None):
+        """
+        Predict future assessment performance for a user
+        
+        Args:
+            user_id: ID of the user
+            features: Output of extract_features for this user, if already computed
+        """
         if not self.performance_model:
             try:
+                import joblib
                 self.performance_model = joblib.load('models/performance_model.pkl')
             except:
                 logger.error("No performance model available. Train the model first.")
                 return None
         
-        features = self.extract_features(user_id)
+        if features is None:
+            features = self.extract_features(user_id)
         
         # Convert features to array
         features_array = np.array(list(features.values())).reshape(1, -1)
@@ -292,16 +318,24 @@ class PredictiveAnalytics:
             'features_importance': features
         }
     
-    def predict_disengagement_risk(self, user_id):
-        """Predict risk of disengagement for a user"""
+    def predict_disengagement_risk(self, user_id, features=None):
+        """
+        Predict risk of disengagement for a user
+        
+        Args:
+            user_id: ID of the user
+            features: Output of extract_features for this user, if already computed
+        """
         if not self.engagement_model:
             try:
+                import joblib
                 self.engagement_model = joblib.load('models/engagement_model.pkl')
             except:
                 logger.error("No engagement model available. Train the model first.")
                 return None
         
-        features = self.extract_features(user_id)
+        if features is None:
+            features = self.extract_features(user_id)
         
         # Convert features to array
         features_array = np.array(list(features.values())).reshape(1, -1)
@@ -0,0 +1,279 @@
+import time
+import logging
+import threading
+from collections import deque
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Safety net for content edits made outside this process (seconds)
+PREREQUISITE_GRAPH_MAX_AGE = 600
+
+# Mastery a user needs in every knowledge component of a content item for it
+# to count as learned (the same 80% assessments use for mastery)
+MASTERY_THRESHOLD = 0.8
+
+def parse_prerequisites(prerequisites):
+    """Content IDs listed in a comma-separated content.prerequisites value"""
+    ids = []
+    for value in (prerequisites or '').split(','):
+        value = value.strip()
+        if value.isdigit():
+            ids.append(int(value))
+    return ids
+
+class CycleError(ValueError):
+    """Raised when prerequisites would make content depend on itself"""
+
+def bitmap_positions(bitmap):
+    """Set bit positions of a bitmap, ascending"""
+    positions = []
+    while bitmap:
+        low = bitmap & -bitmap
+        positions.append(low.bit_length() - 1)
+        bitmap ^= low
+    return positions
+
+def topological_order(prerequisites):
+    """
+    Kahn's algorithm over {content_id: [prerequisite IDs]}
+    
+    Returns:
+        Tuple of (IDs with every prerequisite before its dependents, set of IDs
+        on or behind a cycle that could not be ordered)
+    """
+    indegree = {node: 0 for node in prerequisites}
+    dependents = {node: [] for node in prerequisites}
+    for node, required in prerequisites.items():
+        for prerequisite in required:
+            if prerequisite in indegree:
+                indegree[node] += 1
+                dependents[prerequisite].append(node)
+    
+    queue = deque(sorted(node for node, count in indegree.items() if count == 0))
+    order = []
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for dependent in dependents[node]:
+            indegree[dependent] -= 1
+            if indegree[dependent] == 0:
+                queue.append(dependent)
+    
+    return order, set(prerequisites) - set(order)
+
+def cycle_members(prerequisites, unordered):
+    """
+    Narrow the content Kahn's algorithm could not order down to the items on a
+    cycle, dropping those that merely depend on one
+    """
+    remaining = set(unordered)
+    dependent_count = {node: 0 for node in remaining}
+    for node in remaining:
+        for prerequisite in prerequisites[node]:
+            if prerequisite in remaining:
+                dependent_count[prerequisite] += 1
+    
+    # Peel off items nothing else in the remainder depends on
+    queue = deque(node for node, count in dependent_count.items() if count == 0)
+    while queue:
+        node = queue.popleft()
+        remaining.discard(node)
+        for prerequisite in prerequisites[node]:
+            if prerequisite in remaining:
+                dependent_count[prerequisite] -= 1
+                if dependent_count[prerequisite] == 0:
+                    queue.append(prerequisite)
+    return remaining
+
+class PrerequisiteGraph:
+    """
+    In-memory DAG of content prerequisites (content.prerequisites).
+    Built once in topological order with the transitive closure of every item
+    cached as a bitmap (a Python int, bit i = i-th content item), so readiness
+    checks are a few bitwise operations instead of per-item queries.
+    """
+    
+    def __init__(self, db_path='database/adaptive_learning.db', max_age=PREREQUISITE_GRAPH_MAX_AGE):
+        """Initialize an empty graph; it is built on first use"""
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._graph = None
+    
+    def refresh(self):
+        """Rebuild the graph from the content and content_knowledge_map tables"""
+        conn = get_connection(self.db_path)
+        rows = conn.execute('SELECT id, prerequisites FROM content ORDER BY id').fetchall()
+        kc_rows = conn.execute('SELECT content_id, knowledge_component_id FROM content_knowledge_map').fetchall()
+        conn.close()
+        
+        prerequisites = {row['id']: parse_prerequisites(row['prerequisites']) for row in rows}
+        for content_id, required in prerequisites.items():
+            unknown = [prerequisite for prerequisite in required if prerequisite not in prerequisites]
+            if unknown:
+                logger.warning(f"Content {content_id} lists unknown prerequisites {unknown}")
+        
+        order, unordered = topological_order(prerequisites)
+        cyclic = cycle_members(prerequisites, unordered)
+        if cyclic:
+            # Keep serving the acyclic part; content on a cycle loses the
+            # prerequisites that are themselves on the cycle
+            logger.error(f"Prerequisite cycle involving content {sorted(cyclic)}; ignoring those links")
+            for content_id in cyclic:
+                prerequisites[content_id] = [p for p in prerequisites[content_id] if p not in cyclic]
+            order, _ = topological_order(prerequisites)
+        
+        ids = list(prerequisites)
+        positions = {content_id: position for position, content_id in enumerate(ids)}
+        
+        direct = [0] * len(ids)
+        closure = [0] * len(ids)
+        dependents = [0] * len(ids)
+        for content_id in order:
+            position = positions[content_id]
+            for prerequisite in prerequisites[content_id]:
+                if prerequisite in positions:
+                    required = positions[prerequisite]
+                    direct[position] |= 1 << required
+                    closure[position] |= closure[required] | (1 << required)
+                    dependents[required] |= 1 << position
+        
+        # Content each knowledge component is needed for, and the content that
+        # stays locked while the component isn't mastered
+        kc_content = {}
+        for content_id, kc_id in kc_rows:
+            if content_id in positions:
+                kc_content[kc_id] = kc_content.get(kc_id, 0) | (1 << positions[content_id])
+        kc_blocks = {}
+        for kc_id, content_bits in kc_content.items():
+            blocked = 0
+            for position in bitmap_positions(content_bits):
+                blocked |= dependents[position]
+            kc_blocks[kc_id] = blocked
+        
+        graph = {
+            'ids': ids,
+            'positions': positions,
+            'order': order,
+            'ranks': {content_id: rank for rank, content_id in enumerate(order)},
+            'direct': direct,
+            'closure': closure,
+            'kc_content': kc_content,
+            'kc_blocks': kc_blocks,
+            'all': (1 << len(ids)) - 1,
+            'cyclic': cyclic
+        }
+        
+        with self._lock:
+            self._graph = graph
+            self._loaded_at = time.monotonic()
+        
+        logger.info(f"Built prerequisite graph for {len(ids)} content items")
+    
+    def invalidate(self):
+        """Mark the graph stale so the next lookup rebuilds it (call after content edits)"""
+        with self._lock:
+            self._loaded_at = None
+    
+    def _current(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.max_age:
+            self.refresh()
+        return self._graph
+    
+    def snapshot(self):
+        """Current graph dictionary (a rebuild swaps in a new one, never mutates it)"""
+        return self._current()
+    
+    def topological_order(self):
+        """Every content ID, each after all of its prerequisites"""
+        return list(self._current()['order'])
+    
+    def all_prerequisites(self, content_id):
+        """Transitive prerequisites of a content item, in topological order"""
+        graph = self._current()
+        position = graph['positions'].get(content_id)
+        if position is None:
+            return []
+        ids = graph['ids']
+        return sorted((ids[required] for required in bitmap_positions(graph['closure'][position])),
+                      key=graph['ranks'].__getitem__)
+    
+    def would_create_cycle(self, content_id, prerequisite_ids):
+        """Whether giving content_id these prerequisites would close a cycle"""
+        graph = self._current()
+        position = graph['positions'].get(content_id)
+        if position is None:
+            return False
+        for prerequisite in prerequisite_ids:
+            required = graph['positions'].get(prerequisite)
+            if prerequisite == content_id or (required is not None and graph['closure'][required] >> position & 1):
+                return True
+        return False
+    
+    def _mastered_bits(self, graph, mastery_levels, threshold):
+        """Content whose every knowledge component is mastered (content without components counts)"""
+        not_mastered = 0
+        for kc_id, content_bits in graph['kc_content'].items():
+            if mastery_levels.get(kc_id, 0.0) < threshold:
+                not_mastered |= content_bits
+        return graph['all'] & ~not_mastered
+    
+    def mastered_content(self, mastery_levels, threshold=MASTERY_THRESHOLD):
+        """
+        Content a user has learned
+        
+        Args:
+            mastery_levels: {kc_id: mastery} of the user
+            threshold: Mastery needed in each knowledge component
+            
+        Returns:
+            Set of content IDs
+        """
+        graph = self._current()
+        return {graph['ids'][position] for position in bitmap_positions(self._mastered_bits(graph, mastery_levels, threshold))}
+    
+    def unlocked_content(self, mastery_levels, threshold=MASTERY_THRESHOLD, include_mastered=False):
+        """
+        Content whose direct prerequisites a user has all mastered
+        
+        Args:
+            mastery_levels: {kc_id: mastery} of the user
+            threshold: Mastery needed in each knowledge component
+            include_mastered: Also return content the user has already mastered
+            
+        Returns:
+            List of content IDs in topological order
+        """
+        graph = self._current()
+        
+        # Content stays locked while any component of any prerequisite isn't mastered
+        blocked = 0
+        for kc_id, blocks in graph['kc_blocks'].items():
+            if mastery_levels.get(kc_id, 0.0) < threshold:
+                blocked |= blocks
+        unlocked = graph['all'] & ~blocked
+        
+        if not include_mastered:
+            unlocked &= ~self._mastered_bits(graph, mastery_levels, threshold)
+        
+        positions = graph['positions']
+        return [content_id for content_id in graph['order'] if unlocked >> positions[content_id] & 1]
+    
+    def is_unlocked(self, content_id, mastery_levels, threshold=MASTERY_THRESHOLD):
+        """Whether a user has mastered every direct prerequisite of a content item"""
+        graph = self._current()
+        position = graph['positions'].get(content_id)
+        if position is None:
+            return False
+        return not graph['direct'][position] & ~self._mastered_bits(graph, mastery_levels, threshold)
+
+# Shared by every module in the process
+prerequisite_graph = PrerequisiteGraph()
+
+def invalidate_prerequisite_graph():
+    """Rebuild the graph on next use (call after editing prerequisites or content)"""
+    prerequisite_graph.invalidate()
@@ -0,0 +1,75 @@
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Shared AI components: name -> (module path, class name).
+# The modules are only imported (and the class instantiated) on first use, so
+# workers don't pay for sklearn/nltk/matplotlib until a request needs them.
+COMPONENTS = {
+    'predictive_analytics': ('modules.predictive_analytics', 'PredictiveAnalytics'),
+    'content_recommendation': ('modules.content_recommendation', 'ContentRecommendation'),
+    'learning_style_detection': ('modules.learning_style_detection', 'LearningStyleDetection'),
+}
+
+_instances = {}
+_lock = threading.Lock()
+
+def get_component(name):
+    """
+    Get the process-wide shared instance of an AI component, creating it on first use.
+    
+    Args:
+        name: One of the keys of COMPONENTS
+        
+    Returns:
+        The shared component instance
+    """
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    
+    with _lock:
+        instance = _instances.get(name)
+        if instance is None:
+            module_path, class_name = COMPONENTS[name]
+            component_class = getattr(importlib.import_module(module_path), class_name)
+            instance = component_class()
+            _instances[name] = instance
+            logger.info(f"Initialized shared component: {name}")
+    
+    return instance
+
+def get_predictive_analytics():
+    """Get the shared PredictiveAnalytics instance"""
+    return get_component('predictive_analytics')
+
+def get_content_recommendation():
+    """Get the shared ContentRecommendation instance"""
+    return get_component('content_recommendation')
+
+def get_learning_style_detection():
+    """Get the shared LearningStyleDetection instance"""
+    return get_component('learning_style_detection')
+
+class LazyComponent:
+    """
+    Facade for a shared component that defers the import and construction
+    of the real object until one of its attributes is first accessed.
+    """
+    
+    def __init__(self, name):
+        """Initialize the facade with the registry name of the component"""
+        self._name = name
+    
+    def __getattr__(self, attr):
+        return getattr(get_component(self._name), attr)
+    
+    def __repr__(self):
+        return f"<LazyComponent {self._name}>"
+
+# Module-level facades used by app.py and the ai_api blueprint
+predictive_analytics = LazyComponent('predictive_analytics')
+content_recommendation = LazyComponent('content_recommendation')
+learning_style_detection = LazyComponent('learning_style_detection')
@@ -1,10 +1,12 @@
-import sqlite3
 from datetime import datetime
 import json
 import logging
 import os
 import numpy as np
-from sklearn.cluster import KMeans
+from modules.db import get_connection
+from modules.learning_paths import learning_path_index
+from modules.memo import invalidate_request_memo
+from modules.knowledge_tracing import get_engine
 
 logger = logging.getLogger(__name__)
 
@@ -17,12 +19,12 @@ class UserProfile:
     def __init__(self):
         """Initialize UserProfile with database connection"""
         self.db_path = 'database/adaptive_learning.db'
+        # Mastery model used for assessment updates (see modules.knowledge_tracing)
+        self.knowledge_engine = get_engine()
     
     def get_db_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get a pooled database connection (close() returns it to the pool)"""
+        return get_connection(self.db_path)
     
     def initialize_user(self, user_id):
         """Initialize a new user's profile with default knowledge states"""
@@ -33,12 +35,18 @@ class UserProfile:
             'SELECT id FROM knowledge_components'
         ).fetchall()
         
-        # Initialize user knowledge state for each component
-        for kc in knowledge_components:
-            conn.execute(
-                'INSERT INTO user_knowledge_state (user_id, knowledge_component_id, mastery_level) VALUES (?, ?, ?)',
-                (user_id, kc['id'], 0.0)
-            )
+        # Initialize user knowledge state for each component (keeping any existing state).
+        # last_updated is set here rather than by the CURRENT_TIMESTAMP default (UTC),
+        # so it's in the same local clock as later updates and learning_plans.planned_at
+        timestamp = datetime.now()
+        conn.executemany(
+            '''
+            INSERT INTO user_knowledge_state (user_id, knowledge_component_id, mastery_level, last_updated)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, knowledge_component_id) DO NOTHING
+            ''',
+            [(user_id, kc['id'], 0.0, timestamp) for kc in knowledge_components]
+        )
         
         # Initialize user with the default learning path
         default_path = conn.execute(
@@ -56,8 +64,15 @@ class UserProfile:
         
         logger.info(f"Initialized user profile for user ID: {user_id}")
     
-    def get_profile(self, user_id):
-        """Get user profile data including knowledge state"""
+    def get_profile(self, user_id, include_learning_style=True):
+        """
+        Get user profile data including knowledge state
+        
+        Args:
+            user_id: ID of the user
+            include_learning_style: Whether to run the (clustering based) learning style
+                detection; callers that replace it with the AI style can skip it
+        """
         conn = self.get_db_connection()
         
         # Get user basic info
@@ -89,7 +104,7 @@ class UserProfile:
         ).fetchone()
         
         # Get learning style (if any)
-        learning_style = self._determine_learning_style(user_id)
+        learning_style = self._determine_learning_style(user_id) if include_learning_style else None
         
         conn.close()
         
@@ -124,63 +139,68 @@ class UserProfile:
         else:
             questions_results = assessment_results
         
-        for kc_map in kc_mappings:
-            kc_id = kc_map['knowledge_component_id']
-            weight = kc_map['relevance_weight']
+        weights = {kc_map['knowledge_component_id']: kc_map['relevance_weight'] for kc_map in kc_mappings}
+        
+        # Collect (knowledge component, score) observations in answer order
+        observations = []
+        for r in questions_results:
+            # Handle both dictionary and object access
+            if isinstance(r, dict) and 'knowledge_component_id' in r:
+                kc_id = r['knowledge_component_id']
+                # Default to 0.5 if no score available
+                score = r['score'] if 'score' in r else 0.5
+            elif hasattr(r, 'knowledge_component_id'):
+                kc_id = r.knowledge_component_id
+                score = getattr(r, 'score', 0.5)
+            else:
+                continue
+            
+            if kc_id in weights:
+                observations.append((kc_id, score))
+        
+        kc_ids = list(dict.fromkeys(kc_id for kc_id, _ in observations))
+        
+        if kc_ids:
+            # Take the write lock before reading so concurrent submissions update
+            # mastery one after another rather than from the same stale value
+            conn.execute('BEGIN IMMEDIATE')
             
-            # Get the current mastery level
-            current_mastery = conn.execute(
-                'SELECT mastery_level FROM user_knowledge_state WHERE user_id = ? AND knowledge_component_id = ?',
-                (user_id, kc_id)
-            ).fetchone()['mastery_level']
+            placeholders = ','.join('?' * len(kc_ids))
+            states = conn.execute(
+                f'''
+                SELECT knowledge_component_id, mastery_level
+                FROM user_knowledge_state
+                WHERE user_id = ? AND knowledge_component_id IN ({placeholders})
+                ''',
+                (user_id, *kc_ids)
+            ).fetchall()
             
-            # Check if there are assessment results for this knowledge component
-            kc_results = []
+            current = {state['knowledge_component_id']: state['mastery_level'] for state in states}
             
-            # Safely extract results for this knowledge component
-            for r in questions_results:
-                # Handle both dictionary and object access
-                if isinstance(r, dict) and 'knowledge_component_id' in r:
-                    if r['knowledge_component_id'] == kc_id:
-                        kc_results.append(r)
-                elif hasattr(r, 'knowledge_component_id'):
-                    if r.knowledge_component_id == kc_id:
-                        kc_results.append(r)
+            # Components the user has no state for yet start from the engine's prior
+            engine = self.knowledge_engine
+            # Pick up parameters fitted since the engine was loaded
+            engine.refresh_parameters()
+            initial = engine.initial_mastery(engine.params_for(kc_ids), len(kc_ids))
+            prior = [current.get(kc_id, initial[i]) for i, kc_id in enumerate(kc_ids)]
             
-            if kc_results:
-                # Calculate average score for this knowledge component
-                # Safely extract scores
-                total_score = 0
-                for r in kc_results:
-                    if isinstance(r, dict) and 'score' in r:
-                        total_score += r['score']
-                    elif hasattr(r, 'score'):
-                        total_score += r.score
-                    else:
-                        # Default to 0.5 if no score available
-                        total_score += 0.5
-                
-                avg_score = total_score / len(kc_results)
-                
-                # Update knowledge state with a learning rate factor
-                learning_rate = 0.1
-                new_mastery = current_mastery + learning_rate * weight * (avg_score - current_mastery)
-                
-                # Ensure mastery is between 0 and 1
-                new_mastery = max(0.0, min(1.0, new_mastery))
-                
-                # Update the database
-                conn.execute(
-                    '''
-                    UPDATE user_knowledge_state
-                    SET mastery_level = ?, last_updated = ?
-                    WHERE user_id = ? AND knowledge_component_id = ?
-                    ''',
-                    (new_mastery, datetime.now(), user_id, kc_id)
-                )
+            mastery = engine.update(kc_ids, prior, observations, weights)
+            
+            timestamp = datetime.now()
+            conn.executemany(
+                '''
+                INSERT INTO user_knowledge_state (user_id, knowledge_component_id, mastery_level, last_updated)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, knowledge_component_id) DO UPDATE SET
+                    mastery_level = excluded.mastery_level,
+                    last_updated = excluded.last_updated
+                ''',
+                [(user_id, kc_id, float(level), timestamp) for kc_id, level in zip(kc_ids, mastery)]
+            )
         
         conn.commit()
         conn.close()
+        invalidate_request_memo()
         
         logger.info(f"Updated knowledge state for user ID: {user_id}")
     
@@ -200,6 +220,7 @@ class UserProfile:
         
         conn.commit()
         conn.close()
+        invalidate_request_memo()
     
     def get_progress_metrics(self, user_id):
         """Get progress metrics for the user"""
@@ -212,17 +233,15 @@ class UserProfile:
         ).fetchall()
         
         # Get learning path progress
-        learning_path = conn.execute(
+        user_paths = conn.execute(
             '''
-            SELECT lp.id, lp.name, ulp.current_position, COUNT(lpi.id) as total_items
-            FROM user_learning_paths ulp
-            JOIN learning_paths lp ON ulp.learning_path_id = lp.id
-            JOIN learning_path_items lpi ON lp.id = lpi.learning_path_id
-            WHERE ulp.user_id = ?
-            GROUP BY lp.id
+            SELECT learning_path_id, current_position
+            FROM user_learning_paths
+            WHERE user_id = ?
+            ORDER BY learning_path_id
             ''',
             (user_id,)
-        ).fetchone()
+        ).fetchall()
         
         # Get assessment performance
         assessment_performance = conn.execute(
@@ -254,9 +273,11 @@ class UserProfile:
         
         # Calculate path completion percentage
         path_completion = 0
-        if learning_path:
-            if learning_path['total_items'] > 0:
-                path_completion = (learning_path['current_position'] / learning_path['total_items']) * 100
+        for user_path in user_paths:
+            total_items = learning_path_index.total_items(user_path['learning_path_id'])
+            if total_items > 0:
+                path_completion = (user_path['current_position'] / total_items) * 100
+                break
         
         # Calculate assessment accuracy
         assessment_accuracy = 0
@@ -327,6 +348,8 @@ class UserProfile:
         
         # Simple clustering to determine style (in a real system, use more sophisticated methods)
         try:
+            from sklearn.cluster import KMeans
+            
             features_array = np.array(features)
             kmeans = KMeans(n_clusters=3, random_state=0).fit(features_array)
             cluster = kmeans.predict([np.mean(features_array, axis=0)])[0]
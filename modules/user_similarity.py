@@ -0,0 +1,265 @@
+import argparse
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+
+from modules.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Neighbours stored per user
+DEFAULT_NEIGHBOURS = 20
+
+# Similarities computed at once: block_users x all users
+BLOCK_CELLS = 5000000
+
+def load_mastery_vectors(conn):
+    """
+    Build the dense user x knowledge component mastery matrix
+    
+    Returns:
+        Tuple of (user IDs, L2-normalized float32 matrix); users whose mastery
+        is all zero have an all-zero row
+    """
+    rows = np.array(
+        conn.execute('SELECT user_id, knowledge_component_id, mastery_level FROM user_knowledge_state').fetchall(),
+        dtype=np.float64
+    ).reshape(-1, 3)
+    
+    user_ids, user_rows = np.unique(rows[:, 0].astype(np.int64), return_inverse=True)
+    _, kc_cols = np.unique(rows[:, 1].astype(np.int64), return_inverse=True)
+    
+    vectors = np.zeros((len(user_ids), int(kc_cols.max(initial=-1)) + 1), dtype=np.float32)
+    vectors[user_rows, kc_cols] = np.nan_to_num(rows[:, 2])
+    
+    norms = np.linalg.norm(vectors, axis=1)
+    np.divide(vectors, norms[:, None], out=vectors, where=norms[:, None] > 0)
+    return user_ids, vectors
+
+def _blocks(count, other_count):
+    size = max(1, BLOCK_CELLS // max(other_count, 1))
+    for start in range(0, count, size):
+        yield start, min(start + size, count)
+
+def _nearest(vectors, query_rows, k):
+    """
+    Cosine k nearest neighbours of some users among all users, in blocks
+    
+    Yields:
+        (row, neighbour rows, similarities) for each query row, best first
+    """
+    # Users with no mastery at all have no direction, so they are nobody's neighbour
+    valid = vectors.any(axis=1)
+    
+    for start, end in _blocks(len(query_rows), len(vectors)):
+        rows = query_rows[start:end]
+        similarities = vectors[rows] @ vectors.T
+        similarities[:, ~valid] = -np.inf
+        similarities[np.arange(len(rows)), rows] = -np.inf
+        
+        count = min(k, len(vectors) - 1)
+        if count <= 0:
+            for row in rows:
+                yield row, np.empty(0, dtype=np.int64), np.empty(0)
+            continue
+        
+        top = np.argpartition(-similarities, count - 1, axis=1)[:, :count]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_similarities = np.take_along_axis(top_similarities, order, axis=1)
+        
+        for i, row in enumerate(rows):
+            keep = np.isfinite(top_similarities[i]) & valid[row]
+            yield row, top[i][keep], top_similarities[i][keep]
+
+def _changed_users(conn, user_ids, vectors, k):
+    """
+    Users whose stored neighbour list may be out of date: their own state
+    changed (or they are new), a user in their list changed or disappeared, or
+    a changed user is now more similar than their k-th neighbour.
+    
+    Returns:
+        Tuple of (array of matrix rows to recompute, list of vanished user IDs)
+    """
+    computed = {
+        row['user_id']: (row['computed_at'], row['kth_similarity'])
+        for row in conn.execute('SELECT user_id, computed_at, kth_similarity FROM user_neighbour_state')
+    }
+    last_updated = dict(conn.execute(
+        'SELECT user_id, MAX(last_updated) FROM user_knowledge_state GROUP BY user_id'
+    ).fetchall())
+    
+    position = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+    vanished = [user_id for user_id in computed if user_id not in position]
+    
+    changed = [
+        user_id for user_id in position
+        if user_id not in computed
+        or (last_updated.get(user_id) is not None and str(last_updated[user_id]) > str(computed[user_id][0]))
+    ]
+    if not changed and not vanished:
+        return np.empty(0, dtype=np.int64), vanished
+    
+    stale = set(changed)
+    
+    # Users listing a changed or vanished user as a neighbour
+    moved = changed + vanished
+    for start in range(0, len(moved), 500):
+        chunk = moved[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        stale.update(row[0] for row in conn.execute(
+            f'SELECT DISTINCT user_id FROM user_neighbours WHERE neighbour_id IN ({placeholders})', chunk
+        ))
+    
+    # Users for whom a changed user now beats their current k-th neighbour
+    changed_rows = np.array([position[user_id] for user_id in changed], dtype=np.int64)
+    if len(changed_rows):
+        thresholds = np.array([
+            computed[user_id][1] if user_id in computed and computed[user_id][1] is not None else -np.inf
+            for user_id in user_ids.tolist()
+        ], dtype=np.float32)
+        changed_vectors = vectors[changed_rows]
+        for start, end in _blocks(len(vectors), len(changed_rows)):
+            similarities = vectors[start:end] @ changed_vectors.T
+            # Self-similarity doesn't count
+            own = (changed_rows >= start) & (changed_rows < end)
+            similarities[changed_rows[own] - start, np.flatnonzero(own)] = -np.inf
+            best = similarities.max(axis=1, initial=-np.inf)
+            has_direction = vectors[start:end].any(axis=1)
+            entering = (best > thresholds[start:end]) & has_direction & np.isfinite(best)
+            stale.update(user_ids[start:end][entering].tolist())
+    
+    rows = np.array(sorted(position[user_id] for user_id in stale if user_id in position), dtype=np.int64)
+    return rows, vanished
+
+def build_neighbours(db_path='database/adaptive_learning.db', k=DEFAULT_NEIGHBOURS, full=False):
+    """
+    Compute each user's k most similar users (cosine similarity of mastery
+    vectors) and store them in user_neighbours. Unless full is set, only the
+    users whose list can have changed since the last run are recomputed.
+    
+    Args:
+        db_path: Path to the SQLite database
+        k: Neighbours stored per user
+        full: Recompute every user
+        
+    Returns:
+        Number of users whose neighbour list was recomputed
+    """
+    start = time.perf_counter()
+    conn = get_connection(db_path)
+    try:
+        # Timestamp taken before reading, so updates made during the run are
+        # picked up by the next one
+        computed_at = datetime.now()
+        user_ids, vectors = load_mastery_vectors(conn)
+        
+        if full:
+            rows, vanished = np.arange(len(user_ids)), []
+            conn.execute('DELETE FROM user_neighbours')
+            conn.execute('DELETE FROM user_neighbour_state')
+        else:
+            rows, vanished = _changed_users(conn, user_ids, vectors, k)
+        
+        if vanished:
+            for offset in range(0, len(vanished), 500):
+                chunk = vanished[offset:offset + 500]
+                placeholders = ','.join('?' * len(chunk))
+                conn.execute(f'DELETE FROM user_neighbours WHERE user_id IN ({placeholders})', chunk)
+                conn.execute(f'DELETE FROM user_neighbour_state WHERE user_id IN ({placeholders})', chunk)
+        
+        neighbour_rows = []
+        state_rows = []
+        for row, neighbours, similarities in _nearest(vectors, rows, k):
+            user_id = int(user_ids[row])
+            neighbour_rows.extend(
+                (user_id, rank, int(user_ids[neighbour]), float(similarity))
+                for rank, (neighbour, similarity) in enumerate(zip(neighbours, similarities), start=1)
+            )
+            # A list shorter than k can take any user with a direction
+            kth_similarity = float(similarities[-1]) if len(similarities) >= k else None
+            state_rows.append((user_id, computed_at, kth_similarity))
+            
+            if len(state_rows) >= 1000:
+                _write_neighbours(conn, neighbour_rows, state_rows)
+                neighbour_rows, state_rows = [], []
+        
+        _write_neighbours(conn, neighbour_rows, state_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    logger.info(f"Recomputed neighbours for {len(rows)} of {len(user_ids)} users "
+                f"in {time.perf_counter() - start:.1f}s")
+    return len(rows)
+
+def _write_neighbours(conn, neighbour_rows, state_rows):
+    if not state_rows:
+        return
+    user_ids = [(user_id,) for user_id, _, _ in state_rows]
+    conn.executemany('DELETE FROM user_neighbours WHERE user_id = ?', user_ids)
+    conn.executemany(
+        'INSERT INTO user_neighbours (user_id, rank, neighbour_id, similarity) VALUES (?, ?, ?, ?)',
+        neighbour_rows
+    )
+    conn.executemany(
+        '''
+        INSERT INTO user_neighbour_state (user_id, computed_at, kth_similarity)
+        VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            computed_at = excluded.computed_at,
+            kth_similarity = excluded.kth_similarity
+        ''',
+        state_rows
+    )
+
+def get_neighbours(conn, user_id, limit=5):
+    """
+    Stored nearest neighbours of a user
+    
+    Args:
+        conn: Open database connection
+        user_id: ID of the user
+        limit: Maximum number of neighbours
+        
+    Returns:
+        List of neighbour user IDs, most similar first, or None if the user's
+        neighbours haven't been computed yet (or the tables don't exist)
+    """
+    try:
+        neighbours = conn.execute(
+            '''
+            SELECT neighbour_id
+            FROM user_neighbours
+            WHERE user_id = ?
+            ORDER BY rank
+            LIMIT ?
+            ''',
+            (user_id, limit)
+        ).fetchall()
+        
+        if neighbours:
+            return [row['neighbour_id'] for row in neighbours]
+        
+        computed = conn.execute('SELECT 1 FROM user_neighbour_state WHERE user_id = ?', (user_id,)).fetchone()
+    except sqlite3.OperationalError as e:
+        # Schema not updated yet (run database/update_db.py)
+        logger.warning(f"No stored neighbours for user {user_id}: {e}")
+        return None
+    return [] if computed else None
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Refresh per-user nearest neighbours from knowledge states')
+    parser.add_argument('--neighbours', type=int, default=DEFAULT_NEIGHBOURS, help='neighbours stored per user')
+    parser.add_argument('--full', action='store_true', help='recompute every user instead of only changed ones')
+    args = parser.parse_args()
+    
+    build_neighbours(k=args.neighbours, full=args.full)
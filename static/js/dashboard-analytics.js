@@ -7,16 +7,22 @@ document.addEventListener("DOMContentLoaded", function () {
   const dashboardContainer = document.querySelector(".dashboard-container");
   if (!dashboardContainer) return;
 
+  // All AI panels come from one request so the server extracts features once
+  const bundle = fetch("/api/dashboard/bundle").then((response) => {
+    if (!response.ok) throw new Error(`Bundle request failed: ${response.status}`);
+    return response.json();
+  });
+
   // Initialize analytics components
-  initPerformancePrediction();
-  initLearningStyleViz();
-  initEngagementTracking();
+  initPerformancePrediction(bundle);
+  initLearningStyleViz(bundle);
+  initEngagementTracking(bundle);
 });
 
 /**
  * Initialize the performance prediction visualization
  */
-function initPerformancePrediction() {
+function initPerformancePrediction(bundle) {
   // Create container if it doesn't exist
   let container = document.getElementById("performance-prediction");
   if (!container) {
@@ -41,9 +47,9 @@ function initPerformancePrediction() {
     progressSection.appendChild(container);
   }
 
-  // Fetch prediction data
-  fetch("/api/ai/predict/performance")
-    .then((response) => response.json())
+  // Render the prediction panel of the dashboard bundle
+  bundle
+    .then((data) => data.performance)
     .then((data) => {
       if (data.error) {
         container.querySelector(".prediction-content").innerHTML = `
@@ -109,7 +115,7 @@ function getActionMessage(score) {
 /**
  * Initialize the learning style visualization
  */
-function initLearningStyleViz() {
+function initLearningStyleViz(bundle) {
   // Create container if it doesn't exist
   let container = document.getElementById("learning-style-viz");
   if (!container) {
@@ -134,11 +140,11 @@ function initLearningStyleViz() {
     learningSection.appendChild(container);
   }
 
-  // Fetch learning style data
-  fetch("/api/ai/user/learning-style")
-    .then((response) => response.json())
+  // Render the learning style panel of the dashboard bundle
+  bundle
     .then((data) => {
-      if (!data.enough_data) {
+      const style = data.learning_style;
+      if (!style.enough_data) {
         container.querySelector(".learning-style-content").innerHTML = `
                     <div class="style-not-enough-data">
                         <p>We're still learning about your learning style preferences.</p>
@@ -148,31 +154,23 @@ function initLearningStyleViz() {
         return;
       }
 
-      // Fetch visualization
-      return fetch("/api/ai/user/learning-style/visualization")
-        .then((response) => response.json())
-        .then((vizData) => {
-          // Update content
-          container.querySelector(".learning-style-content").innerHTML = `
-                        <div class="style-info">
-                            <h5>${capitalizeFirstLetter(
-                              data.style
-                            )} Learner</h5>
-                            <p>${data.description}</p>
-                        </div>
-                        <div class="style-visualization">
-                            <img src="${
-                              vizData.visualization
-                            }" alt="Learning Style Visualization">
-                        </div>
-                        <div class="style-tips">
-                            <h5>Personalization Tips</h5>
-                            <p>Based on your learning style, we'll emphasize ${getStyleEmphasis(
-                              data.style
-                            )} in your learning materials.</p>
-                        </div>
-                    `;
-        });
+      // The chart is a cacheable image (ETag/Cache-Control), so the browser
+      // can reuse it across dashboard loads instead of re-fetching base64 JSON
+      container.querySelector(".learning-style-content").innerHTML = `
+                    <div class="style-info">
+                        <h5>${capitalizeFirstLetter(style.style)} Learner</h5>
+                        <p>${style.description}</p>
+                    </div>
+                    <div class="style-visualization">
+                        <img src="${data.learning_style_visualization}" alt="Learning Style Visualization">
+                    </div>
+                    <div class="style-tips">
+                        <h5>Personalization Tips</h5>
+                        <p>Based on your learning style, we'll emphasize ${getStyleEmphasis(
+                          style.style
+                        )} in your learning materials.</p>
+                    </div>
+                `;
     })
     .catch((error) => {
       console.error("Error fetching learning style:", error);
@@ -205,7 +203,7 @@ function getStyleEmphasis(style) {
 /**
  * Initialize the engagement tracking component
  */
-function initEngagementTracking() {
+function initEngagementTracking(bundle) {
   // Create container if it doesn't exist
   let container = document.getElementById("engagement-tracking");
   if (!container) {
@@ -230,9 +228,9 @@ function initEngagementTracking() {
     recsSection.insertBefore(container, recsSection.firstChild.nextSibling);
   }
 
-  // Fetch engagement data
-  fetch("/api/ai/predict/disengagement")
-    .then((response) => response.json())
+  // Render the engagement panel of the dashboard bundle
+  bundle
+    .then((data) => data.disengagement)
     .then((data) => {
       if (data.error) {
         container.querySelector(".engagement-content").innerHTML = `